@@ -1,149 +1,376 @@
-from fastapi import APIRouter, Request, HTTPException, Query
+from fastapi import APIRouter, Depends, Request, HTTPException, Query, Response
 import datetime
-import os
+import json
 from bson import ObjectId
+from decouple import config
 from fastapi.encoders import jsonable_encoder
-from typing import Optional  # <-- added
+from fastapi.responses import StreamingResponse
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+from typing import Optional, List, Dict, Any  # <-- added
 
-from models.attendance_schema import RfidTapResponse, AttendanceRecordsResponse, StudentSummarySchema
+from core.student_directory import student_directory
+from core.schedule_index import schedule_index
+from core.tap_stream import tap_broadcaster
+from core.tap_debounce import tap_debouncer
+from models.attendance_schema import (
+    AttendanceResponse,
+    AttendanceRecordsResponse,
+    TapEventIn,
+    TapEventResult,
+    TapBatchResponse,
+)
 
 from .attendance_utils import (
-    get_mongo_client,
-    ensure_mongo_available,
-    now_iso_z,
+    get_mongo_db,
     parse_iso,
-    duration_seconds,
-    format_short_duration,
     to_iso_z,
     ensure_dt,
     student_canonical_id,
     build_attendance_filter,
-    recompute_flags_and_update,
-    insert_or_update_log,
-    handle_attendance_record,
+    register_late_and_convert,
+    log_event,
+    tap_journal,
+    publish_tap,
+    class_closer,
+    build_tap_update,
+    apply_tap,
+    tap_action,
+    is_first_tap,
+    tap_state,
+    last_tap_at,
+    LATE_GRACE_MINUTES,
+    rollup_sync,
+    records_query,
+    SUBJECT_MATCH_MODES,
 )
 
 router = APIRouter()
-DB_NAME = "attendance_system"
 COL_NAME = "subject_attendance"
+RFID_BATCH_MAX_EVENTS = config("RFID_BATCH_MAX_EVENTS", default=10000, cast=int)
+RECORDS_PAGE_SIZE = config("RECORDS_PAGE_SIZE", default=1000, cast=int)
+RECORDS_MAX_PAGE_SIZE = config("RECORDS_MAX_PAGE_SIZE", default=5000, cast=int)
+TAP_STREAM_KEEPALIVE_SECONDS = config("TAP_STREAM_KEEPALIVE_SECONDS", default=15, cast=float)
+TAP_EVENTS_PAGE_SIZE = config("TAP_EVENTS_PAGE_SIZE", default=1000, cast=int)
+TAP_EVENTS_MAX_PAGE_SIZE = config("TAP_EVENTS_MAX_PAGE_SIZE", default=10000, cast=int)
 
 @router.post("/rfid")
-async def rfid_tap(rfid_uid: str = Query(..., description="RFID UID"), request: Request = None):
+async def rfid_tap(rfid_uid: str = Query(..., description="RFID UID"), request: Request = None, response: Response = None, db=Depends(get_mongo_db)):
     """
     Tap handler:
-    - find student by rfid_uid
-    - find current schedule for student's section
-    - upsert one subject_attendance record per student+subject+lesson_date
+    - repeated reads of the same card within RFID_DEBOUNCE_SECONDS return the first read's result
+      without touching the database (X-Tap-Duplicate: 1 header)
+    - find student by rfid_uid (in-process directory, falls back to the database)
+    - find current schedule for student's section (compiled schedule index, no DB access)
+    - upsert one subject_attendance record per student+subject+lesson_date in a single atomic update
     - 1st tap -> set time_in
     - 2nd tap -> set time_out
     - 3rd tap -> create break from previous time_out -> now and clear time_out (student inside)
     Break durations computed and stored as duration_seconds and duration (short string). Uses student's student_id_no if present, else uses string(_id).
     """
-    client = get_mongo_client(request)
-    ensure_mongo_available(client, request)
-    db = client[DB_NAME]
-    students_col = db["students"]
-    schedules_col = db["class_schedules"]
+    result, duplicate = await tap_debouncer.run(rfid_uid, lambda: _apply_rfid_tap(db, rfid_uid))
+    if duplicate:
+        response.headers["X-Tap-Duplicate"] = "1"
+    return result
+
+async def _apply_rfid_tap(db, rfid_uid: str) -> Dict[str, Any]:
     att_col = db[COL_NAME]
 
-    student = students_col.find_one({"rfid_uid": rfid_uid})
+    student = await student_directory.get_by_rfid(db, rfid_uid)
     if not student:
         raise HTTPException(status_code=404, detail="RFID not found")
 
     now_dt = datetime.datetime.now(datetime.timezone.utc)
-    weekday_short = now_dt.strftime("%a")
     section = student.get("section")
-    
-    sched_filt = {"section": section, "day": weekday_short}
-    schedules_from_db = schedules_col.find(sched_filt)
-
-    active_schedule = None
-    
-    for schedule_doc in schedules_from_db:
-        start_time_from_db = schedule_doc.get("start_time")
-        end_time_from_db = schedule_doc.get("end_time")
-
-        if isinstance(start_time_from_db, datetime.datetime) and isinstance(end_time_from_db, datetime.datetime):
-            
-            # --- THE DEFINITIVE FIX IS HERE ---
-
-            # 1. Extract just the TIME component from the schedule's stored datetime.
-            schedule_start_time = start_time_from_db.time()
-            schedule_end_time = end_time_from_db.time()
-            
-            # 2. Get TODAY's DATE component from the current time.
-            today_date_utc = now_dt.date()
-            
-            # 3. Combine TODAY's DATE with the schedule's TIME to create a comparable datetime.
-            start_dt_today = datetime.datetime.combine(today_date_utc, schedule_start_time)
-            end_dt_today = datetime.datetime.combine(today_date_utc, schedule_end_time)
-
-            # 4. Make these new datetimes timezone-aware (they are in UTC).
-            start_dt_today_aware = start_dt_today.replace(tzinfo=datetime.timezone.utc)
-            end_dt_today_aware = end_dt_today.replace(tzinfo=datetime.timezone.utc)
-            
-            # 5. Handle potential overnight classes (where end time is on the next day).
-            if end_dt_today_aware < start_dt_today_aware:
-                end_dt_today_aware += datetime.timedelta(days=1)
-
-            # 6. Now we are comparing apples to apples: today's time vs. today's schedule.
-            if start_dt_today_aware <= now_dt < end_dt_today_aware:
-                active_schedule = schedule_doc
-                break
-
-    if not active_schedule:
+
+    active_class = schedule_index.lookup(section, now_dt)
+    if not active_class:
         raise HTTPException(status_code=400, detail=f"No class is currently in session for section '{section}' at this time.")
 
-    # The rest of the function is correct and remains the same.
-    subject = active_schedule.get("subject")
-    start_time = active_schedule.get("start_time")
-    end_time = active_schedule.get("end_time")
+    subject = active_class.schedule.get("subject")
     lesson_date = now_dt.date().isoformat()
-    
+
     filt = build_attendance_filter(student, lesson_date, subject)
-    existing = att_col.find_one(filt)
-    now_iso = now_iso_z()
-    action = "tap_in" if not existing else ("tap_out" if existing.get("time_out") is None else "tap_in")
+    doc = await apply_tap(db, filt, build_tap_update(student, section, subject, now_dt, active_class.start, active_class.end))
+
+    action = tap_action(doc)
     student_id_str = student_canonical_id(student)
-    insert_or_update_log(db, student_id_str, student, section, lesson_date, now_iso, action)
-    handle_attendance_record(db, student, section, subject, lesson_date, now_dt, now_iso, start_time, end_time)
-    recompute_flags_and_update(db, filt, start_time, end_time, student, subject)
+    tap_journal.submit(log_event(student_id_str, student, section, lesson_date, to_iso_z(now_dt), action, "rfid", subject))
+
+    # a record can only become late on its first tap
+    if doc.get("late") and is_first_tap(doc, now_dt):
+        try:
+            if await register_late_and_convert(db, student, subject):
+                doc = await att_col.find_one(filt)
+        except Exception:
+            # don't let conversion failures break the main flow
+            pass
+    await rollup_sync.sync(db, [doc])
+    publish_tap(doc, action)
 
-    doc = att_col.find_one(filt)
     if doc and "_id" in doc:
         doc["_id"] = str(doc["_id"]) 
     return {"doc": doc}
 
+@router.post("/rfid/batch", response_model=TapBatchResponse)
+async def rfid_tap_batch(events: List[TapEventIn], request: Request, db=Depends(get_mongo_db)):
+    """
+    Replays taps buffered by a reader device while it was offline.
+    - events are matched to the class in session at their own tapped_at, not server time
+    - taps are applied per student+subject+lesson_date in timestamp order with the same state machine as /rfid
+    - events not newer than the last tap already stored on the record are reported as stale, so replaying a backlog twice is harmless
+    - events within RFID_DEBOUNCE_SECONDS of the previous tap of the same record are reported as duplicate
+    - all record updates go out in one ordered bulk_write
+    Results are returned per event, in request order.
+    """
+    if len(events) > RFID_BATCH_MAX_EVENTS:
+        raise HTTPException(status_code=400, detail=f"A batch can hold at most {RFID_BATCH_MAX_EVENTS} events.")
+
+    att_col = db[COL_NAME]
+
+    results = [
+        TapEventResult(index=i, rfid_uid=ev.rfid_uid, tapped_at=ensure_dt(ev.tapped_at), status="rejected")
+        for i, ev in enumerate(events)
+    ]
+    students = await student_directory.get_many_by_rfid(db, [ev.rfid_uid for ev in events])
+
+    # resolve student and class for every event
+    planned: List[Dict[str, Any]] = []
+    for i, ev in enumerate(events):
+        tapped_at = results[i].tapped_at
+        student = students.get(ev.rfid_uid)
+        if not student:
+            results[i].detail = "RFID not found"
+            continue
+        section = student.get("section")
+        active_class = schedule_index.lookup(section, tapped_at)
+        if not active_class:
+            results[i].detail = f"No class was in session for section '{section}' at this time."
+            continue
+        subject = active_class.schedule.get("subject")
+        lesson_date = tapped_at.date().isoformat()
+        try:
+            filt = build_attendance_filter(student, lesson_date, subject)
+        except ValueError as e:
+            results[i].detail = str(e)
+            continue
+        results[i].subject, results[i].lesson_date = subject, lesson_date
+        planned.append({
+            "index": i,
+            "student": student,
+            "section": section,
+            "class": active_class,
+            "filt": filt,
+            "key": (filt["student_id"], lesson_date, subject),
+            "tapped_at": tapped_at,
+            "device": ev.device_id or "rfid",
+        })
+
+    planned.sort(key=lambda p: (p["tapped_at"], p["index"]))
+
+    # current state of every touched record, to report actions and skip already-applied taps
+    existing: Dict[Any, Dict[str, Any]] = {}
+    filters = list({p["key"]: p["filt"] for p in planned}.values())
+    if filters:
+        async for doc in att_col.find({"$or": filters}):
+            existing[(doc.get("student_id"), doc.get("lesson_date"), doc.get("subject"))] = doc
+    state = {key: tap_state(doc) for key, doc in existing.items()}
+    last_seen = {key: last_tap_at(doc) for key, doc in existing.items()}
+
+    ops, applied = [], []
+    for p in planned:
+        key, tapped_at, res = p["key"], p["tapped_at"], results[p["index"]]
+        if last_seen.get(key) and tapped_at.replace(microsecond=0) <= last_seen[key]:
+            res.status, res.detail = "stale", "Tap is not newer than the record's last tap"
+            continue
+        if last_seen.get(key) and (tapped_at.replace(microsecond=0) - last_seen[key]).total_seconds() < tap_debouncer.window_seconds:
+            tap_debouncer.suppressed += 1
+            res.status, res.detail = "duplicate", "Repeated read within the debounce window"
+            continue
+        current = state.get(key, "new")
+        state[key] = "outside" if current == "inside" else "inside"
+        last_seen[key] = tapped_at.replace(microsecond=0)
+        p["action"] = "tap_out" if current == "inside" else "tap_in"
+        p["became_late"] = current == "new" and tapped_at.replace(microsecond=0) > p["class"].start + datetime.timedelta(minutes=LATE_GRACE_MINUTES)
+        ops.append(UpdateOne(
+            p["filt"],
+            build_tap_update(p["student"], p["section"], key[2], tapped_at, p["class"].start, p["class"].end, p["device"]),
+            upsert=True,
+        ))
+        applied.append(p)
+
+    failed_at = len(ops)
+    if ops:
+        try:
+            await att_col.bulk_write(ops, ordered=True)
+        except BulkWriteError as e:
+            write_errors = e.details.get("writeErrors") or [{}]
+            failed_at = write_errors[0].get("index", 0)
+            for p in applied[failed_at:]:
+                results[p["index"]].status = "failed"
+                results[p["index"]].detail = write_errors[0].get("errmsg", "Write failed")
+
+    for p in applied[:failed_at]:
+        res = results[p["index"]]
+        res.status, res.action = "applied", p["action"]
+        tap_journal.submit(log_event(
+            student_canonical_id(p["student"]), p["student"], p["section"], res.lesson_date,
+            to_iso_z(p["tapped_at"]), p["action"], p["device"], res.subject,
+        ))
+        if p["became_late"]:
+            try:
+                await register_late_and_convert(db, p["student"], res.subject)
+            except Exception:
+                pass
+
+    # read the records back only after late conversions, so rollups and streams see 'Absent'
+    touched_docs = []
+    if failed_at:
+        touched = list({p["key"]: p["filt"] for p in applied[:failed_at]}.values())
+        touched_docs = await att_col.find({"$or": touched}).to_list(None)
+        await rollup_sync.sync(db, touched_docs)
+
+    # one push per touched record, with the action of its last applied tap
+    last_action = {p["key"]: p["action"] for p in applied[:failed_at]}
+    for doc in touched_docs:
+        publish_tap(doc, last_action.get((doc.get("student_id"), doc.get("lesson_date"), doc.get("subject"))))
+
+    return {"applied": failed_at, "results": results}
+
+@router.get("/stream")
+async def attendance_stream(
+    request: Request,
+    section: str = Query(..., description="Section whose taps are pushed"),
+    subject: Optional[str] = Query(None, description="Only taps for this subject (exact)"),
+):
+    """
+    Live roster as server-sent events: one `tap` event per record change made by /rfid or
+    /rfid/batch, carrying the action and the record as stored. A comment line is sent every
+    TAP_STREAM_KEEPALIVE_SECONDS so proxies keep the connection open.
+    A client that falls behind loses its oldest pending events, never the newest.
+    """
+    subscription = tap_broadcaster.subscribe(section, subject)
+    if subscription is None:
+        raise HTTPException(status_code=503, detail="Too many live streams open, try again later.")
+
+    async def events():
+        try:
+            yield "retry: 3000\n\n"
+            while not await request.is_disconnected():
+                message = await subscription.get(TAP_STREAM_KEEPALIVE_SECONDS)
+                yield message if message is not None else ": keepalive\n\n"
+        finally:
+            tap_broadcaster.unsubscribe(subscription)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@router.get("/stream/stats")
+async def attendance_stream_stats():
+    """Open live streams and how many events were published, delivered and dropped."""
+    return tap_broadcaster.stats()
+
+@router.get("/journal/stats")
+async def tap_journal_stats():
+    """Queue depth, flush latency and dropped writes of the tap_events write-behind queue."""
+    return tap_journal.stats()
+
+@router.get("/events")
+async def get_tap_events(
+    student_id: Optional[str] = Query(None, description="Timeline of one student (student_id_no)"),
+    device: Optional[str] = Query(None, description="Taps read by one device"),
+    section: Optional[str] = Query(None, description="Taps of one section"),
+    start: Optional[str] = Query(None, description="ISO timestamp, inclusive"),
+    end: Optional[str] = Query(None, description="ISO timestamp, exclusive"),
+    limit: int = Query(TAP_EVENTS_PAGE_SIZE, ge=1, le=TAP_EVENTS_MAX_PAGE_SIZE),
+    db=Depends(get_mongo_db),
+):
+    """
+    Raw taps from the tap_events time-series collection, oldest first.
+    Needs one of student_id, device or section; narrowing by start/end keeps the scan to the
+    buckets of that time range.
+    """
+    if not (student_id or device or section):
+        raise HTTPException(status_code=400, detail="Provide student_id, device or section.")
+    query: Dict[str, Any] = {}
+    if student_id:
+        query["meta.student_id"] = student_id
+    if device:
+        query["meta.device"] = device
+    if section:
+        query["meta.section"] = section
+    at: Dict[str, Any] = {}
+    try:
+        if start:
+            at["$gte"] = parse_iso(start)
+        if end:
+            at["$lt"] = parse_iso(end)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="start/end must be ISO timestamps.")
+    if at:
+        query["at"] = at
+
+    docs = await db["tap_events"].find(query, {"_id": 0}).sort("at", 1).limit(limit).to_list(limit)
+    return {"count": len(docs), "events": jsonable_encoder(docs)}
+
+@router.get("/closer/stats")
+async def class_closer_stats():
+    """How far end-of-class absence marking has got, and how many classes and records it produced."""
+    return class_closer.stats()
+
 @router.get("/records", response_model=AttendanceRecordsResponse)
 async def get_attendance_records(
     request: Request,
     student_id: Optional[str] = Query(None, description="Filter by student_id"),  # <-- optional
     subject: Optional[str] = Query(None, description="Filter by subject"),       # <-- optional
+    subject_match: str = Query(
+        "contains", pattern=f"^({'|'.join(SUBJECT_MATCH_MODES)})$",
+        description="How 'subject' matches: contains (case-insensitive, unindexed), prefix or exact (case-insensitive, indexed)",
+    ),
     date: Optional[str] = Query(                                                 # <-- optional
         None, description="Filter by date (YYYY-MM-DD). Maps to 'lesson_date'."
     ),
+    after: Optional[str] = Query(None, description="Return records after this _id (value of next_after from the previous page)"),
+    limit: Optional[int] = Query(
+        None, ge=1, le=RECORDS_MAX_PAGE_SIZE,
+        description=f"Page size (default {RECORDS_PAGE_SIZE} for json, unlimited for ndjson)",
+    ),
+    format: str = Query("json", pattern="^(json|ndjson)$", description="json page, or ndjson stream of one record per line"),
+    db=Depends(get_mongo_db),
 ):
     """
     Retrieve attendance records from MongoDB.
     - All filters are optional.
-    - If no filters are provided, returns all records.
-    - Supported filters: student_id, subject (case-insensitive), date (maps to lesson_date).
+    - Records come in _id order; json returns one page plus next_after (null on the last page).
+    - ndjson streams records as the cursor yields them, so memory stays flat for any result size.
+    - Supported filters: student_id, subject (case-insensitive, see subject_match), date (maps to lesson_date).
     """
-    client = get_mongo_client(request)
-    ensure_mongo_available(client, request)
-    db = client[DB_NAME]
     att_col = db[COL_NAME]
 
-    query = {}
-    if student_id:
-        query["student_id"] = student_id
-    if subject:
-        # case-insensitive substring match
-        query["subject"] = {"$regex": subject, "$options": "i"}
-    if date:
-        query["lesson_date"] = date
-
-    records = list(att_col.find(query))
+    if after and not ObjectId.is_valid(after):
+        raise HTTPException(status_code=400, detail="'after' must be a record _id")
+    query = records_query(student_id, subject, subject_match, date, ObjectId(after) if after else None)
+
+    if format == "ndjson":
+        cursor = att_col.find(query).sort("_id", 1).batch_size(RECORDS_PAGE_SIZE)
+        if limit:
+            cursor = cursor.limit(limit)
+
+        async def ndjson_lines():
+            async for record in cursor:
+                encoded = jsonable_encoder(record, custom_encoder={ObjectId: str})
+                line = AttendanceResponse.model_validate(encoded).model_dump(mode="json", by_alias=True)
+                yield json.dumps(line, ensure_ascii=False) + "\n"
+
+        return StreamingResponse(ndjson_lines(), media_type="application/x-ndjson")
+
+    page_size = limit or RECORDS_PAGE_SIZE
+    # one extra record tells whether there is a next page
+    records = await att_col.find(query).sort("_id", 1).limit(page_size + 1).to_list(page_size + 1)
+    next_after = str(records[page_size - 1]["_id"]) if len(records) > page_size else None
     # Ensure ObjectId/datetime are JSON serializable
-    encoded = jsonable_encoder(records, custom_encoder={ObjectId: str})
-    return {"records": encoded}
\ No newline at end of file
+    encoded = jsonable_encoder(records[:page_size], custom_encoder={ObjectId: str})
+    return {"records": encoded, "next_after": next_after}
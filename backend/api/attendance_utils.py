@@ -1,32 +1,37 @@
-from typing import Optional, Any, Dict, List, Tuple
+from typing import Optional, Any, Dict, List, Set, Tuple
 import datetime
 import os
-from pymongo import MongoClient, errors
+import re
+from pymongo import ASCENDING, IndexModel, InsertOne, ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError
 from bson import ObjectId
-from fastapi import Request, HTTPException
+from fastapi import HTTPException
+from fastapi.encoders import jsonable_encoder
 from dotenv import load_dotenv
 
+from db.connection import get_db, health_probe
+from core.batched_writer import BatchedWriter
+from core.tap_stream import tap_broadcaster
+from core.report_cache import report_cache
+from core.class_closer import CLOSURES_COL, ClassCloser
+from core.schedule_index import ActiveClass
+from core.job_queue import JobQueue
+
 load_dotenv()
 
-MONGODB_URI = os.getenv("MONGO_URI")
-DB_NAME = "attendance_system"
 COL_NAME = "subject_attendance"
 
 
-def get_mongo_client(request: Request) -> MongoClient:
-    client = getattr(request.app.state, "mongo_client", None)
-    if client is None:
-        client = MongoClient(MONGODB_URI, serverSelectionTimeoutMS=5000)
-    return client
+async def ensure_mongo_available() -> None:
+    # raise HTTPException(503) if server not available; the probe pings at most every few seconds
+    if not await health_probe.is_available():
+        raise HTTPException(status_code=503, detail=f"Cannot connect to MongoDB: {health_probe.last_error}")
 
 
-def ensure_mongo_available(client: MongoClient, request: Request) -> None:
-    # raise HTTPException(503) if server not available
-    try:
-        if not getattr(request.app.state, "mongo_client", None):
-            client.server_info()
-    except errors.ServerSelectionTimeoutError as e:
-        raise HTTPException(status_code=503, detail=f"Cannot connect to MongoDB: {e}")
+async def get_mongo_db():
+    """Route dependency: the shared database handle, after the cached availability check."""
+    await ensure_mongo_available()
+    return get_db()
 
 
 def now_iso_z() -> str:
@@ -87,59 +92,316 @@ def ensure_dt(v: Any) -> Optional[datetime.datetime]:
     return None
 
 LATES_FOR_ABSENCE = 3
+LATE_COUNTERS_COL = "late_counters"
+
+
+def late_counter_id(student_id_str: str, subject: str) -> Dict[str, str]:
+    # key order matters for embedded _id equality; backfill_late_counters.py builds the same shape
+    return {"student_id": student_id_str, "subject": subject}
 
-def check_and_convert_lates_to_absence(db, student, subject):
+
+def late_records_filter(student_id_str: str, subject: str) -> Dict[str, Any]:
+    # served by the (student_id, subject, late, lesson_date) index of SubjectAttendance
+    return {
+        "student_id": student_id_str,
+        "subject": subject,
+        "late": True,
+        "converted_to_absence": {"$ne": True},
+    }
+
+
+async def register_late_and_convert(db, student, subject):
     """
-    Checks if a student has accumulated enough lates for a subject to be marked absent.
-    If so, it flags the lates as converted and updates the latest record to 'Absent'.
+    Counts a new late for a student and subject, and converts lates to an absence when enough accumulated.
+    The per-(student, subject) counter in `late_counters` is maintained with $inc, so the cost of a
+    late tap does not depend on how much attendance history exists. Only the tap that crosses
+    LATES_FOR_ABSENCE loads the oldest unconverted lates (bounded by the threshold),
+    flags them as converted and updates the latest of them to 'Absent'.
+    Call exactly once per record that became late.
     """
     att_col = db["subject_attendance"]
-    
-    # --- THIS IS THE FIX ---
+    counters_col = db[LATE_COUNTERS_COL]
+
     # Use the student's string ID number from the 'student_id_no' field.
     student_id_str = student.get("student_id_no")
     if not student_id_str:
         print(f"WARNING: Could not run late conversion for student {student.get('_id')} because they are missing 'student_id_no'.")
         return False
 
-    # 1. Find all 'Late' records for this student and subject that have NOT been converted yet.
-    late_filter = {
-        "student_id": student_id_str, # Query with the correct string ID
-        "subject": subject,
-        "late": True,
-        "converted_to_absence": {"$ne": True}
-    }
-    unconverted_lates = list(att_col.find(late_filter).sort("lesson_date", 1))
-
-    # 2. If the number of unconverted lates reaches the threshold...
-    if len(unconverted_lates) >= LATES_FOR_ABSENCE:
-        print(f"Found {len(unconverted_lates)} unconverted lates for student {student_id_str}. Triggering absence conversion.")
-        
-        records_to_convert = unconverted_lates[:LATES_FOR_ABSENCE]
-        ids_to_convert = [rec["_id"] for rec in records_to_convert]
-        triggering_record_id = ids_to_convert[-1]
-
-        # 3. Update the triggering record to be an 'Absent' record.
-        att_col.update_one(
-            {"_id": triggering_record_id},
-            {
-                "$set": {
-                    "status": "Absent",
-                    "late": False,
-                    "remarks": f"Automatically converted from {LATES_FOR_ABSENCE} lates."
-                }
+    counter_id = late_counter_id(student_id_str, subject)
+    counter = await counters_col.find_one_and_update(
+        {"_id": counter_id},
+        {"$inc": {"pending": 1}, "$set": {"updated_at": datetime.datetime.utcnow()}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+    )
+    if counter["pending"] < LATES_FOR_ABSENCE:
+        return False
+
+    # Claim one conversion atomically so concurrent taps never convert the same lates twice.
+    claimed = await counters_col.find_one_and_update(
+        {"_id": counter_id, "pending": {"$gte": LATES_FOR_ABSENCE}},
+        {"$inc": {"pending": -LATES_FOR_ABSENCE}},
+    )
+    if not claimed:
+        return False
+
+    records_to_convert = await att_col.find(late_records_filter(student_id_str, subject), {"_id": 1, "lesson_date": 1}).sort("lesson_date", 1).limit(LATES_FOR_ABSENCE).to_list(LATES_FOR_ABSENCE)
+    if len(records_to_convert) < LATES_FOR_ABSENCE:
+        # counter drifted from the records (e.g. edited by hand); resync it instead of converting
+        print(f"WARNING: late counter for student {student_id_str} / {subject} was ahead of the records; resetting it to {len(records_to_convert)}.")
+        await counters_col.update_one({"_id": counter_id}, {"$set": {"pending": len(records_to_convert)}})
+        return False
+
+    print(f"Student {student_id_str} reached {LATES_FOR_ABSENCE} unconverted lates in {subject}. Triggering absence conversion.")
+    ids_to_convert = [rec["_id"] for rec in records_to_convert]
+    triggering_record_id = ids_to_convert[-1]
+
+    # Update the triggering record to be an 'Absent' record.
+    await att_col.update_one(
+        {"_id": triggering_record_id},
+        {
+            "$set": {
+                "status": "Absent",
+                "late": False,
+                "remarks": f"Automatically converted from {LATES_FOR_ABSENCE} lates."
             }
+        }
+    )
+
+    # Mark all the used late records as 'converted'.
+    await att_col.update_many(
+        {"_id": {"$in": ids_to_convert}},
+        {"$set": {"converted_to_absence": True, "late": False}}
+    )
+
+    await db[ROLLUPS_COL].bulk_write([
+        UpdateOne(
+            {"_id": rollup_key(student_id_str, subject, rec.get("lesson_date"))},
+            {"$set": {"late": 0, "absent": 1 if rec["_id"] == triggering_record_id else 0}},
         )
+        for rec in records_to_convert
+    ], ordered=False)
+    for rec in records_to_convert:
+        report_cache.invalidate(student.get("section"), rec.get("lesson_date"))
+
+    return True # Indicate that a conversion happened
+
+ROLLUPS_COL = "attendance_rollups"
+
+
+def subject_code_of(subject: Optional[str]) -> Optional[str]:
+    # same as {"$arrayElemAt": [{"$split": ["$subject", " "]}, 0]}
+    return subject.split(" ")[0] if isinstance(subject, str) else None
+
+
+def subject_key_of(subject: Optional[str]) -> Optional[str]:
+    # lowercase copy of the subject so exact and prefix filters can use an index
+    return subject.lower() if isinstance(subject, str) else None
+
+
+SUBJECT_MATCH_MODES = ("contains", "prefix", "exact")
+
+
+def subject_filter(subject: str, mode: str = "contains") -> Dict[str, Any]:
+    if mode == "exact":
+        return {"subject_key": subject_key_of(subject)}
+    if mode == "prefix":
+        # anchored, case-sensitive regex on the lowercase key is an index range scan
+        return {"subject_key": {"$regex": "^" + re.escape(subject_key_of(subject))}}
+    # case-insensitive substring match; cannot use an index
+    return {"subject": {"$regex": subject, "$options": "i"}}
+
+
+def records_query(
+    student_id: Optional[str] = None,
+    subject: Optional[str] = None,
+    subject_match: str = "contains",
+    lesson_date: Optional[str] = None,
+    after: Optional[ObjectId] = None,
+) -> Dict[str, Any]:
+    # filter of GET /attendance/records; pages continue after the last _id of the previous one
+    query: Dict[str, Any] = {}
+    if student_id:
+        query["student_id"] = student_id
+    if subject:
+        query.update(subject_filter(subject, subject_match))
+    if lesson_date:
+        query["lesson_date"] = lesson_date
+    if after:
+        query["_id"] = {"$gt": after}
+    return query
+
+
+def report_match(
+    section: Optional[str] = None,
+    subject: Optional[str] = None,
+    subject_match: str = "contains",
+    lesson_date: Optional[str] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+) -> Dict[str, Any]:
+    # filter of the attendance summary and the export, on rollups or records alike;
+    # a single lesson_date wins over the date range
+    match: Dict[str, Any] = {}
+    if section:
+        match["section"] = section
+    if subject:
+        match.update(subject_filter(subject, subject_match))
+    if lesson_date:
+        match["lesson_date"] = lesson_date
+    elif date_from or date_to:
+        match["lesson_date"] = {
+            **({"$gte": date_from} if date_from else {}),
+            **({"$lte": date_to} if date_to else {}),
+        }
+    return match
+
+
+# Closed terms, moved out of subject_attendance by archive_terms.py: the records themselves,
+# and one summary per student+subject+month shaped like a rollup (late / absent are counts).
+ARCHIVE_COL = "subject_attendance_archive"
+MONTHLY_COL = "attendance_monthly"
+
+
+def archived_months_stage(
+    section: Optional[str] = None,
+    subject: Optional[str] = None,
+    subject_match: str = "contains",
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+) -> Dict[str, Any]:
+    """
+    $unionWith stage adding the monthly summaries of archived terms to a rollups pipeline.
+    Archived months only exist as a whole, so only the months lying entirely inside
+    [date_from, date_to] are included.
+    """
+    match: Dict[str, Any] = {}
+    if section:
+        match["section"] = section
+    if subject:
+        match.update(subject_filter(subject, subject_match))
+    if date_from:
+        match["month_start"] = {"$gte": date_from}
+    if date_to:
+        match["month_end"] = {"$lte": date_to}
+    return {"$unionWith": {"coll": MONTHLY_COL, "pipeline": [{"$match": match}]}}
+
+
+async def ensure_indexes(db) -> None:
+    # indexes of collections that are not Beanie documents
+    await db[ROLLUPS_COL].create_indexes([
+        IndexModel([("section", ASCENDING), ("lesson_date", ASCENDING)]),
+        IndexModel([("subject_key", ASCENDING), ("lesson_date", ASCENDING)]),
+        IndexModel([("lesson_date", ASCENDING)]),
+    ])
+    await db[MONTHLY_COL].create_indexes([
+        IndexModel([("section", ASCENDING), ("month_start", ASCENDING)]),
+        IndexModel([("subject_key", ASCENDING), ("month_start", ASCENDING)]),
+        IndexModel([("month_start", ASCENDING)]),
+    ])
+    # attendance_logs used to allow one log per student and day, which breaks out/in taps contradict
+    legacy = (await db["attendance_logs"].index_information()).get("student_id_1_lesson_date_1")
+    if legacy and legacy.get("unique"):
+        await db["attendance_logs"].drop_index("student_id_1_lesson_date_1")
+    await db[ARCHIVE_COL].create_indexes([
+        IndexModel([("lesson_date", ASCENDING)]),
+        IndexModel([("student_id", ASCENDING), ("lesson_date", ASCENDING)]),
+    ])
+    # the class closer looks for abandoned claims every round
+    await db[CLOSURES_COL].create_indexes([
+        IndexModel([("status", ASCENDING), ("claimed_at", ASCENDING)]),
+    ])
+
+
+def rollup_key(student_id_str: str, subject: str, lesson_date: str) -> Dict[str, str]:
+    return {"student_id": student_id_str, "subject": subject, "lesson_date": lesson_date}
+
+
+# Stages turning subject_attendance records into attendance_rollups documents (used by rebuild_rollups.py).
+ROLLUP_FROM_RECORDS_STAGES: List[Dict[str, Any]] = [
+    {"$group": {
+        "_id": {"student_id": "$student_id", "subject": "$subject", "lesson_date": "$lesson_date"},
+        "student_id": {"$last": "$student_id"},
+        "student_name": {"$last": "$student_name"},
+        "section": {"$last": "$section"},
+        "subject": {"$last": "$subject"},
+        "lesson_date": {"$last": "$lesson_date"},
+        "subject_code": {"$last": "$subject_code"},
+        "subject_key": {"$last": "$subject_key"},
+        "late": {"$sum": {"$cond": [{"$eq": ["$late", True]}, 1, 0]}},
+        "absent": {"$sum": {"$cond": [{"$eq": ["$status", "Absent"]}, 1, 0]}},
+    }},
+    # records written before subject_code/subject_key existed
+    {"$set": {
+        "subject_code": {"$ifNull": ["$subject_code", {"$arrayElemAt": [{"$split": ["$subject", " "]}, 0]}]},
+        "subject_key": {"$ifNull": ["$subject_key", {"$toLower": "$subject"}]},
+    }},
+]
+
+
+def rollup_write_ops(records: List[Dict[str, Any]]) -> List[Any]:
+    """
+    attendance_rollups holds one small document per student+subject+lesson_date with the
+    0/1 late and absent counts the report endpoints sum. Each op mirrors a record's current state.
+    """
+    ops = []
+    for rec in records:
+        if not rec:
+            continue
+        ops.append(UpdateOne(
+            {"_id": rollup_key(rec.get("student_id"), rec.get("subject"), rec.get("lesson_date"))},
+            {"$set": {
+                "student_id": rec.get("student_id"),
+                "student_name": rec.get("student_name"),
+                "section": rec.get("section"),
+                "subject": rec.get("subject"),
+                "subject_code": subject_code_of(rec.get("subject")),
+                "subject_key": subject_key_of(rec.get("subject")),
+                "lesson_date": rec.get("lesson_date"),
+                "late": 1 if rec.get("late") is True else 0,
+                "absent": 1 if rec.get("status") == "Absent" else 0,
+            }},
+            upsert=True,
+        ))
+    return ops
+
+
+async def sync_rollups(db, records: List[Dict[str, Any]]) -> None:
+    ops = rollup_write_ops(records)
+    try:
+        if ops:
+            await db[ROLLUPS_COL].bulk_write(ops, ordered=True)
+    finally:
+        # cached reports that could include a changed (section, lesson_date), even if the rollups lag
+        for key in {(rec.get("section"), rec.get("lesson_date")) for rec in records if rec}:
+            report_cache.invalidate(*key)
+
+
+class RollupSync:
+    """Rollup writes that failed after their taps were committed; rebuild_rollups.py repairs them."""
+
+    def __init__(self):
+        self.failures = 0
+        self.last_error: Optional[str] = None
+
+    async def sync(self, db, records: List[Dict[str, Any]]) -> bool:
+        # the tap is already stored: failing the response would make the reader retry it as a new tap
+        try:
+            await sync_rollups(db, records)
+            return True
+        except Exception as e:
+            self.failures += 1
+            self.last_error = str(e)
+            print(f"WARNING: rollup sync failed after a committed tap ({e}); run rebuild_rollups.py to repair.")
+            return False
+
+    def stats(self) -> Dict[str, Any]:
+        return {"failures": self.failures, "last_error": self.last_error}
+
+
+rollup_sync = RollupSync()
 
-        # 4. Mark all the used late records as 'converted'.
-        att_col.update_many(
-            {"_id": {"$in": ids_to_convert}},
-            {"$set": {"converted_to_absence": True, "late": False}}
-        )
-        
-        return True # Indicate that a conversion happened
-        
-    return False # No conversion happened
 
 def student_canonical_id(student: Dict[str, Any]) -> str:
     return student.get("student_id_no") or str(student.get("_id"))
@@ -159,169 +421,369 @@ def build_attendance_filter(student: Dict[str, Any], lesson_date: str, subject:
     }
 
 
-def recompute_flags_and_update(db, filt, start_time, end_time, student, subject):
+def log_event(student_id_str: str, student: Dict[str, Any], section: str, lesson_date: str, now_iso: str, action: str, from_device: str = "rfid", subject: Optional[str] = None) -> Dict[str, Any]:
+    return {
+        "student_id": student_id_str,
+        "section": section,
+        "subject": subject,
+        "lesson_date": lesson_date,
+        "at": now_iso,
+        "action": action,
+        "from_device": from_device,
+        "queued_at": datetime.datetime.utcnow(),
+    }
+
+
+def publish_tap(doc: Dict[str, Any], action: Optional[str]) -> int:
+    """Pushes a record's state after a tap to the live roster streams of its section."""
+    return tap_broadcaster.publish({
+        "action": action,
+        "section": doc.get("section"),
+        "subject": doc.get("subject"),
+        "lesson_date": doc.get("lesson_date"),
+        "student_id": doc.get("student_id"),
+        "doc": jsonable_encoder(doc, custom_encoder={ObjectId: str}),
+    })
+
+
+def tap_event_ops(events: List[Dict[str, Any]]) -> List[Any]:
     """
-    Recomputes flags like 'late' and 'left_early' based on the current record state.
-    Also triggers the logic to convert lates to absences.
+    Turns queued taps into tap_events inserts. Events are never updated afterwards:
+    the time-series collection buckets them by meta (student, section, device) and time,
+    and pairing tap_in with tap_out is left to whoever reads them.
     """
-    att_col = db["subject_attendance"]
-    doc = att_col.find_one(filt)
-    if not doc:
-        return
-
-    update_doc = {}
-    is_late = False
-
-    
-
-    # Calculate 'late' flag
-    if doc.get("time_in"):
-        time_in_dt = ensure_dt(doc["time_in"])
-        late_threshold = ensure_dt(start_time) + datetime.timedelta(minutes=10)
-        if time_in_dt > late_threshold:
-            is_late = True
-    update_doc["late"] = is_late
-
-    if doc.get("status") != "Absent":
-        update_doc["status"] = "Late" if is_late else "Present"
-
-    # Calculate 'left_early' flag
-    if doc.get("time_out"):
-        time_out_dt = ensure_dt(doc["time_out"])
-        if time_out_dt < ensure_dt(end_time):
-            update_doc["left_early"] = True
-        else:
-            update_doc["left_early"] = False
-
-    
-    if update_doc:
-        att_col.update_one(filt, {"$set": update_doc})
-
-    # --- NEW LOGIC INTEGRATION ---
-    # After updating flags, always attempt to convert accumulated lates into absences.
-    # This ensures conversions aren't missed if the most-recent tap wasn't itself flagged late
-    # (for example when records are backfilled or updated).
-    try:
-        check_and_convert_lates_to_absence(db, student, subject)
-    except Exception:
-        # don't let conversion failures break the main flow
-        pass
+    return [
+        InsertOne({
+            "at": parse_iso(ev["at"]),
+            "meta": {"student_id": ev["student_id"], "section": ev["section"], "device": ev["from_device"]},
+            "action": ev["action"],
+            "lesson_date": ev["lesson_date"],
+            "subject": ev["subject"],
+            "queued_at": ev["queued_at"],
+        })
+        for ev in events
+    ]
+
+
+# tap_events is a journal nobody reads on the tap path, so it is written behind the response
+tap_journal = BatchedWriter("tap_events", tap_event_ops)
+
 
+LATE_GRACE_MINUTES = 10
+ISO_Z_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+
+
+def build_tap_update(student: Dict[str, Any], section: str, subject: str, tapped_at: datetime.datetime, class_start: datetime.datetime, class_end: datetime.datetime, from_device: str = "rfid") -> List[Dict[str, Any]]:
+    """
+    Builds the aggregation-pipeline update that applies one tap to a subject_attendance record.
+    The whole state machine runs inside MongoDB so a tap is a single atomic find_one_and_update:
+    - no time_in yet -> tap in (creates the record on upsert)
+    - inside (time_out is null) -> tap out, flag left_early
+    - outside -> back from a break: append break from previous time_out -> now and clear time_out
+    The late flag / status are recomputed from time_in against the class start plus the grace period,
+    and the normalized subject_code / subject_key are (re)written on every tap.
+    """
+    tap_dt = ensure_dt(tapped_at).replace(microsecond=0)
+    tap_iso = to_iso_z(tap_dt)
+    late_threshold = ensure_dt(class_start) + datetime.timedelta(minutes=LATE_GRACE_MINUTES)
+    left_early = tap_dt < ensure_dt(class_end)
+    now = datetime.datetime.utcnow()
+
+    prev_out_iso = {"$cond": [
+        {"$eq": [{"$type": "$time_out"}, "date"]},
+        {"$dateToString": {"date": "$time_out", "format": ISO_Z_FORMAT}},
+        "$time_out",
+    ]}
+    short_duration = {"$cond": [
+        {"$lt": ["$_ds", 60]},
+        {"$concat": [{"$toString": "$_ds"}, "s"]},
+        {"$concat": [{"$toString": {"$toInt": {"$floor": {"$divide": ["$_ds", 60]}}}}, "m"]},
+    ]}
+    existing_breaks = {"$ifNull": ["$breaks", []]}
+    break_already_recorded = {"$in": [
+        [prev_out_iso, tap_iso],
+        {"$map": {"input": existing_breaks, "in": ["$$this.start", "$$this.end"]}},
+    ]}
+
+    tap_in = {
+        "student_name": {"$literal": f"{student.get('first_name','')} {student.get('last_name','')}".strip()},
+        "section": {"$literal": section},
+        "subject": {"$literal": subject},
+        "time_in": tap_iso,
+        "time_out": None,
+        "status": "Present",
+        "left_early": False,
+        "breaks": [],
+        "total_break_seconds": 0,
+        "remarks": None,
+        "from_device": {"$literal": from_device},
+        "created_at": now,
+        "updated_at": now,
+    }
+    tap_out = {"time_out": tap_iso, "left_early": left_early, "updated_at": now}
+    break_return = {
+        "breaks": {"$cond": [
+            break_already_recorded,
+            existing_breaks,
+            {"$concatArrays": [existing_breaks, [{
+                "start": prev_out_iso,
+                "end": tap_iso,
+                "duration_seconds": "$_ds",
+                "duration": short_duration,
+            }]]},
+        ]},
+        "time_out": None,
+        "left_early": False,
+        "updated_at": now,
+    }
 
-def insert_or_update_log(db, student_id_str: str, student: Dict[str, Any], section: str, lesson_date: str, now_iso: str, action: str) -> None:
+    return [
+        {"$set": {"_tap": {"$switch": {
+            "branches": [
+                {"case": {"$not": [{"$ifNull": ["$time_in", False]}]}, "then": "tap_in"},
+                {"case": {"$eq": [{"$ifNull": ["$time_out", None]}, None]}, "then": "tap_out"},
+            ],
+            "default": "break_return",
+        }}}},
+        {"$set": {"_ds": {"$cond": [
+            {"$eq": ["$_tap", "break_return"]},
+            {"$toInt": {"$trunc": {"$divide": [{"$subtract": [tap_dt, {"$toDate": "$time_out"}]}, 1000]}}},
+            "$$REMOVE",
+        ]}}},
+        {"$replaceRoot": {"newRoot": {"$mergeObjects": ["$$ROOT", {"$switch": {
+            "branches": [
+                {"case": {"$eq": ["$_tap", "tap_in"]}, "then": tap_in},
+                {"case": {"$eq": ["$_tap", "tap_out"]}, "then": tap_out},
+            ],
+            "default": break_return,
+        }}]}}},
+        # converted lates keep late=False so they are not counted twice
+        {"$set": {"late": {"$cond": [
+            {"$eq": ["$converted_to_absence", True]},
+            {"$ifNull": ["$late", False]},
+            {"$gt": [{"$toDate": "$time_in"}, late_threshold]},
+        ]}}},
+        {"$set": {
+            "status": {"$cond": [{"$eq": ["$status", "Absent"]}, "Absent", {"$cond": ["$late", "Late", "Present"]}]},
+            "total_break_seconds": {"$sum": "$breaks.duration_seconds"},
+            "subject_code": {"$literal": subject_code_of(subject)},
+            "subject_key": {"$literal": subject_key_of(subject)},
+        }},
+        {"$unset": ["_tap", "_ds"]},
+    ]
+
+
+async def apply_tap(db, filt: Dict[str, Any], update: List[Dict[str, Any]]) -> Dict[str, Any]:
+    # one round trip: upsert + state transition + flags, returns the record after the tap
     try:
-        logs_col = db["attendance_logs"]
-        last_open_log = logs_col.find_one({"student_id": student_id_str, "lesson_date": lesson_date, "time_out": None}, sort=[("time_in", -1)])
-
-        if action == "tap_in":
-            log_doc = {
-                "student_id": student_id_str,
-                "student_name": f"{student.get('first_name','')} {student.get('last_name','')}".strip(),
-                "section": section,
-                "lesson_date": lesson_date,
-                "time_in": now_iso,
-                "time_out": None,
-                "from_device": "rfid",
-                "created_at": datetime.datetime.utcnow(),
-                "updated_at": datetime.datetime.utcnow()
-            }
-            logs_col.insert_one(log_doc)
-        elif action == "tap_out":
-            if last_open_log:
-                logs_col.update_one({"_id": last_open_log["_id"]}, {"$set": {"time_out": now_iso, "updated_at": datetime.datetime.utcnow()}})
-            else:
-                log_doc = {
-                    "student_id": student_id_str,
-                    "student_name": f"{student.get('first_name','')} {student.get('last_name','')}".strip(),
-                    "section": section,
-                    "lesson_date": lesson_date,
-                    "time_in": None,
-                    "time_out": now_iso,
-                    "from_device": "rfid",
-                    "created_at": datetime.datetime.utcnow(),
-                    "updated_at": datetime.datetime.utcnow()
-                }
-                logs_col.insert_one(log_doc)
-    except Exception:
-        # don't fail main flow if logging fails
-        return
+        return await db[COL_NAME].find_one_and_update(filt, update, upsert=True, return_document=ReturnDocument.AFTER)
+    except DuplicateKeyError:
+        # a concurrent first tap inserted the record between our match and insert (the unique
+        # tap index rejected the second one); servers >= 4.2 retry this themselves
+        return await db[COL_NAME].find_one_and_update(filt, update, upsert=True, return_document=ReturnDocument.AFTER)
 
 
-def handle_attendance_record(db, student: Dict[str, Any], section: str, subject: str, lesson_date: str, now_dt: datetime.datetime, now_iso: str, start_time: Any, end_time: Any) -> None:
-    att_col = db[COL_NAME]
-    student_id_str = student_canonical_id(student)
-    filt = build_attendance_filter(student, lesson_date, subject)
-    existing = att_col.find_one(filt)
+def tap_action(doc: Dict[str, Any]) -> str:
+    # the journal only distinguishes being inside (tap_in) from leaving (tap_out)
+    return "tap_in" if doc.get("time_out") is None else "tap_out"
 
-    # decide action
-    if not existing:
-        # tap in: compute late flag
-        late_flag = False
-        try:
-            if isinstance(start_time, datetime.datetime):
-                late_flag = now_dt > start_time
-            elif isinstance(start_time, str):
-                late_flag = now_dt > parse_iso(start_time)
-        except Exception:
-            late_flag = False
-
-        status_val = "Late" if late_flag else "Present"
-
-        doc = {
-            "student_id": student_id_str,
-            "student_name": f"{student.get('first_name','')} {student.get('last_name','')}".strip(),
-            "section": section,
-            "subject": subject,
-            "lesson_date": lesson_date,
-            "time_in": now_iso,
-            "time_out": None,
-            "status": status_val,
-            "late": late_flag,
-            "left_early": False,
-            "breaks": [],
-            "total_break_seconds": 0,
-            "remarks": None,
-            "from_device": "rfid",
-            "created_at": datetime.datetime.utcnow(),
-            "updated_at": datetime.datetime.utcnow()
-        }
-        att_col.update_one({"lesson_date": lesson_date, "subject": subject, "student_id": student_id_str}, {"$set": doc}, upsert=True)
-        return
 
-    existing_time_out = existing.get("time_out")
-    if existing_time_out is None:
-        # currently inside -> tap out
-        left_early_flag = False
-        try:
-            if isinstance(end_time, datetime.datetime):
-                left_early_flag = now_dt < end_time
-            elif isinstance(end_time, str):
-                left_early_flag = now_dt < parse_iso(end_time)
-        except Exception:
-            left_early_flag = False
-
-        update_set = {"time_out": now_iso, "left_early": left_early_flag, "updated_at": datetime.datetime.utcnow()}
-        att_col.update_one({"_id": existing["_id"]}, {"$set": update_set})
-        return
-
-    # currently outside -> tap in: append break from prev time_out -> now, clear time_out
-    prev_out_iso = to_iso_z(existing_time_out)
-    new_break = {"start": prev_out_iso, "end": now_iso}
-    ds = duration_seconds(prev_out_iso, now_iso)
-    if ds is not None:
-        new_break["duration_seconds"] = ds
-        new_break["duration"] = format_short_duration(ds)
-    breaks = existing.get("breaks") or []
-    keys = {(to_iso_z(b.get("start")), to_iso_z(b.get("end"))) for b in breaks if b.get("start")}
-    key_new = (to_iso_z(new_break["start"]), to_iso_z(new_break["end"]))
-    if key_new not in keys:
-        breaks.append(new_break)
-    total = 0
-    for b in breaks:
-        try:
-            total += int(b.get("duration_seconds") or 0)
-        except Exception:
-            pass
+def tap_state(doc: Optional[Dict[str, Any]]) -> str:
+    # same branching as the pipeline built by build_tap_update
+    if not doc or not doc.get("time_in"):
+        return "new"
+    return "inside" if doc.get("time_out") is None else "outside"
 
-    update_set = {"breaks": breaks, "total_break_seconds": total, "time_out": None, "left_early": False, "updated_at": datetime.datetime.utcnow()}
-    att_col.update_one({"_id": existing["_id"]}, {"$set": update_set})
+
+def last_tap_at(doc: Optional[Dict[str, Any]]) -> Optional[datetime.datetime]:
+    if not doc:
+        return None
+    stamps = [doc.get("time_in"), doc.get("time_out")] + [b.get("end") for b in doc.get("breaks") or []]
+    stamps = [ensure_dt(s) for s in stamps if s]
+    stamps = [s for s in stamps if s]
+    return max(stamps) if stamps else None
+
+
+def is_first_tap(doc: Dict[str, Any], tapped_at: datetime.datetime) -> bool:
+    return doc.get("time_in") == to_iso_z(ensure_dt(tapped_at)) and not doc.get("breaks") and doc.get("time_out") is None
+
+
+async def materialize_absences(db, section: str, occurrence: ActiveClass) -> int:
+    """
+    Gives every active student of the section without a record for the class an Absent record.
+    Four round trips per class whatever its size: roster, tappers, one unordered bulk upsert
+    and the rollup sync. $setOnInsert never touches a record a tap created in the meantime,
+    and a tap replayed later (/rfid/batch) still turns the absence into Present or Late.
+    """
+    subject = occurrence.schedule.get("subject")
+    lesson_date = occurrence.start.date().isoformat()
+    roster = await db["students"].find(
+        {"section": section, "is_active": {"$ne": False}, "student_id_no": {"$nin": [None, ""]}},
+        {"student_id_no": 1, "first_name": 1, "last_name": 1},
+    ).to_list(None)
+    if not roster:
+        return 0
+    tapped = set(await db[COL_NAME].distinct("student_id", {
+        "student_id": {"$in": [s["student_id_no"] for s in roster]},
+        "lesson_date": lesson_date,
+        "subject": subject,
+    }))
+    absent = [s for s in roster if s["student_id_no"] not in tapped]
+    if not absent:
+        return 0
+
+    now = datetime.datetime.utcnow()
+    records = [{
+        "student_id": s["student_id_no"],
+        "student_name": f"{s.get('first_name','')} {s.get('last_name','')}".strip(),
+        "section": section,
+        "subject": subject,
+        "subject_code": subject_code_of(subject),
+        "subject_key": subject_key_of(subject),
+        "lesson_date": lesson_date,
+        "time_in": None,
+        "time_out": None,
+        "status": "Absent",
+        "late": False,
+        "left_early": False,
+        "breaks": [],
+        "total_break_seconds": 0,
+        "converted_to_absence": False,
+        "remarks": "No tap during class",
+        "from_device": "class_closer",
+        "created_at": now,
+        "updated_at": now,
+    } for s in absent]
+    result = await db[COL_NAME].bulk_write([
+        UpdateOne(
+            {"student_id": rec["student_id"], "lesson_date": lesson_date, "subject": subject},
+            {"$setOnInsert": rec},
+            upsert=True,
+        )
+        for rec in records
+    ], ordered=False)
+
+    created = []
+    for i, _id in result.upserted_ids.items():
+        records[i]["_id"] = _id
+        created.append(records[i])
+    await sync_rollups(db, created)
+    for rec in created:
+        publish_tap(rec, "absent")
+    return len(created)
+
+
+class_closer = ClassCloser(materialize_absences)
+
+
+# collections carrying a student's id, name and section on every document, rewritten in _id order
+STUDENT_HISTORY_COLLECTIONS = [COL_NAME, "attendance_logs"]
+TAP_EVENTS_COL = "tap_events"
+
+
+def record_keep_order(doc: Dict[str, Any]) -> Tuple[Any, ...]:
+    # of several records for one student+subject+day, the first by this key is kept:
+    # one already converted to an absence, one with a tap, the earliest tap, the oldest _id
+    return (not doc.get("converted_to_absence"), doc.get("time_in") is None, str(doc.get("time_in") or ""), doc["_id"])
+
+
+async def resolve_rekey_collisions(db, batch: List[Dict[str, Any]], new_id: str) -> Set[Any]:
+    """
+    Before records move to `new_id`, drops one record of every student+subject+day that would
+    then exist twice: a tap or an absence can already have created a new-ID record for a lesson
+    the old ID has a record of. Keeps the record first by record_keep_order and returns the
+    _ids of the batch's records that were dropped.
+    """
+    clashing = await db[COL_NAME].find({"student_id": new_id, "$or": [
+        {"lesson_date": doc.get("lesson_date"), "subject": doc.get("subject")} for doc in batch
+    ]}).to_list(None)
+    existing = {(doc.get("lesson_date"), doc.get("subject")): doc for doc in clashing}
+    dropped: Set[Any] = set()
+    losers = []
+    for doc in batch:
+        other = existing.get((doc.get("lesson_date"), doc.get("subject")))
+        if other is None:
+            continue
+        loser = max(doc, other, key=record_keep_order)
+        losers.append(loser["_id"])
+        if loser is doc:
+            dropped.add(doc["_id"])
+    if losers:
+        await db[COL_NAME].delete_many({"_id": {"$in": losers}})
+    return dropped
+
+
+async def propagate_student_edit(db, job: Dict[str, Any], batch_size: int) -> Dict[str, Any]:
+    """
+    One step of carrying a student edit into the attendance history (a `student_edit` job):
+    - subject_attendance, attendance_logs: next `batch_size` documents of the old student_id_no,
+      in _id order, get the new student_id / student_name / section; a subject_attendance record
+      the new ID already has for the same lesson is merged first (resolve_rekey_collisions)
+    - tap_events: the meta of the student's events is re-keyed in one update (time-series
+      collections only allow updates of the meta field, which touch whole buckets)
+    - rollups: the student's rollups are rebuilt from the (re-keyed) records
+    - late counters: re-derived from the records when student_id_no changed
+    """
+    params = job["params"]
+    old_id, new_id = params["old_student_id_no"], params["student_id_no"]
+    phase = job.get("phase") or STUDENT_HISTORY_COLLECTIONS[0]
+
+    if phase in STUDENT_HISTORY_COLLECTIONS:
+        query: Dict[str, Any] = {"student_id": old_id}
+        if job.get("last_id") is not None:
+            query["_id"] = {"$gt": job["last_id"]}
+        batch = await db[phase].find(query).sort("_id", 1).limit(batch_size).to_list(batch_size)
+        if batch:
+            dropped = set()
+            if phase == COL_NAME and old_id != new_id:
+                dropped = await resolve_rekey_collisions(db, batch, new_id)
+            ids = [doc["_id"] for doc in batch if doc["_id"] not in dropped]
+            try:
+                await db[phase].update_many({"_id": {"$in": ids}}, {"$set": {
+                    "student_id": new_id,
+                    "student_name": params["student_name"],
+                    "section": params["section"],
+                }})
+            except DuplicateKeyError:
+                # a new-ID record appeared since the check; redo the batch, records already
+                # moved no longer match the old ID
+                return {"phase": phase, "last_id": job.get("last_id"), "processed": 0, "done": False}
+            return {"phase": phase, "last_id": batch[-1]["_id"], "processed": len(batch), "done": False}
+        following = STUDENT_HISTORY_COLLECTIONS.index(phase) + 1
+        next_phase = STUDENT_HISTORY_COLLECTIONS[following] if following < len(STUDENT_HISTORY_COLLECTIONS) else TAP_EVENTS_COL
+        return {"phase": next_phase, "last_id": None, "processed": 0, "done": False}
+
+    if phase == TAP_EVENTS_COL:
+        # the section of past taps stays the one the student tapped in
+        result = await db[TAP_EVENTS_COL].update_many(
+            {"meta.student_id": old_id},
+            {"$set": {"meta.student_id": new_id}},
+        ) if old_id != new_id else None
+        processed = result.modified_count if result else 0
+        return {"phase": "rollups", "last_id": None, "processed": processed, "done": False}
+
+    if phase == "rollups":
+        await db[COL_NAME].aggregate(
+            [{"$match": {"student_id": new_id}}] + ROLLUP_FROM_RECORDS_STAGES
+            + [{"$merge": {"into": ROLLUPS_COL, "whenMatched": "replace"}}],
+            allowDiskUse=True,
+        ).to_list(None)
+        if old_id != new_id:
+            await db[ROLLUPS_COL].delete_many({"student_id": old_id})
+        return {"phase": "late_counters", "last_id": None, "processed": 0, "done": False}
+
+    if old_id != new_id:
+        await db[COL_NAME].aggregate([
+            {"$match": {"student_id": new_id, "late": True, "converted_to_absence": {"$ne": True}}},
+            # same _id shape as late_counter_id
+            {"$group": {"_id": {"student_id": "$student_id", "subject": "$subject"}, "pending": {"$sum": 1}}},
+            {"$set": {"updated_at": datetime.datetime.utcnow()}},
+            {"$merge": {"into": LATE_COUNTERS_COL, "whenMatched": "replace"}},
+        ]).to_list(None)
+        await db[LATE_COUNTERS_COL].delete_many({"_id.student_id": old_id})
+    report_cache.invalidate(params.get("old_section"))
+    report_cache.invalidate(params["section"])
+    return {"phase": "done", "last_id": None, "processed": 0, "done": True}
+
+
+student_edit_jobs = JobQueue("student_edit_jobs", {"student_edit": propagate_student_edit})
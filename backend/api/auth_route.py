@@ -1,11 +1,11 @@
 from fastapi import APIRouter, HTTPException, Depends, status
 from fastapi.security import OAuth2PasswordBearer
 from pydantic import BaseModel, EmailStr, Field
-from typing import Optional
 import logging
 
 from models.user import Teacher
-from core.security import hash_password, verify_password, create_access_token, decode_access_token
+from core.dependencies import load_principal
+from core.security import hash_password_async, verify_and_update_password_async, create_access_token
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("auth_route")
@@ -41,12 +41,7 @@ oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/teacher/login")
 
 async def get_current_teacher(token: str = Depends(oauth2_scheme)) -> Teacher:
     try:
-        payload = decode_access_token(token)
-        user_id: Optional[str] = payload.get("sub")
-        if not user_id:
-            raise HTTPException(status_code=401, detail="Invalid token")
-
-        teacher = await Teacher.get(user_id)
+        teacher = await load_principal(token)
         if not teacher:
             raise HTTPException(status_code=401, detail="User not found")
 
@@ -65,7 +60,7 @@ async def register_user(payload: RegisterIn):
     if existing:
         raise HTTPException(status_code=400, detail="Email already registered")
 
-    hashed_pw = hash_password(payload.password)
+    hashed_pw = await hash_password_async(payload.password)
     teacher = Teacher(
         first_name=payload.first_name,
         last_name=payload.last_name,
@@ -91,8 +86,14 @@ async def login(payload: LoginIn):
     Authenticate with JSON body: { "email": "...", "password": "..." }
     """
     user = await Teacher.find_one(Teacher.email == payload.email)
-    if not user or not verify_password(payload.password, user.password):
+    if not user:
+        raise HTTPException(status_code=401, detail="Invalid credentials")
+    valid, new_hash = await verify_and_update_password_async(payload.password, user.password)
+    if not valid:
         raise HTTPException(status_code=401, detail="Invalid credentials")
+    if new_hash:
+        # BCRYPT_ROUNDS changed since this password was stored; upgrade it transparently
+        await user.set({Teacher.password: new_hash})
 
     token_data = {"sub": str(user.id), "role": user.role}
     access_token = create_access_token(data=token_data)
@@ -1,10 +1,19 @@
-from fastapi import APIRouter, Request, Query
-from typing import Optional, List, Dict, Any
+from fastapi import APIRouter, Depends, Request, Query, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
+from typing import Optional, List, Dict, Any, AsyncIterator, Awaitable, Callable, Hashable, Tuple
 from pydantic import BaseModel, Field
-from .attendance_utils import get_mongo_client, ensure_mongo_available
+from decouple import config
+import csv
+import io
+import json
+import tempfile
+from core.report_cache import report_cache
+from .attendance_utils import get_mongo_db, report_match, archived_months_stage, ROLLUPS_COL, SUBJECT_MATCH_MODES, COL_NAME
 
 router = APIRouter()
-DB_NAME = "attendance_system"
+EXPORT_BATCH_ROWS = config("EXPORT_BATCH_ROWS", default=1000, cast=int)
 
 class StudentAttendanceSummary(BaseModel):
     student_id: str
@@ -20,134 +29,179 @@ class AttendanceReport(BaseModel):
 class SectionTotalsRequest(BaseModel):
     section: str = Field(..., min_length=1, description="Exact section to summarize")
 
+# rollups -> per student+subject lates/absences, every 3 lates of a subject counting as one absence
+SUMMARY_PER_SUBJECT_STAGES: List[Dict[str, Any]] = [
+    {"$group": {
+        "_id": {
+            "student_id": "$student_id",
+            "student_name": "$student_name",
+            "section": "$section",
+            "subject_code": "$subject_code",
+        },
+        "lates_per_subject": {"$sum": "$late"},
+        "absences_per_subject": {"$sum": "$absent"},
+    }},
+    {"$project": {
+        "student_id": "$_id.student_id",
+        "student_name": "$_id.student_name",
+        "section": "$_id.section",
+        "subject_code": "$_id.subject_code",
+        "lates_per_subject": 1,
+        "absences_per_subject": 1,
+        "extra_absences_from_lates": {
+            "$floor": {"$divide": [{"$ifNull": ["$lates_per_subject", 0]}, 3]}
+        },
+        "residual_lates": {"$mod": [{"$ifNull": ["$lates_per_subject", 0]}, 3]},
+    }},
+]
+
+# per subject -> per student totals
+SUMMARY_PER_STUDENT_STAGES: List[Dict[str, Any]] = [
+    {"$group": {
+        "_id": {
+            "student_id": "$student_id",
+            "student_name": "$student_name",
+            "section": "$section",
+        },
+        "total_lates": {"$sum": "$residual_lates"},
+        "total_absences": {
+            "$sum": {"$add": ["$absences_per_subject", "$extra_absences_from_lates"]}
+        },
+    }},
+    {"$project": {
+        "_id": 0,
+        "student_id": "$_id.student_id",
+        "student_name": "$_id.student_name",
+        "section": "$_id.section",
+        "total_lates": 1,
+        "total_absences": 1,
+    }},
+    {"$sort": {"student_name": 1}},
+]
+
+async def cached_report(
+    request: Request,
+    key: Hashable,
+    compute: Callable[[], Awaitable[Dict[str, Any]]],
+    section: Optional[str] = None,
+    date_range: Tuple[Optional[str], Optional[str]] = (None, None),
+) -> Response:
+    """
+    Serves a report from report_cache, computing and caching it on a miss.
+    Responses carry an ETag of the body; a matching If-None-Match gets an empty 304.
+    """
+    entry = report_cache.get(key)
+    if entry is None:
+        # taps invalidating while compute() awaits must keep its result out of the cache
+        generation = report_cache.generation
+        report = AttendanceReport.model_validate(await compute())
+        body = json.dumps(jsonable_encoder(report), ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        entry = report_cache.set(key, body, section=section, date_range=date_range, generation=generation)
+    headers = {"ETag": entry.etag, "Cache-Control": "private, no-cache"}
+    if request.headers.get("if-none-match") == entry.etag:
+        return Response(status_code=304, headers=headers)
+    return Response(content=entry.body, media_type="application/json", headers=headers)
+
+@router.get("/cache/stats", tags=["Reports"])
+async def report_cache_stats():
+    """Hit ratio, size and invalidations of the report cache."""
+    return report_cache.stats()
+
 @router.get("/attendance-summary", tags=["Reports"], response_model=AttendanceReport)
 async def get_attendance_summary(
     request: Request,
     section: Optional[str] = Query(None, description="Filter by section"),
     subject: Optional[str] = Query(None, description="Filter by subject"),
+    subject_match: str = Query(
+        "contains", pattern=f"^({'|'.join(SUBJECT_MATCH_MODES)})$",
+        description="How 'subject' matches: contains (case-insensitive, unindexed), prefix or exact (case-insensitive, indexed)",
+    ),
     lesson_date: Optional[str] = Query(None, description="Exact lesson date (YYYY-MM-DD)"),
     date_from: Optional[str] = Query(None, description="Start date (YYYY-MM-DD)"),
     date_to: Optional[str] = Query(None, description="End date (YYYY-MM-DD)"),
-    debug: bool = Query(False, description="If true return intermediate per-subject aggregation for debugging")
+    debug: bool = Query(False, description="If true return intermediate per-subject aggregation for debugging"),
+    db=Depends(get_mongo_db),
 ):
-    client = get_mongo_client(request)
-    ensure_mongo_available(client, request)
-    db = client[DB_NAME]
-    att_col = db["subject_attendance"]
+    if lesson_date:
+        date_from = date_to = None
+    if not debug:
+        # the subject as typed: report_details echoes it
+        key = (
+            "attendance-summary", section,
+            subject, subject_match if subject else None,
+            lesson_date, date_from, date_to,
+        )
+        return await cached_report(
+            request, key,
+            lambda: _attendance_summary(db, section, subject, subject_match, lesson_date, date_from, date_to, False),
+            section=section,
+            date_range=(lesson_date, lesson_date) if lesson_date else (date_from, date_to),
+        )
+    return await _attendance_summary(db, section, subject, subject_match, lesson_date, date_from, date_to, True)
+
+async def _attendance_summary(db, section, subject, subject_match, lesson_date, date_from, date_to, debug) -> Dict[str, Any]:
+    # attendance_rollups: one small doc per student+subject+lesson_date, kept in sync by the tap path
+    rollups_col = db[ROLLUPS_COL]
 
     pipeline: List[Dict[str, Any]] = []
-    match_stage: Dict[str, Any] = {}
+    match_stage = report_match(section, subject, subject_match, lesson_date, date_from, date_to)
     report_details = "Overall Attendance Summary"
 
     if section:
-        match_stage["section"] = section
         report_details = f"Attendance Summary for Section: {section}"
     if subject:
-        match_stage["subject"] = {"$regex": subject, "$options": "i"}
         report_details = f"{report_details.replace('Summary', 'Summary for Subject')} {subject}"
     if lesson_date:
-        match_stage["lesson_date"] = lesson_date
         report_details = f"{report_details} on {lesson_date}"
-    else:
-        date_filter: Dict[str, Any] = {}
-        if date_from:
-            date_filter["$gte"] = date_from
-        if date_to:
-            date_filter["$lte"] = date_to
-
-        if date_filter:
-            match_stage["lesson_date"] = date_filter
-
-            if date_from and date_to:
-                report_details = f"{report_details} ({date_from} to {date_to})"
-            elif date_from:
-                report_details = f"{report_details} (from {date_from})"
-            elif date_to:
-                report_details = f"{report_details} (until {date_to})"
+    elif date_from and date_to:
+        report_details = f"{report_details} ({date_from} to {date_to})"
+    elif date_from:
+        report_details = f"{report_details} (from {date_from})"
+    elif date_to:
+        report_details = f"{report_details} (until {date_to})"
 
     if match_stage:
         pipeline.append({"$match": match_stage})
+    if not lesson_date:
+        # archived terms only exist as monthly summaries
+        pipeline.append(archived_months_stage(section, subject, subject_match, date_from, date_to))
 
-    pipeline.extend([
-        {"$addFields": {"subject_code": {"$arrayElemAt": [{"$split": ["$subject", " "]}, 0]}}},
-        {"$group": {
-            "_id": {
-                "student_id": "$student_id",
-                "student_name": "$student_name",
-                "section": "$section",
-                "subject_code": "$subject_code",
-            },
-            "lates_per_subject": {"$sum": {"$cond": [{"$eq": ["$late", True]}, 1, 0]}},
-            "absences_per_subject": {"$sum": {"$cond": [{"$eq": ["$status", "Absent"]}, 1, 0]}},
-        }},
-        {"$project": {
-            "student_id": "$_id.student_id",
-            "student_name": "$_id.student_name",
-            "section": "$_id.section",
-            "subject_code": "$_id.subject_code",
-            "lates_per_subject": 1,
-            "absences_per_subject": 1,
-            "extra_absences_from_lates": {
-                "$floor": {"$divide": [{"$ifNull": ["$lates_per_subject", 0]}, 3]}
-            },
-            "residual_lates": {"$mod": [{"$ifNull": ["$lates_per_subject", 0]}, 3]},
-        }},
-    ])
+    pipeline.extend(SUMMARY_PER_SUBJECT_STAGES)
 
     per_subjects_snapshot = None
     if debug:
-        per_subjects_snapshot = list(att_col.aggregate(pipeline))
+        per_subjects_snapshot = await rollups_col.aggregate(pipeline).to_list(None)
 
-    pipeline.extend([
-        {"$group": {
-            "_id": {
-                "student_id": "$student_id",
-                "student_name": "$student_name",
-                "section": "$section",
-            },
-            "total_lates": {"$sum": "$residual_lates"},
-            "total_absences": {
-                "$sum": {"$add": ["$absences_per_subject", "$extra_absences_from_lates"]}
-            },
-        }},
-        {"$project": {
-            "_id": 0,
-            "student_id": "$_id.student_id",
-            "student_name": "$_id.student_name",
-            "section": "$_id.section",
-            "total_lates": 1,
-            "total_absences": 1,
-        }},
-        {"$sort": {"student_name": 1}},
-    ])
+    pipeline.extend(SUMMARY_PER_STUDENT_STAGES)
 
-    results = list(att_col.aggregate(pipeline))
+    results = await rollups_col.aggregate(pipeline).to_list(None)
     if debug:
         return {"report_details": report_details.strip(), "student_summaries": results, "debug": {"per_subjects": per_subjects_snapshot}}
     return {"report_details": report_details.strip(), "student_summaries": results}
 
 @router.post("/attendance/section-totals", tags=["Reports"], response_model=AttendanceReport)
-async def attendance_section_totals(request: Request, payload: SectionTotalsRequest) -> Dict[str, Any]:
-    client = get_mongo_client(request)
-    ensure_mongo_available(client, request)
-    db = client[DB_NAME]
-    att_col = db["subject_attendance"]
+async def attendance_section_totals(request: Request, payload: SectionTotalsRequest, db=Depends(get_mongo_db)):
+    return await cached_report(
+        request, ("section-totals", payload.section),
+        lambda: _section_totals(db, payload.section),
+        section=payload.section,
+    )
+
+async def _section_totals(db, section: str) -> Dict[str, Any]:
+    rollups_col = db[ROLLUPS_COL]
 
     pipeline: List[Dict[str, Any]] = [
         # {"$match": {"section": {"$regex": f"^{payload.section}$", "$options": "i"}}},
-        {"$match": {"section": payload.section}},
+        {"$match": {"section": section}},
+        archived_months_stage(section),
         {"$group": {
             "_id": {
                 "student_id": "$student_id",
                 "student_name": "$student_name",
                 "section": "$section",
             },
-            "total_lates": {
-                "$sum": {"$cond": [{"$eq": [{"$ifNull": ["$late", False]}, True]}, 1, 0]}
-            },
-            "total_absences": {
-                "$sum": {"$cond": [{"$eq": [{"$ifNull": ["$status", ""]}, "Absent"]}, 1, 0]}
-            },
+            "total_lates": {"$sum": "$late"},
+            "total_absences": {"$sum": "$absent"},
         }},
         {"$project": {
             "_id": 0,
@@ -160,8 +214,115 @@ async def attendance_section_totals(request: Request, payload: SectionTotalsRequ
         {"$sort": {"student_name": 1}},
     ]
 
-    results = list(att_col.aggregate(pipeline))
+    results = await rollups_col.aggregate(pipeline).to_list(None)
     return {
-        "report_details": f"Totals per student for Section: {payload.section}",
+        "report_details": f"Totals per student for Section: {section}",
         "student_summaries": results,
     }
+
+
+RECORD_EXPORT_COLUMNS = [
+    "lesson_date", "section", "subject", "subject_code", "student_id", "student_name", "status",
+    "late", "left_early", "converted_to_absence", "time_in", "time_out", "total_break_seconds", "remarks",
+]
+SUMMARY_EXPORT_COLUMNS = ["student_id", "student_name", "section", "total_lates", "total_absences"]
+
+
+def _export_cell(value: Any) -> Any:
+    # xlsx/csv cells: scalars as they are, anything else (ObjectId, datetime, lists) as text
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    return str(value)
+
+
+async def _export_batches(cursor, columns: List[str]) -> AsyncIterator[List[List[Any]]]:
+    batch: List[List[Any]] = []
+    try:
+        async for doc in cursor:
+            batch.append([_export_cell(doc.get(col)) for col in columns])
+            if len(batch) >= EXPORT_BATCH_ROWS:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+    finally:
+        await cursor.close()
+
+
+async def _csv_stream(cursor, columns: List[str]) -> AsyncIterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    # BOM so Excel opens UTF-8 names and subjects correctly
+    buffer.write("\ufeff")
+    writer.writerow(columns)
+    async for batch in _export_batches(cursor, columns):
+        writer.writerows(batch)
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
+
+
+async def _xlsx_stream(cursor, columns: List[str], title: str) -> AsyncIterator[bytes]:
+    from openpyxl import Workbook
+
+    # write-only mode keeps rows on disk, not as cell objects; the finished file is streamed back
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet(title)
+    sheet.append(columns)
+    async for batch in _export_batches(cursor, columns):
+        await run_in_threadpool(lambda rows=batch: [sheet.append(row) for row in rows])
+    with tempfile.TemporaryFile() as out:
+        await run_in_threadpool(workbook.save, out)
+        out.seek(0)
+        while True:
+            chunk = await run_in_threadpool(out.read, 1 << 20)
+            if not chunk:
+                break
+            yield chunk
+
+
+@router.get("/export", tags=["Reports"])
+async def export_attendance(
+    format: str = Query("csv", pattern="^(csv|xlsx)$", description="csv or xlsx"),
+    kind: str = Query("records", pattern="^(records|summary)$", description="records: one row per attendance record; summary: per-student totals"),
+    date_from: Optional[str] = Query(None, description="Start date (YYYY-MM-DD)"),
+    date_to: Optional[str] = Query(None, description="End date (YYYY-MM-DD)"),
+    section: Optional[str] = Query(None, description="Filter by section"),
+    subject: Optional[str] = Query(None, description="Filter by subject"),
+    subject_match: str = Query("contains", pattern=f"^({'|'.join(SUBJECT_MATCH_MODES)})$"),
+    db=Depends(get_mongo_db),
+):
+    """
+    Downloads attendance over a date range as a file, streamed straight from a MongoDB cursor
+    in batches of EXPORT_BATCH_ROWS, so memory stays flat for a term or a year of records.
+    - records are exported in _id (insertion) order
+    - summary applies the same 3-lates-per-absence rule as /reports/attendance-summary and includes
+      archived months lying inside the range; records only cover the live (unarchived) terms
+    """
+    match = report_match(section, subject, subject_match, date_from=date_from, date_to=date_to)
+
+    if kind == "records":
+        columns = RECORD_EXPORT_COLUMNS
+        cursor = db[COL_NAME].find(match, {col: 1 for col in columns}).sort("_id", 1).batch_size(EXPORT_BATCH_ROWS)
+    else:
+        columns = SUMMARY_EXPORT_COLUMNS
+        pipeline = (
+            ([{"$match": match}] if match else [])
+            + [archived_months_stage(section, subject, subject_match, date_from, date_to)]
+            + SUMMARY_PER_SUBJECT_STAGES + SUMMARY_PER_STUDENT_STAGES
+        )
+        cursor = db[ROLLUPS_COL].aggregate(pipeline, allowDiskUse=True, batchSize=EXPORT_BATCH_ROWS)
+
+    name = "_".join(part for part in ["attendance", kind, section, date_from, date_to] if part)
+    if format == "xlsx":
+        body = _xlsx_stream(cursor, columns, kind)
+        media_type = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+    else:
+        body = _csv_stream(cursor, columns)
+        media_type = "text/csv; charset=utf-8"
+    return StreamingResponse(body, media_type=media_type, headers={
+        "Content-Disposition": f'attachment; filename="{name}.{format}"',
+        "Cache-Control": "no-store",
+    })
@@ -1,23 +1,14 @@
-from fastapi import APIRouter, HTTPException, status
-from beanie import PydanticObjectId
+from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi.encoders import jsonable_encoder
+from bson import ObjectId
 from models.user import Student
-from models.subject_attendance import SubjectAttendance
+from core.student_directory import student_directory, signal_students_changed
 from pydantic import BaseModel
 from typing import Optional
-from motor.motor_asyncio import AsyncIOMotorClient
-from dotenv import load_dotenv
-import os
-
-load_dotenv()
+from .attendance_utils import get_mongo_db, student_edit_jobs
 
 router = APIRouter()
 
-# --- Direct MongoDB client for legacy attendance collection ---
-MONGODB_URI = os.getenv("MONGO_URI")
-client = AsyncIOMotorClient(MONGODB_URI)
-db = client["attendance_system"]
-legacy_collection = db["subject_attendance"]
-
 
 # --- Schema for updating ---
 class UpdateStudentIn(BaseModel):
@@ -43,10 +34,12 @@ class StudentOut(BaseModel):
     seat_col: int
     is_active: bool
     role: str
+    # background job carrying the edit into the attendance history, see GET /edit/jobs/{job_id}
+    propagation_job_id: Optional[str] = None
 
 
 @router.put("/students/{student_id_no}", response_model=StudentOut, status_code=status.HTTP_200_OK)
-async def update_student(student_id_no: str, payload: UpdateStudentIn):
+async def update_student(student_id_no: str, payload: UpdateStudentIn, db=Depends(get_mongo_db)):
     # Find student by student_id_no
     student = await Student.find_one(Student.student_id_no == student_id_no)
     if not student:
@@ -67,34 +60,24 @@ async def update_student(student_id_no: str, payload: UpdateStudentIn):
             raise HTTPException(status_code=400, detail="Student ID already registered")
 
     # --- Update the Student record ---
+    old_rfid_uid, old_student_id_no, old_section = student.rfid_uid, student.student_id_no, student.section
+    old_name = f"{student.first_name} {student.last_name}".strip()
     await student.set(update_data)
+    student_directory.invalidate(rfid_uid=old_rfid_uid, student_id_no=old_student_id_no)
+    student_directory.invalidate(rfid_uid=student.rfid_uid, student_id_no=student.student_id_no)
+    await signal_students_changed(db)
 
-    # --- Prepare synced fields for attendance ---
+    # --- Carry name / section / student ID changes into the history in the background ---
+    propagation_job_id = None
     new_name = f"{student.first_name} {student.last_name}".strip()
-    new_section = student.section
-
-    # --- ✅ Update all SubjectAttendance documents (Beanie-managed) ---
-    await SubjectAttendance.find(
-        SubjectAttendance.student_id == PydanticObjectId(student.id)
-    ).update_many(
-        {
-            "$set": {
-                "student_name": new_name,
-                "section": new_section,
-            }
-        }
-    )
-
-    # --- ✅ Update legacy collection directly (matches by student_id_no field) ---
-    await legacy_collection.update_many(
-        {"student_id": student.student_id_no},  # legacy collection uses string IDs
-        {
-            "$set": {
-                "student_name": new_name,
-                "section": new_section,
-            }
-        }
-    )
+    if (new_name, student.section, student.student_id_no) != (old_name, old_section, old_student_id_no):
+        propagation_job_id = await student_edit_jobs.enqueue(db, "student_edit", {
+            "old_student_id_no": old_student_id_no,
+            "student_id_no": student.student_id_no,
+            "student_name": new_name,
+            "section": student.section,
+            "old_section": old_section,
+        })
 
     # --- Return updated student info ---
     return StudentOut(
@@ -108,4 +91,14 @@ async def update_student(student_id_no: str, payload: UpdateStudentIn):
         seat_col=student.seat_col,
         is_active=student.is_active,
         role=student.role,
+        propagation_job_id=propagation_job_id,
     )
+
+
+@router.get("/jobs/{job_id}", status_code=status.HTTP_200_OK)
+async def get_propagation_job(job_id: str, db=Depends(get_mongo_db)):
+    """Status and progress (phase, documents rewritten) of a student edit propagation job."""
+    job = await student_edit_jobs.get(db, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return jsonable_encoder(job, custom_encoder={ObjectId: str})
@@ -1,11 +1,10 @@
-from fastapi import APIRouter, Request, Query
+from fastapi import APIRouter, Depends, Request, Query
 from typing import Optional, List
 from pydantic import BaseModel, Field
-from .attendance_utils import get_mongo_client, ensure_mongo_available
+from .attendance_utils import get_mongo_db
 from models.class_schedule import Schedule
 
 router = APIRouter()
-DB_NAME = "attendance_system"
 
 ClassSchedule = Schedule
 
@@ -13,20 +12,18 @@ ClassSchedule = Schedule
 async def get_class_schedules(
     request: Request,
     section: Optional[str] = Query(None, description="Filter by section"),
+    db=Depends(get_mongo_db),
 ):
     """
     Retrieve all class schedules from MongoDB, optionally filtered by section.
     """
-    client = get_mongo_client(request)
-    ensure_mongo_available(client, request)
-    db = client[DB_NAME]
     sched_col = db["class_schedules"]
 
     query = {}
     if section:
         query["section"] = section
 
-    schedules = list(sched_col.find(query))
+    schedules = await sched_col.find(query).to_list(None)
 
     # Convert ObjectId and datetime fields to string for JSON serialization
     for sched in schedules:
@@ -1,10 +1,21 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Query, Response
-from pydantic import BaseModel, Field
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Response, Request
+from pydantic import BaseModel, Field, ValidationError
+from beanie import PydanticObjectId
+from decouple import config
+from pymongo.errors import BulkWriteError
 from models.user import Student
 from core.dependencies import role_required   
-from typing import List, Optional
+from core.student_directory import student_directory, signal_students_changed
+from db.connection import get_db
+from typing import Any, Dict, List, Literal, Optional, Tuple
+import csv
+import io
+import json
 
 router = APIRouter()
+STUDENT_IMPORT_MAX_ROWS = config("STUDENT_IMPORT_MAX_ROWS", default=5000, cast=int)
+# where csv.DictReader puts the cells of a row that has more of them than the header
+EXTRA_CELLS_KEY = "__extra_cells__"
 
 # Schemas 
 class StudentCreate(BaseModel):
@@ -26,6 +37,53 @@ class StudentOut(BaseModel):
     seat_col: int
     rfid_uid: str
 
+class StudentImportRow(BaseModel):
+    index: int
+    student_id_no: Optional[str] = None
+    status: Literal["created", "valid", "error"]
+    id: Optional[str] = None
+    errors: List[str] = []
+
+class StudentImportResponse(BaseModel):
+    received: int
+    created: int
+    failed: int
+    dry_run: bool
+    results: List[StudentImportRow]
+
+# Helpers
+def _parse_rows(raw: bytes, fmt: str) -> List[Dict[str, Any]]:
+    text = raw.decode("utf-8-sig")
+    if fmt == "json":
+        data = json.loads(text)
+        if isinstance(data, dict):
+            data = data.get("students")
+        if not isinstance(data, list) or not all(isinstance(row, dict) for row in data):
+            raise ValueError("JSON body must be a list of student objects or {\"students\": [...]}")
+        return data
+    reader = csv.DictReader(io.StringIO(text), restkey=EXTRA_CELLS_KEY)
+    rows = []
+    for row in reader:
+        # cells past the header; blank ones (a trailing comma) are ignored, others fail the row
+        extra = [v for v in row.pop(EXTRA_CELLS_KEY, []) if v.strip() != ""]
+        # header names are matched case-insensitively; blank cells count as missing
+        parsed: Dict[str, Any] = {k.strip().lower(): v.strip() for k, v in row.items() if k is not None and v is not None and v.strip() != ""}
+        if extra:
+            parsed[EXTRA_CELLS_KEY] = extra
+        rows.append(parsed)
+    return rows
+
+async def _read_import_body(request: Request) -> Tuple[bytes, str]:
+    content_type = request.headers.get("content-type", "")
+    if content_type.startswith("multipart/form-data"):
+        form = await request.form()
+        upload = form.get("file")
+        if upload is None or isinstance(upload, str):
+            raise HTTPException(status.HTTP_400_BAD_REQUEST, "Upload the roster as the 'file' field")
+        is_json = (upload.filename or "").lower().endswith(".json") or "json" in (upload.content_type or "")
+        return await upload.read(), "json" if is_json else "csv"
+    return await request.body(), "json" if "json" in content_type else "csv"
+
 # Routes 
 @router.post(
     "/create",
@@ -59,6 +117,8 @@ async def create_student(payload: StudentCreate):
         seat_col=payload.seat_col,
     )
     await student.insert()
+    student_directory.invalidate(rfid_uid=student.rfid_uid, student_id_no=student.student_id_no)
+    await signal_students_changed(get_db())
 
     return StudentOut(
         id=str(student.id),
@@ -72,6 +132,106 @@ async def create_student(payload: StudentCreate):
     )
 
 
+@router.post(
+    "/import",
+    response_model=StudentImportResponse,
+    dependencies=[Depends(role_required("teacher"))],
+)
+async def import_students(
+    request: Request,
+    dry_run: bool = Query(False, description="Validate only, insert nothing"),
+):
+    """
+    Bulk enrollment from a CSV (header row with the StudentCreate field names) or JSON roster,
+    sent as the request body or as a multipart 'file' field.
+    - every row is validated, then checked against earlier rows of the same upload and against
+      existing students fetched in one query (RFID, student ID, seat per section)
+    - the rows that pass go out in one unordered insert_many; the unique indexes on Student
+      still reject anything that slipped in concurrently, reported per row
+    Results are returned per row, in upload order.
+    """
+    raw, fmt = await _read_import_body(request)
+    try:
+        rows = _parse_rows(raw, fmt)
+    except (ValueError, UnicodeDecodeError, csv.Error) as e:
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, f"Could not read roster: {e}")
+    if len(rows) > STUDENT_IMPORT_MAX_ROWS:
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, f"An import can hold at most {STUDENT_IMPORT_MAX_ROWS} students.")
+
+    results = [
+        StudentImportRow(index=i, student_id_no=str(row["student_id_no"]) if row.get("student_id_no") is not None else None, status="error")
+        for i, row in enumerate(rows)
+    ]
+    valid: List[Tuple[int, StudentCreate]] = []
+    for i, row in enumerate(rows):
+        if EXTRA_CELLS_KEY in row:
+            results[i].errors = [f"Row has {len(row[EXTRA_CELLS_KEY])} more cell(s) than the header"]
+            continue
+        try:
+            valid.append((i, StudentCreate(**row)))
+        except ValidationError as e:
+            results[i].errors = [f"{'.'.join(str(p) for p in err['loc'])}: {err['msg']}" for err in e.errors()]
+
+    # one round trip for every key the upload could collide with
+    taken_rfid: Dict[str, str] = {}
+    taken_id_no: Dict[str, str] = {}
+    taken_seat: Dict[Tuple[str, int, int], str] = {}
+    if valid:
+        existing = await Student.find({"$or": [
+            {"rfid_uid": {"$in": list({p.rfid_uid for _, p in valid})}},
+            {"student_id_no": {"$in": list({p.student_id_no for _, p in valid})}},
+            {"section": {"$in": list({p.section for _, p in valid})}},
+        ]}).to_list()
+        for s in existing:
+            taken_rfid[s.rfid_uid] = f"RFID already assigned to {s.student_id_no}"
+            taken_id_no[s.student_id_no] = "Student ID already exists"
+            taken_seat[(s.section, s.seat_row, s.seat_col)] = f"Seat already taken in this section by {s.student_id_no}"
+
+    to_insert: List[Tuple[int, Student]] = []
+    for i, payload in valid:
+        seat = (payload.section, payload.seat_row, payload.seat_col)
+        errors = [
+            msg for msg in (
+                taken_rfid.get(payload.rfid_uid),
+                taken_id_no.get(payload.student_id_no),
+                taken_seat.get(seat),
+            ) if msg
+        ]
+        if errors:
+            results[i].errors = errors
+            continue
+        # later rows of the same upload collide with this one
+        taken_rfid[payload.rfid_uid] = f"RFID duplicates row {i}"
+        taken_id_no[payload.student_id_no] = f"Student ID duplicates row {i}"
+        taken_seat[seat] = f"Seat duplicates row {i}"
+        to_insert.append((i, Student(id=PydanticObjectId(), role="student", **payload.model_dump())))
+
+    if dry_run:
+        for i, _ in to_insert:
+            results[i].status = "valid"
+    elif to_insert:
+        failed = {}
+        try:
+            await Student.insert_many([student for _, student in to_insert], ordered=False)
+        except BulkWriteError as e:
+            failed = {err["index"]: err.get("errmsg", "Insert failed") for err in e.details.get("writeErrors", [])}
+        for pos, (i, student) in enumerate(to_insert):
+            if pos in failed:
+                results[i].errors = [failed[pos]]
+                continue
+            results[i].status, results[i].id = "created", str(student.id)
+            student_directory.invalidate(rfid_uid=student.rfid_uid, student_id_no=student.student_id_no)
+        await signal_students_changed(get_db())
+
+    return {
+        "received": len(rows),
+        "created": sum(1 for r in results if r.status == "created"),
+        "failed": sum(1 for r in results if r.status == "error"),
+        "dry_run": dry_run,
+        "results": results,
+    }
+
+
 @router.get(
     "/",
     response_model=List[StudentOut],
@@ -165,4 +325,6 @@ async def delete_student(student_id_no: str):
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Student not found")
 
     await student.delete()
+    student_directory.invalidate(rfid_uid=student.rfid_uid, student_id_no=student.student_id_no)
+    await signal_students_changed(get_db())
     return Response(status_code=status.HTTP_204_NO_CONTENT)
\ No newline at end of file
@@ -0,0 +1,124 @@
+import argparse
+import asyncio
+import calendar
+import gzip
+import os
+from datetime import date
+from bson import json_util
+from db.connection import get_db
+from api.attendance_utils import (
+    COL_NAME,
+    ROLLUPS_COL,
+    ARCHIVE_COL,
+    MONTHLY_COL,
+    ensure_indexes,
+)
+from backfill_late_counters import backfill_late_counters
+
+DELETE_BATCH = 1000
+
+# Moves closed terms out of subject_attendance, one calendar month at a time:
+# 1. copy the month's records into subject_attendance_archive (and optionally a .jsonl.gz file)
+# 2. (re)build its per student+subject summaries in attendance_monthly from the archived copy
+# 3. delete the archived records and their rollups from the live collections
+# Every step is safe to repeat, so an interrupted run is finished by running it again.
+# Reports merge attendance_monthly back in; late counters are recounted from the live records
+# afterwards, so lates of archived terms no longer count toward absences.
+
+
+def month_bounds(month: str):
+    year, mon = int(month[:4]), int(month[5:7])
+    return f"{month}-01", f"{month}-{calendar.monthrange(year, mon)[1]:02d}"
+
+
+async def archive_month(db, month: str, files_dir):
+    month_start, month_end = month_bounds(month)
+    in_month = {"lesson_date": {"$gte": month_start, "$lte": month_end}}
+
+    await db[COL_NAME].aggregate([
+        {"$match": in_month},
+        {"$merge": {"into": ARCHIVE_COL, "on": "_id", "whenMatched": "keepExisting", "whenNotMatched": "insert"}},
+    ], allowDiskUse=True).to_list(None)
+
+    await db[ARCHIVE_COL].aggregate([
+        {"$match": in_month},
+        {"$group": {
+            "_id": {"student_id": "$student_id", "subject": "$subject", "month": month},
+            "student_id": {"$last": "$student_id"},
+            "student_name": {"$last": "$student_name"},
+            "section": {"$last": "$section"},
+            "subject": {"$last": "$subject"},
+            "subject_key": {"$last": {"$toLower": "$subject"}},
+            "late": {"$sum": {"$cond": [{"$eq": ["$late", True]}, 1, 0]}},
+            "absent": {"$sum": {"$cond": [{"$eq": ["$status", "Absent"]}, 1, 0]}},
+            "records": {"$sum": 1},
+        }},
+        {"$set": {
+            "subject_code": {"$arrayElemAt": [{"$split": ["$subject", " "]}, 0]},
+            "month": month,
+            "month_start": month_start,
+            "month_end": month_end,
+        }},
+        {"$merge": {"into": MONTHLY_COL, "on": "_id", "whenMatched": "replace", "whenNotMatched": "insert"}},
+    ], allowDiskUse=True).to_list(None)
+
+    archived = 0
+    out = None
+    if files_dir:
+        path = os.path.join(files_dir, f"{COL_NAME}-{month}.jsonl.gz")
+        out = gzip.open(path + ".tmp", "wt", encoding="utf-8")
+    try:
+        ids = []
+        async for doc in db[ARCHIVE_COL].find(in_month).sort("_id", 1):
+            if out:
+                out.write(json_util.dumps(doc, ensure_ascii=False) + "\n")
+            ids.append(doc["_id"])
+            if len(ids) >= DELETE_BATCH:
+                archived += (await db[COL_NAME].delete_many({"_id": {"$in": ids}})).deleted_count
+                ids = []
+        if ids:
+            archived += (await db[COL_NAME].delete_many({"_id": {"$in": ids}})).deleted_count
+    finally:
+        if out:
+            out.close()
+            os.replace(path + ".tmp", path)
+
+    await db[ROLLUPS_COL].delete_many(in_month)
+    summaries = await db[MONTHLY_COL].count_documents({"month": month})
+    print(f"{month}: moved {archived} records, {summaries} monthly summaries.")
+
+
+async def archive_terms(before: str, files_dir, compact: bool):
+    print("--- Starting Term Archive ---")
+    db = get_db()
+    await ensure_indexes(db)
+    # whole months only: the cutoff is the first day of the month of --before
+    cutoff = date.fromisoformat(before).replace(day=1).isoformat()
+    months = await db[COL_NAME].aggregate([
+        {"$match": {"lesson_date": {"$lt": cutoff}}},
+        {"$group": {"_id": {"$substrCP": ["$lesson_date", 0, 7]}}},
+        {"$sort": {"_id": 1}},
+    ]).to_list(None)
+    if files_dir:
+        os.makedirs(files_dir, exist_ok=True)
+    print(f"Archiving {len(months)} month(s) before {cutoff}.")
+    for month in months:
+        await archive_month(db, month["_id"], files_dir)
+
+    if months:
+        await backfill_late_counters()
+    if compact:
+        # returns freed space to the OS; blocks writes to the collection on older servers
+        for name in (COL_NAME, ROLLUPS_COL):
+            await db.command("compact", name)
+            print(f"Compacted {name}.")
+    print("--- Archive Complete! ---")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Archive closed terms of subject_attendance into monthly summaries")
+    parser.add_argument("--before", required=True, help="first day of the live term (YYYY-MM-DD); rounded down to the month")
+    parser.add_argument("--files", help="also write each archived month as <dir>/subject_attendance-YYYY-MM.jsonl.gz")
+    parser.add_argument("--compact", action="store_true", help="run compact on the live collections afterwards")
+    args = parser.parse_args()
+    asyncio.run(archive_terms(args.before, args.files, args.compact))
@@ -0,0 +1,28 @@
+import asyncio
+from datetime import datetime
+from db.connection import get_db
+from api.attendance_utils import LATE_COUNTERS_COL, LATES_FOR_ABSENCE
+
+# Seeds late_counters from the existing subject_attendance history.
+# Run once after deploying the counters, ideally outside class hours.
+async def backfill_late_counters():
+    print("--- Starting Late Counter Backfill ---")
+    db = get_db()
+    pipeline = [
+        {"$match": {"late": True, "converted_to_absence": {"$ne": True}}},
+        # same _id shape as api.attendance_utils.late_counter_id
+        {"$group": {
+            "_id": {"student_id": "$student_id", "subject": "$subject"},
+            "pending": {"$sum": 1},
+        }},
+        {"$set": {"updated_at": datetime.utcnow()}},
+        {"$out": LATE_COUNTERS_COL},
+    ]
+    await db["subject_attendance"].aggregate(pipeline).to_list(None)
+    seeded = await db[LATE_COUNTERS_COL].count_documents({})
+    ready = await db[LATE_COUNTERS_COL].count_documents({"pending": {"$gte": LATES_FOR_ABSENCE}})
+    print(f"Seeded {seeded} counters ({ready} already at the conversion threshold; they convert on the next late).")
+    print("--- Backfill Complete! ---")
+
+if __name__ == "__main__":
+    asyncio.run(backfill_late_counters())
@@ -0,0 +1,234 @@
+"""
+Benchmark of GET /attendance/records on a large collection: the old handler, which loaded every
+matching record with to_list() and returned them as one JSON body, against the paginated json
+pages and the ndjson stream that replaced it.
+
+Seeds --records subject_attendance documents into a dedicated database (never the real one
+unless --allow-main-db is given; an existing seed of the same size is reused), then for each
+variant starts a fresh uvicorn server, reads the whole result over HTTP and reports time to
+first byte, total time, bytes received and the server's peak RSS. Needs a mongod at MONGO_URI,
+like loadtest.py.
+
+    MONGO_URI=mongodb://localhost:27017 python bench_records.py --records 1000000 --out records.json
+
+Peak RSS is the server's VmHWM from /proc, so it is only reported on Linux.
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import subprocess
+import sys
+import time
+from typing import Any, Dict, List, Optional
+
+# must happen before db.connection creates the client
+os.environ.setdefault("MONGO_DB_NAME", "attendance_bench")
+
+import httpx
+from db.connection import init_db, get_db, MONGO_DB_NAME
+
+SUBJECTS = ["MATH 101", "SCI 102", "ENG 103", "FIL 104", "HIST 105", "PE 106", "ICT 107", "ART 108"]
+LESSON_DAYS = 250
+RECORDS_PER_STUDENT = LESSON_DAYS * len(SUBJECTS)
+VARIANTS = ("legacy", "pages", "ndjson")
+
+
+def record(n: int) -> Dict[str, Any]:
+    """The n-th seeded record; (student_id, lesson_date, subject) is unique for every n."""
+    lesson_date = datetime.date(2025, 6, 2) + datetime.timedelta(days=n % LESSON_DAYS)
+    time_in = datetime.datetime.combine(lesson_date, datetime.time(7, 30 + n % 20))
+    late = n % 20 >= 10
+    return {
+        "student_id": f"BR{n // RECORDS_PER_STUDENT:06d}",
+        "student_name": f"Student{n // RECORDS_PER_STUDENT:06d} Bench",
+        "section": f"BR{n // RECORDS_PER_STUDENT % 50:02d}",
+        "subject": SUBJECTS[n // LESSON_DAYS % len(SUBJECTS)],
+        "lesson_date": lesson_date.isoformat(),
+        "time_in": time_in.strftime("%Y-%m-%dT%H:%M:%SZ"),
+        "time_out": (time_in + datetime.timedelta(minutes=55)).strftime("%Y-%m-%dT%H:%M:%SZ"),
+        "status": "Late" if late else "Present",
+        "late": late,
+        "left_early": False,
+        "breaks": [],
+        "from_device": "rfid",
+        "created_at": time_in,
+        "updated_at": time_in,
+    }
+
+
+async def seed(count: int, reseed: bool):
+    await init_db()
+    col = get_db()["subject_attendance"]
+    if not reseed and await col.estimated_document_count() == count:
+        print(f"Reusing {count} records already in '{MONGO_DB_NAME}'")
+        return
+    await col.drop()
+    await init_db()  # recreate the Beanie indexes on the dropped collection
+    batch = 10000
+    for start in range(0, count, batch):
+        await col.insert_many([record(n) for n in range(start, min(start + batch, count))], ordered=False)
+    print(f"Seeded {count} records into '{MONGO_DB_NAME}'")
+
+
+def serve(port: int):
+    """The app as deployed, plus the pre-pagination handler under /attendance/records-legacy."""
+    import uvicorn
+    from bson import ObjectId
+    from fastapi import APIRouter, Depends
+    from fastapi.encoders import jsonable_encoder
+    from api.attendance_utils import get_mongo_db
+    from main import app
+    from models.attendance_schema import AttendanceRecordsResponse
+
+    router = APIRouter()
+
+    @router.get("/attendance/records-legacy", response_model=AttendanceRecordsResponse)
+    async def legacy_records(db=Depends(get_mongo_db)):
+        records = await db["subject_attendance"].find({}).to_list(None)
+        return {"records": jsonable_encoder(records, custom_encoder={ObjectId: str})}
+
+    app.include_router(router)
+    uvicorn.run(app, host="127.0.0.1", port=port, log_level="warning")
+
+
+def peak_rss_mb(pid: int) -> Optional[float]:
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+async def read_legacy(client: httpx.AsyncClient, page_size: int) -> Dict[str, Any]:
+    async with client.stream("GET", "/attendance/records-legacy") as response:
+        response.raise_for_status()
+        chunks, first_byte = [], None
+        async for chunk in response.aiter_bytes():
+            first_byte = first_byte or time.perf_counter()
+            chunks.append(chunk)
+    body = b"".join(chunks)
+    return {"first_byte": first_byte, "bytes": len(body), "records": len(json.loads(body)["records"])}
+
+
+async def read_pages(client: httpx.AsyncClient, page_size: int) -> Dict[str, Any]:
+    first_byte, size, records, pages, after = None, 0, 0, 0, None
+    while True:
+        params = {"limit": page_size, **({"after": after} if after else {})}
+        async with client.stream("GET", "/attendance/records", params=params) as response:
+            response.raise_for_status()
+            chunks = []
+            async for chunk in response.aiter_bytes():
+                first_byte = first_byte or time.perf_counter()
+                chunks.append(chunk)
+        body = b"".join(chunks)
+        page = json.loads(body)
+        size, records, pages = size + len(body), records + len(page["records"]), pages + 1
+        after = page["next_after"]
+        if not after:
+            return {"first_byte": first_byte, "bytes": size, "records": records, "pages": pages}
+
+
+async def read_ndjson(client: httpx.AsyncClient, page_size: int) -> Dict[str, Any]:
+    first_byte, size, records = None, 0, 0
+    async with client.stream("GET", "/attendance/records", params={"format": "ndjson"}) as response:
+        response.raise_for_status()
+        async for chunk in response.aiter_bytes():
+            first_byte = first_byte or time.perf_counter()
+            size += len(chunk)
+            records += chunk.count(b"\n")
+    return {"first_byte": first_byte, "bytes": size, "records": records}
+
+
+READERS = {"legacy": read_legacy, "pages": read_pages, "ndjson": read_ndjson}
+
+
+async def wait_ready(client: httpx.AsyncClient, server: subprocess.Popen, timeout: float = 60):
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        if server.poll() is not None:
+            sys.exit(f"Server exited with status {server.returncode}")
+        try:
+            if (await client.get("/health")).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        await asyncio.sleep(0.2)
+    sys.exit("Server did not become ready")
+
+
+async def measure(variant: str, port: int, page_size: int) -> Dict[str, Any]:
+    """One variant against a freshly started server, so its peak RSS is this request's alone."""
+    server = subprocess.Popen([sys.executable, os.path.abspath(__file__), "--serve", "--port", str(port)])
+    try:
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=None) as client:
+            await wait_ready(client, server)
+            idle_rss = peak_rss_mb(server.pid)
+            t0 = time.perf_counter()
+            read = await READERS[variant](client, page_size)
+            total = time.perf_counter() - t0
+        peak_rss = peak_rss_mb(server.pid)
+    finally:
+        server.terminate()
+        server.wait()
+    return {
+        "variant": variant,
+        "records": read["records"],
+        "pages": read.get("pages"),
+        "bytes": read["bytes"],
+        "ttfb_seconds": read["first_byte"] - t0 if read["first_byte"] else None,
+        "total_seconds": total,
+        "server_idle_rss_mb": idle_rss,
+        "server_peak_rss_mb": peak_rss,
+    }
+
+
+async def run(args) -> Dict[str, Any]:
+    if MONGO_DB_NAME == "attendance_system" and not args.allow_main_db:
+        sys.exit("Refusing to seed the production database; set MONGO_DB_NAME or pass --allow-main-db.")
+    await seed(args.records, args.reseed)
+    results: List[Dict[str, Any]] = []
+    for variant in args.variants:
+        print(f"Reading {args.records} records via {variant}...")
+        results.append(await measure(variant, args.port, args.page_size))
+    return {
+        "started_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "config": {"records": args.records, "page_size": args.page_size, "database": MONGO_DB_NAME},
+        "results": results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the old and new GET /attendance/records on a large collection")
+    parser.add_argument("--records", type=int, default=1_000_000)
+    parser.add_argument("--page-size", type=int, default=1000, help="limit of each json page")
+    parser.add_argument("--variants", nargs="+", choices=VARIANTS, default=list(VARIANTS))
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--reseed", action="store_true", help="drop and reseed even if the record count matches")
+    parser.add_argument("--out", default="bench-records-results.json")
+    parser.add_argument("--allow-main-db", action="store_true")
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.port)
+        return
+
+    print("--- Starting Records Benchmark ---")
+    result = asyncio.run(run(args))
+    with open(args.out, "w") as f:
+        json.dump(result, f, indent=2)
+    for r in result["results"]:
+        rss = f"{r['server_peak_rss_mb']:.0f} MB" if r["server_peak_rss_mb"] is not None else "n/a"
+        print(f"  {r['variant']:<7} {r['records']} records, {r['bytes'] / 1e6:.1f} MB: "
+              f"first byte {r['ttfb_seconds']:.2f}s, total {r['total_seconds']:.1f}s, server peak RSS {rss}")
+    print(f"Results written to {args.out}")
+    print("--- Benchmark Complete! ---")
+
+
+if __name__ == "__main__":
+    main()
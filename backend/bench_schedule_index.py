@@ -0,0 +1,116 @@
+"""
+Microbenchmark and equivalence check of the compiled schedule index against the per-tap
+schedule scan it replaced. Needs no database: the timetable is generated in memory.
+
+    python bench_schedule_index.py --schedules 300 --instants 20000
+
+Every instant is looked up both ways; any difference is printed and the exit status is 1.
+"""
+import argparse
+import datetime
+import random
+import sys
+import time
+from typing import Any, Dict, List, Optional
+
+from core.schedule_index import DAYS, ScheduleIndex
+
+LOCAL_TZ = datetime.timezone(datetime.timedelta(hours=8))
+
+
+def random_schedules(count: int, sections: int, rng: random.Random) -> List[Dict[str, Any]]:
+    """Stored like repopulate.py does: times on a placeholder date, some overnight and overlapping."""
+    placeholder = datetime.date(1970, 1, 1)
+    schedules = []
+    for i in range(count):
+        start = datetime.datetime.combine(placeholder, datetime.time(rng.randrange(24), rng.choice([0, 15, 30, 45])), tzinfo=LOCAL_TZ)
+        end = start + datetime.timedelta(minutes=rng.choice([20, 45, 60, 90, 180]))
+        schedules.append({
+            "_id": i,
+            "section": f"S{rng.randrange(sections):02d}",
+            "day": rng.choice(DAYS),
+            "subject": f"SUBJ{i}",
+            # as read back from MongoDB: naive UTC
+            "start_time": start.astimezone(datetime.timezone.utc).replace(tzinfo=None),
+            "end_time": end.astimezone(datetime.timezone.utc).replace(tzinfo=None),
+        })
+    # the (section, day, start_time) order of ScheduleIndex.load and of the old cursor
+    schedules.sort(key=lambda d: (d["section"], d["day"], d["start_time"]))
+    return schedules
+
+
+def legacy_lookup(by_section_day: Dict[Any, List[Dict[str, Any]]], section: str, now_dt: datetime.datetime) -> Optional[Dict[str, Any]]:
+    """The loop rfid_tap ran over find({"section", "day"}) before the index existed."""
+    weekday_short = now_dt.strftime("%a")
+    for schedule_doc in by_section_day.get((section, weekday_short), []):
+        start_time_from_db = schedule_doc.get("start_time")
+        end_time_from_db = schedule_doc.get("end_time")
+        if isinstance(start_time_from_db, datetime.datetime) and isinstance(end_time_from_db, datetime.datetime):
+            today_date_utc = now_dt.date()
+            start_dt_today = datetime.datetime.combine(today_date_utc, start_time_from_db.time()).replace(tzinfo=datetime.timezone.utc)
+            end_dt_today = datetime.datetime.combine(today_date_utc, end_time_from_db.time()).replace(tzinfo=datetime.timezone.utc)
+            if end_dt_today < start_dt_today:
+                end_dt_today += datetime.timedelta(days=1)
+            if start_dt_today <= now_dt < end_dt_today:
+                return schedule_doc
+    return None
+
+
+def compare(schedules: int, sections: int, instants: int, seed: int) -> Dict[str, Any]:
+    rng = random.Random(seed)
+    docs = random_schedules(schedules, sections, rng)
+    index = ScheduleIndex()
+    index.build(docs)
+    week_start = datetime.datetime(2026, 10, 12, tzinfo=datetime.timezone.utc)  # a Monday
+    queries = [
+        (f"S{rng.randrange(sections):02d}", week_start + datetime.timedelta(seconds=rng.randrange(7 * 24 * 3600)))
+        for _ in range(instants)
+    ]
+
+    # what the old find({"section", "day"}) returned, without the round trip
+    by_section_day: Dict[Any, List[Dict[str, Any]]] = {}
+    for doc in docs:
+        by_section_day.setdefault((doc["section"], doc["day"]), []).append(doc)
+
+    t0 = time.perf_counter()
+    legacy = [legacy_lookup(by_section_day, section, at) for section, at in queries]
+    legacy_seconds = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    compiled = [index.lookup(section, at) for section, at in queries]
+    compiled_seconds = time.perf_counter() - t0
+
+    mismatches = []
+    for (section, at), old, new in zip(queries, legacy, compiled):
+        if (old and old["_id"]) != (new and new.schedule["_id"]):
+            mismatches.append({"section": section, "at": at.isoformat(), "legacy": old and old["_id"], "index": new and new.schedule["_id"]})
+    return {
+        "schedules": schedules,
+        "instants": instants,
+        "active": sum(1 for r in legacy if r),
+        "mismatches": mismatches,
+        # the legacy scan also paid a MongoDB round trip per tap, not counted here
+        "legacy_us_per_lookup": legacy_seconds / instants * 1e6,
+        "index_us_per_lookup": compiled_seconds / instants * 1e6,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the compiled schedule index with the old per-tap scan")
+    parser.add_argument("--schedules", type=int, default=300)
+    parser.add_argument("--sections", type=int, default=10)
+    parser.add_argument("--instants", type=int, default=20000)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    result = compare(args.schedules, args.sections, args.instants, args.seed)
+    print(f"{result['instants']} lookups over {result['schedules']} schedules ({result['active']} inside a class)")
+    print(f"  old scan:       {result['legacy_us_per_lookup']:.2f} us/lookup (+ one query per tap)")
+    print(f"  compiled index: {result['index_us_per_lookup']:.2f} us/lookup")
+    print(f"  mismatches:     {len(result['mismatches'])}")
+    for mismatch in result["mismatches"][:10]:
+        print(f"    {mismatch}")
+    sys.exit(1 if result["mismatches"] else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+import asyncio
+import logging
+import time
+from typing import Any, Callable, Dict, List, Optional
+from decouple import config
+from pymongo.errors import BulkWriteError
+
+logger = logging.getLogger("batched_writer")
+
+WRITER_QUEUE_SIZE = config("WRITER_QUEUE_SIZE", default=10000, cast=int)
+WRITER_BATCH_SIZE = config("WRITER_BATCH_SIZE", default=500, cast=int)
+WRITER_FLUSH_SECONDS = config("WRITER_FLUSH_SECONDS", default=0.5, cast=float)
+
+_STOP = object()
+
+
+class BatchedWriter:
+    """
+    Write-behind queue for one collection.
+    Request handlers `submit()` events without awaiting the database; a background task
+    turns them into bulk_write operations with `build_ops` and flushes when `batch_size`
+    events are queued or `flush_seconds` have passed since the first one.
+    Events that cannot be queued or written are counted in `dropped`, never raised to the caller.
+    """
+
+    def __init__(
+        self,
+        collection: str,
+        build_ops: Callable[[List[Dict[str, Any]]], List[Any]],
+        queue_size: int = WRITER_QUEUE_SIZE,
+        batch_size: int = WRITER_BATCH_SIZE,
+        flush_seconds: float = WRITER_FLUSH_SECONDS,
+    ):
+        self.collection = collection
+        self.build_ops = build_ops
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self._db = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self.enqueued = 0
+        self.written = 0
+        self.dropped = 0
+        self.flushes = 0
+        self.last_flush_seconds = 0.0
+        self.max_flush_seconds = 0.0
+
+    def start(self, db) -> None:
+        self._db = db
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._task = asyncio.create_task(self._run())
+
+    def submit(self, event: Dict[str, Any]) -> bool:
+        if self._queue is None:
+            self.dropped += 1
+            logger.warning("%s writer is not running; dropped one event", self.collection)
+            return False
+        try:
+            self._queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.dropped += 1
+            logger.warning("%s writer queue is full; dropped one event", self.collection)
+            return False
+        self.enqueued += 1
+        return True
+
+    async def stop(self) -> None:
+        # drain everything already queued, then let the worker exit
+        if self._task is None:
+            return
+        await self._queue.put(_STOP)
+        await self._task
+        self._task = None
+        self._queue = None
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            first = await self._queue.get()
+            if first is _STOP:
+                return
+            batch = [first]
+            deadline = loop.time() + self.flush_seconds
+            stopping = False
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            await self._flush(batch)
+            if stopping:
+                return
+
+    async def _flush(self, batch: List[Dict[str, Any]]) -> None:
+        started = time.perf_counter()
+        try:
+            ops = self.build_ops(batch)
+            # ordered, so later events see earlier ones; a failing op is skipped and counted
+            while ops:
+                try:
+                    await self._db[self.collection].bulk_write(ops, ordered=True)
+                    self.written += len(ops)
+                    ops = []
+                except BulkWriteError as e:
+                    failed_at = (e.details.get("writeErrors") or [{}])[0].get("index", 0)
+                    logger.warning("%s writer skipped one operation: %s", self.collection, e.details.get("writeErrors"))
+                    self.written += failed_at
+                    self.dropped += 1
+                    ops = ops[failed_at + 1:]
+        except Exception:
+            self.dropped += len(batch)
+            logger.exception("%s writer failed to flush %d events", self.collection, len(batch))
+        finally:
+            self.flushes += 1
+            self.last_flush_seconds = time.perf_counter() - started
+            self.max_flush_seconds = max(self.max_flush_seconds, self.last_flush_seconds)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "collection": self.collection,
+            "queue_depth": self._queue.qsize() if self._queue else 0,
+            "queue_size": self.queue_size,
+            "enqueued": self.enqueued,
+            "written_ops": self.written,
+            "dropped": self.dropped,
+            "flushes": self.flushes,
+            "last_flush_seconds": self.last_flush_seconds,
+            "max_flush_seconds": self.max_flush_seconds,
+        }
@@ -0,0 +1,189 @@
+import asyncio
+import datetime
+import logging
+from typing import Any, Awaitable, Callable, Dict, Optional
+from decouple import config
+from pymongo.errors import DuplicateKeyError
+
+from core.schedule_index import ActiveClass, ScheduleIndex, schedule_index as default_index
+
+logger = logging.getLogger("class_closer")
+
+CLASS_CLOSER_DELAY_SECONDS = config("CLASS_CLOSER_DELAY_SECONDS", default=120, cast=int)
+CLASS_CLOSER_MAX_SLEEP_SECONDS = config("CLASS_CLOSER_MAX_SLEEP_SECONDS", default=300, cast=int)
+CLASS_CLOSER_CATCHUP_DAYS = config("CLASS_CLOSER_CATCHUP_DAYS", default=7, cast=int)
+CLASS_CLOSER_CLAIM_SECONDS = config("CLASS_CLOSER_CLAIM_SECONDS", default=600, cast=int)
+
+CLOSURES_COL = "class_closures"
+WATERMARK_ID = "_watermark"
+
+
+def closure_id(section: str, occurrence: ActiveClass) -> str:
+    return f"{section}|{occurrence.schedule.get('subject')}|{occurrence.start.isoformat()}"
+
+
+class ClassCloser:
+    """
+    Runs `close_class(db, section, occurrence)` once for every class occurrence of the
+    schedule index, CLASS_CLOSER_DELAY_SECONDS after its end so the last taps have landed.
+    - every occurrence is claimed in class_closures before it is closed, so neither a restart
+      nor another worker running the same closer closes it twice
+    - a claim still "closing" after claim_seconds (its worker died mid-close) is retried by the
+      next round of any worker, even once the watermark has moved past the occurrence
+    - a watermark in the same collection remembers how far closing got; after downtime the
+      missed occurrences (at most CLASS_CLOSER_CATCHUP_DAYS back) are closed on startup
+    - the very first run starts from now instead of closing the whole past
+    A failing occurrence stops the round without moving the watermark; it is retried next round.
+    """
+
+    def __init__(
+        self,
+        close_class: Callable[[Any, str, ActiveClass], Awaitable[int]],
+        index: ScheduleIndex = default_index,
+        delay_seconds: float = CLASS_CLOSER_DELAY_SECONDS,
+        max_sleep_seconds: float = CLASS_CLOSER_MAX_SLEEP_SECONDS,
+        catchup_days: int = CLASS_CLOSER_CATCHUP_DAYS,
+        claim_seconds: float = CLASS_CLOSER_CLAIM_SECONDS,
+    ):
+        self.close_class = close_class
+        self.index = index
+        self.delay = datetime.timedelta(seconds=delay_seconds)
+        self.max_sleep_seconds = max_sleep_seconds
+        self.catchup = datetime.timedelta(days=catchup_days)
+        self.claim = datetime.timedelta(seconds=claim_seconds)
+        self.watermark: Optional[datetime.datetime] = None
+        self.closed = 0
+        self.records_created = 0
+        self.skipped = 0
+        self.retried = 0
+        self.failures = 0
+        self.last_error: Optional[str] = None
+
+    async def _load_watermark(self, db, cutoff: datetime.datetime) -> datetime.datetime:
+        doc = await db[CLOSURES_COL].find_one({"_id": WATERMARK_ID})
+        if not doc:
+            return cutoff
+        watermark = doc["until"].replace(tzinfo=datetime.timezone.utc)
+        return max(watermark, datetime.datetime.now(datetime.timezone.utc) - self.catchup)
+
+    async def _claim(self, db, closure: str, section: str, occurrence: ActiveClass) -> bool:
+        """
+        Takes an occurrence for this worker: inserting its closure doc as "closing" succeeds
+        for one worker only. A claim older than claim_seconds (its worker died mid-close) is taken over.
+        """
+        now = datetime.datetime.now(datetime.timezone.utc)
+        try:
+            await db[CLOSURES_COL].insert_one({
+                "_id": closure,
+                "status": "closing",
+                "section": section,
+                "subject": occurrence.schedule.get("subject"),
+                "start": occurrence.start,
+                "end": occurrence.end,
+                "claimed_at": now,
+            })
+            return True
+        except DuplicateKeyError:
+            self.skipped += 1
+        stale = await db[CLOSURES_COL].update_one(
+            {"_id": closure, "status": "closing", "claimed_at": {"$lt": now - self.claim}},
+            {"$set": {"claimed_at": now}},
+        )
+        return stale.modified_count == 1
+
+    async def _close(self, db, closure: str, section: str, occurrence: ActiveClass) -> None:
+        """Closes a claimed occurrence and marks its claim closed."""
+        try:
+            created = await self.close_class(db, section, occurrence)
+        except Exception:
+            # let the next round (of any worker) retry it
+            await db[CLOSURES_COL].delete_one({"_id": closure, "status": "closing"})
+            raise
+        await db[CLOSURES_COL].update_one(
+            {"_id": closure},
+            {"$set": {
+                "status": "closed",
+                "records_created": created,
+                "closed_at": datetime.datetime.now(datetime.timezone.utc),
+            }},
+        )
+        self.closed += 1
+        self.records_created += created
+
+    async def _retry_abandoned(self, db) -> int:
+        """
+        Closes the occurrences whose claim is older than claim_seconds. Their range may lie
+        behind the watermark already (another worker skipped them and moved on), so they are
+        found through their claims, which carry everything close_class needs.
+        """
+        now = datetime.datetime.now(datetime.timezone.utc)
+        abandoned = await db[CLOSURES_COL].find({"status": "closing", "claimed_at": {"$lt": now - self.claim}}).to_list(None)
+        retried = 0
+        for doc in abandoned:
+            taken = await db[CLOSURES_COL].update_one(
+                {"_id": doc["_id"], "status": "closing", "claimed_at": doc["claimed_at"]},
+                {"$set": {"claimed_at": now}},
+            )
+            if taken.modified_count != 1:
+                continue  # another worker took it over first
+            occurrence = ActiveClass(
+                schedule={"section": doc["section"], "subject": doc["subject"]},
+                start=doc["start"].replace(tzinfo=datetime.timezone.utc),
+                end=doc["end"].replace(tzinfo=datetime.timezone.utc),
+            )
+            await self._close(db, doc["_id"], doc["section"], occurrence)
+            self.retried += 1
+            retried += 1
+        return retried
+
+    async def run_once(self, db) -> int:
+        """Retries abandoned claims, then closes every occurrence that ended between the watermark and now - delay."""
+        until = datetime.datetime.now(datetime.timezone.utc) - self.delay
+        if self.watermark is None:
+            self.watermark = await self._load_watermark(db, until)
+        closed_now = await self._retry_abandoned(db)
+        ended = self.index.ended_between(self.watermark, until)
+        if ended:
+            ids = [closure_id(section, occurrence) for section, occurrence in ended]
+            # closures written before claims existed have no status
+            done = {doc["_id"] async for doc in db[CLOSURES_COL].find({"_id": {"$in": ids}, "status": {"$ne": "closing"}}, {"_id": 1})}
+            for closure, (section, occurrence) in zip(ids, ended):
+                if closure in done or not await self._claim(db, closure, section, occurrence):
+                    continue
+                await self._close(db, closure, section, occurrence)
+                closed_now += 1
+        await db[CLOSURES_COL].update_one({"_id": WATERMARK_ID}, {"$set": {"until": until}}, upsert=True)
+        self.watermark = until
+        return closed_now
+
+    def _seconds_until_next(self) -> float:
+        now = datetime.datetime.now(datetime.timezone.utc)
+        horizon = now + datetime.timedelta(seconds=self.max_sleep_seconds)
+        upcoming = self.index.ended_between(now - self.delay, horizon - self.delay)
+        if not upcoming:
+            return self.max_sleep_seconds
+        due = upcoming[0][1].end + self.delay
+        return min(max((due - now).total_seconds(), 1.0), self.max_sleep_seconds)
+
+    async def run(self, db) -> None:
+        while True:
+            try:
+                closed = await self.run_once(db)
+                if closed:
+                    logger.info("Closed %s class occurrence(s)", closed)
+            except Exception as e:
+                self.failures += 1
+                self.last_error = str(e)
+                logger.exception("Closing ended classes failed; retrying next round")
+            await asyncio.sleep(self._seconds_until_next())
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "watermark": self.watermark.isoformat() if self.watermark else None,
+            "closed": self.closed,
+            "records_created": self.records_created,
+            "skipped": self.skipped,
+            "retried": self.retried,
+            "failures": self.failures,
+            "last_error": self.last_error,
+        }
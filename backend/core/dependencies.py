@@ -1,17 +1,48 @@
 from fastapi import Depends, HTTPException, status
 from jose import jwt, JWTError
 from decouple import config
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional
 from models.user import Teacher
+from core.cache import TTLCache
 SECRET_KEY = config("SECRET_KEY", default="supersecretkey")
 ALGORITHM = "HS256"
+PRINCIPAL_CACHE_TTL_SECONDS = config("PRINCIPAL_CACHE_TTL_SECONDS", default=30, cast=int)
+PRINCIPAL_CACHE_MAX_SIZE = config("PRINCIPAL_CACHE_MAX_SIZE", default=1000, cast=int)
+
+# token -> Teacher it authenticates; saves the JWT decode and the Teacher.get per request
+principal_cache = TTLCache(PRINCIPAL_CACHE_MAX_SIZE, PRINCIPAL_CACHE_TTL_SECONDS)
+
+async def load_principal(token: str, payload: Optional[Dict[str, Any]] = None) -> Optional[Teacher]:
+    """
+    Returns the Teacher a token belongs to, from the short-lived principal cache when possible.
+    Raises JWTError for an invalid or expired token, or one without a subject.
+    Entries never outlive the token's exp.
+    """
+    teacher = principal_cache.get(token)
+    if teacher is not None:
+        return teacher
+    if payload is None:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    user_id = payload.get("sub")
+    if not user_id:
+        raise JWTError("token has no subject")
+    teacher = await Teacher.get(user_id)
+    if teacher:
+        ttl = PRINCIPAL_CACHE_TTL_SECONDS
+        if payload.get("exp"):
+            ttl = min(ttl, payload["exp"] - datetime.now(timezone.utc).timestamp())
+        if ttl > 0:
+            principal_cache.set(token, teacher, ttl)
+    return teacher
+
+def invalidate_teacher(teacher_id: str) -> int:
+    # call whenever a teacher is deactivated or changed so cached tokens stop resolving to the old state
+    return principal_cache.discard_if(lambda token, teacher: str(teacher.id) == str(teacher_id))
 
 async def get_current_user(token: str) -> Teacher:
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        user_id = payload.get("sub")
-        if not user_id:
-            raise HTTPException(status_code=401, detail="Invalid token")
-        user = await Teacher.get(user_id)
+        user = await load_principal(token)
         if not user or not user.is_active:
             raise HTTPException(status_code=401, detail="Inactive user")
         return user
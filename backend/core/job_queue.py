@@ -0,0 +1,135 @@
+import asyncio
+import datetime
+import logging
+import os
+import socket
+import uuid
+from typing import Any, Awaitable, Callable, Dict, Optional
+from bson import ObjectId
+from decouple import config
+from pymongo import ReturnDocument
+
+logger = logging.getLogger("job_queue")
+
+JOB_BATCH_SIZE = config("JOB_BATCH_SIZE", default=500, cast=int)
+JOB_POLL_SECONDS = config("JOB_POLL_SECONDS", default=30, cast=float)
+# a running job whose worker has not saved progress for this long is taken over by another worker
+JOB_LEASE_SECONDS = config("JOB_LEASE_SECONDS", default=120, cast=float)
+
+# handler(db, job, batch_size) -> progress of one step: {"phase", "last_id", "processed", "done"}
+StepHandler = Callable[[Any, Dict[str, Any], int], Awaitable[Dict[str, Any]]]
+
+
+class JobQueue:
+    """
+    Background jobs persisted in a collection and run one at a time, oldest first.
+    A job is a series of small steps; after every step its progress (phase, last _id handled,
+    processed count) is saved, so a job interrupted by a restart resumes where it stopped.
+    Running jobs strictly in order keeps successive edits of the same data in order too.
+    Every worker runs the loop; a job is claimed atomically with an owner and a lease that
+    each saved step renews, so it runs on one worker at a time.
+    """
+
+    def __init__(
+        self,
+        collection: str,
+        handlers: Dict[str, StepHandler],
+        batch_size: int = JOB_BATCH_SIZE,
+        poll_seconds: float = JOB_POLL_SECONDS,
+        lease_seconds: float = JOB_LEASE_SECONDS,
+    ):
+        self.collection = collection
+        self.handlers = handlers
+        self.batch_size = batch_size
+        self.poll_seconds = poll_seconds
+        self.lease = datetime.timedelta(seconds=lease_seconds)
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._wakeup: Optional[asyncio.Event] = None
+        self.completed = 0
+        self.failed = 0
+        self.lost = 0
+
+    async def enqueue(self, db, kind: str, params: Dict[str, Any]) -> str:
+        now = datetime.datetime.utcnow()
+        result = await db[self.collection].insert_one({
+            "kind": kind,
+            "params": params,
+            "status": "queued",
+            "phase": None,
+            "last_id": None,
+            "processed": 0,
+            "error": None,
+            "created_at": now,
+            "updated_at": now,
+        })
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return str(result.inserted_id)
+
+    async def get(self, db, job_id: str) -> Optional[Dict[str, Any]]:
+        if not ObjectId.is_valid(job_id):
+            return None
+        return await db[self.collection].find_one({"_id": ObjectId(job_id)})
+
+    async def _claim(self, db) -> Optional[Dict[str, Any]]:
+        """
+        Takes the oldest unfinished job if it is queued or its lease ran out (its worker died).
+        The claim is a single find_one_and_update, so only one worker wins it. While another
+        worker holds the oldest job nothing newer is claimed, which keeps jobs in order.
+        """
+        jobs = db[self.collection]
+        oldest = await jobs.find_one({"status": {"$in": ["running", "queued"]}}, {"_id": 1}, sort=[("_id", 1)])
+        if oldest is None:
+            return None
+        now = datetime.datetime.utcnow()
+        return await jobs.find_one_and_update(
+            # jobs left running before leases existed have no lease_until
+            {"_id": oldest["_id"], "$or": [{"status": "queued"}, {"status": "running", "lease_until": {"$not": {"$gte": now}}}]},
+            {"$set": {"status": "running", "owner": self.owner, "lease_until": now + self.lease, "updated_at": now}},
+            return_document=ReturnDocument.AFTER,
+        )
+
+    async def _run_job(self, db, job: Dict[str, Any]) -> None:
+        jobs = db[self.collection]
+        handler = self.handlers[job["kind"]]
+        while True:
+            progress = await handler(db, job, self.batch_size)
+            job.update(phase=progress["phase"], last_id=progress["last_id"], processed=job["processed"] + progress["processed"])
+            now = datetime.datetime.utcnow()
+            # saving progress also renews the lease
+            update = {"phase": job["phase"], "last_id": job["last_id"], "processed": job["processed"], "updated_at": now, "lease_until": now + self.lease}
+            if progress["done"]:
+                update.update(status="done", finished_at=now)
+            saved = await jobs.update_one({"_id": job["_id"], "owner": self.owner}, {"$set": update})
+            if not saved.matched_count:
+                self.lost += 1
+                logger.warning("Job %s was taken over by another worker; stopping here", job["_id"])
+                return
+            if progress["done"]:
+                self.completed += 1
+                return
+
+    async def run(self, db) -> None:
+        """Worker loop; also resumes jobs whose worker stopped before finishing them."""
+        self._wakeup = asyncio.Event()
+        jobs = db[self.collection]
+        while True:
+            self._wakeup.clear()
+            job = await self._claim(db)
+            if job is None:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_seconds)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            try:
+                await self._run_job(db, job)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.failed += 1
+                logger.exception("Job %s (%s) failed", job["_id"], job["kind"])
+                await jobs.update_one({"_id": job["_id"], "owner": self.owner}, {"$set": {"status": "failed", "error": str(e), "updated_at": datetime.datetime.utcnow()}})
+
+    def stats(self) -> Dict[str, Any]:
+        return {"collection": self.collection, "owner": self.owner, "completed": self.completed, "failed": self.failed, "lost": self.lost}
@@ -0,0 +1,176 @@
+import bisect
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from pymongo import monitoring
+
+# seconds; taps sit in the low milliseconds, reports and imports can take seconds
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    """
+    Labelled histogram in the Prometheus exposition format. observe() is a bisect and a few
+    additions under a lock, cheap enough for every request and every MongoDB command.
+    The lock matters: command events arrive on pymongo's threads, not the event loop.
+    """
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str], buckets: Iterable[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[Tuple[str, ...], List[float]] = {}  # labels -> [per-bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, labels: Tuple[str, ...], value: float) -> None:
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[i] += 1
+            series[-1] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            snapshot = {labels: list(series) for labels, series in self._series.items()}
+        for labels, series in sorted(snapshot.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series[:-1]):
+                cumulative += count
+                le = 'le="%s"' % _number(bound)
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {series[-1]}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str]):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels: Tuple[str, ...], amount: float = 1) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            snapshot = dict(self._values)
+        for labels, value in sorted(snapshot.items()):
+            lines.append(f"{self.name}{_labels(self.labelnames, labels)} {_number(value)}")
+        return lines
+
+
+http_request_duration = Histogram(
+    "http_request_duration_seconds", "HTTP request latency by route template.", ("method", "route", "status"),
+)
+mongo_command_duration = Histogram(
+    "mongodb_command_duration_seconds", "MongoDB command latency by collection and command.", ("collection", "command"),
+)
+mongo_command_failures = Counter(
+    "mongodb_command_failures_total", "MongoDB commands that returned an error.", ("collection", "command"),
+)
+
+
+class CommandMetrics(monitoring.CommandListener):
+    """Times every MongoDB command the client sends; the driver reports the duration itself."""
+
+    def __init__(self):
+        # (connection, request id) -> collection, between started and succeeded/failed
+        self._pending: Dict[Tuple[Any, int], str] = {}
+
+    def started(self, event):
+        collection = event.command.get(event.command_name)
+        if event.command_name == "getMore":
+            collection = event.command.get("collection")
+        self._pending[(event.connection_id, event.request_id)] = collection if isinstance(collection, str) else ""
+
+    def succeeded(self, event):
+        collection = self._pending.pop((event.connection_id, event.request_id), "")
+        mongo_command_duration.observe((collection, event.command_name), event.duration_micros / 1_000_000)
+
+    def failed(self, event):
+        collection = self._pending.pop((event.connection_id, event.request_id), "")
+        mongo_command_duration.observe((collection, event.command_name), event.duration_micros / 1_000_000)
+        mongo_command_failures.inc((collection, event.command_name))
+
+
+command_metrics = CommandMetrics()
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware feeding http_request_duration. Requests are labelled with the matched
+    route's path template (/attendance/records, not the raw URL) so label cardinality stays
+    bounded; anything that matched no route is counted as "<unmatched>".
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        status = "500"
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = str(message["status"])
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            template = getattr(route, "path", None) or "<unmatched>"
+            http_request_duration.observe((scope["method"], template, status), time.perf_counter() - started)
+
+
+def render_gauges(prefix: str, stats: Dict[str, Any], labels: Optional[Dict[str, str]] = None) -> List[str]:
+    """Turns a stats() dict into gauges; nested dicts extend the name, non-numeric values are skipped."""
+    lines = []
+    label_text = _labels(tuple(labels), tuple(labels.values())) if labels else ""
+    for key, value in stats.items():
+        name = f"{prefix}_{key}"
+        if isinstance(value, dict):
+            lines.extend(render_gauges(name, value, labels))
+        elif isinstance(value, bool):
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name}{label_text} {int(value)}")
+        elif isinstance(value, (int, float)):
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name}{label_text} {_number(value)}")
+    return lines
+
+
+def render(extra_lines: Iterable[str] = ()) -> str:
+    lines = http_request_duration.render() + mongo_command_duration.render() + mongo_command_failures.render()
+    lines.extend(extra_lines)
+    return "\n".join(lines) + "\n"
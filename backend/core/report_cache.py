@@ -0,0 +1,138 @@
+import hashlib
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, Hashable, Optional, Tuple
+from decouple import config
+
+REPORT_CACHE_TTL_SECONDS = config("REPORT_CACHE_TTL_SECONDS", default=60, cast=float)
+REPORT_CACHE_MAX_ENTRIES = config("REPORT_CACHE_MAX_ENTRIES", default=256, cast=int)
+REPORT_CACHE_MAX_BYTES = config("REPORT_CACHE_MAX_BYTES", default=32 * 1024 * 1024, cast=int)
+
+
+@dataclass
+class CachedReport:
+    body: bytes
+    etag: str
+    expires_at: float
+    # what the report's filters can include: None means every section / date
+    section: Optional[str]
+    date_from: Optional[str]
+    date_to: Optional[str]
+
+    def covers(self, section: Optional[str], lesson_date: Optional[str]) -> bool:
+        if section is not None and self.section is not None and section != self.section:
+            return False
+        if lesson_date is None:
+            return True
+        # ISO dates compare correctly as strings
+        return (self.date_from is None or self.date_from <= lesson_date) and (self.date_to is None or lesson_date <= self.date_to)
+
+
+class ReportCache:
+    """
+    Encoded report responses keyed by their normalized query parameters.
+    LRU with a per-entry TTL, bounded both by entry count and by total body bytes.
+    Writes to the rollups drop only the reports whose section/date filters could include
+    the changed (section, lesson_date); the TTL covers changes made by other workers and scripts.
+    Every invalidation bumps `generation`: a report computed while one happened may already be
+    stale, so `set` with the generation read before computing it does not cache it.
+    """
+
+    def __init__(
+        self,
+        ttl_seconds: float = REPORT_CACHE_TTL_SECONDS,
+        max_entries: int = REPORT_CACHE_MAX_ENTRIES,
+        max_bytes: int = REPORT_CACHE_MAX_BYTES,
+    ):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._data: "OrderedDict[Hashable, CachedReport]" = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.generation = 0
+        self.stale_skips = 0
+
+    def get(self, key: Hashable) -> Optional[CachedReport]:
+        entry = self._data.get(key)
+        if entry is None or entry.expires_at <= time.monotonic():
+            if entry is not None:
+                self._drop(key)
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def set(
+        self,
+        key: Hashable,
+        body: bytes,
+        section: Optional[str] = None,
+        date_range: Tuple[Optional[str], Optional[str]] = (None, None),
+        generation: Optional[int] = None,
+    ) -> CachedReport:
+        entry = CachedReport(
+            body=body,
+            etag='"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"',
+            expires_at=time.monotonic() + self.ttl_seconds,
+            section=section,
+            date_from=date_range[0],
+            date_to=date_range[1],
+        )
+        if generation is not None and generation != self.generation:
+            # invalidated while it was computed; serve it once, don't keep it
+            self.stale_skips += 1
+            return entry
+        if len(body) > self.max_bytes:
+            # too big to keep; still hand back an ETag for the response
+            return entry
+        if key in self._data:
+            self._drop(key)
+        self._data[key] = entry
+        self.bytes += len(body)
+        while len(self._data) > self.max_entries or self.bytes > self.max_bytes:
+            self._drop(next(iter(self._data)))
+            self.evictions += 1
+        return entry
+
+    def _drop(self, key: Hashable) -> None:
+        entry = self._data.pop(key)
+        self.bytes -= len(entry.body)
+
+    def invalidate(self, section: Optional[str] = None, lesson_date: Optional[str] = None) -> int:
+        """Drops reports that could include the section on that date (None: any section / any date)."""
+        self.generation += 1
+        doomed = [key for key, entry in self._data.items() if entry.covers(section, lesson_date)]
+        for key in doomed:
+            self._drop(key)
+        self.invalidations += len(doomed)
+        return len(doomed)
+
+    def clear(self) -> None:
+        self.generation += 1
+        self._data.clear()
+        self.bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "max_entries": self.max_entries,
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "generation": self.generation,
+            "stale_skips": self.stale_skips,
+            "hit_ratio": (self.hits / lookups) if lookups else 0.0,
+        }
+
+
+report_cache = ReportCache()
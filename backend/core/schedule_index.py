@@ -0,0 +1,203 @@
+import asyncio
+import bisect
+import datetime
+import logging
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from decouple import config
+
+logger = logging.getLogger("schedule_index")
+
+# how often the change signal is checked, and how often the timetable is reloaded without one
+SCHEDULE_INDEX_POLL_SECONDS = config("SCHEDULE_INDEX_POLL_SECONDS", default=5, cast=float)
+SCHEDULE_INDEX_REFRESH_SECONDS = config("SCHEDULE_INDEX_REFRESH_SECONDS", default=600, cast=int)
+# a change left unfinished for this long (its writer died) no longer holds reloads back
+SCHEDULE_CHANGE_TIMEOUT_SECONDS = config("SCHEDULE_CHANGE_TIMEOUT_SECONDS", default=300, cast=int)
+
+# change signal of class_schedules: {_id: "class_schedules", version, changing, changed_at}
+SCHEDULE_VERSION_COL = "schedule_versions"
+SCHEDULE_VERSION_ID = "class_schedules"
+
+DAYS = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
+DAY_SECONDS = 24 * 60 * 60
+
+
+@dataclass(frozen=True)
+class ActiveClass:
+    schedule: Dict[str, Any]
+    start: datetime.datetime
+    end: datetime.datetime
+
+
+def _seconds_of_day(t: datetime.time) -> float:
+    return t.hour * 3600 + t.minute * 60 + t.second + t.microsecond / 1_000_000
+
+
+async def mark_schedules_changing(db) -> None:
+    """Call before rewriting class_schedules; running servers keep their index until the change ends."""
+    await db[SCHEDULE_VERSION_COL].update_one(
+        {"_id": SCHEDULE_VERSION_ID},
+        {"$inc": {"version": 1}, "$set": {"changing": True, "changed_at": datetime.datetime.now(datetime.timezone.utc)}},
+        upsert=True,
+    )
+
+
+async def mark_schedules_changed(db) -> None:
+    """Call after rewriting class_schedules; running servers reload within SCHEDULE_INDEX_POLL_SECONDS."""
+    await db[SCHEDULE_VERSION_COL].update_one(
+        {"_id": SCHEDULE_VERSION_ID},
+        {"$inc": {"version": 1}, "$set": {"changing": False, "changed_at": datetime.datetime.now(datetime.timezone.utc)}},
+        upsert=True,
+    )
+
+
+class ScheduleIndex:
+    """
+    Compiled weekly timetable: per section, class intervals sorted by second-of-week.
+    Mirrors the tap-time matching rules: a class is active when today's weekday equals its
+    `day` and start <= now < end using the time-of-day of the stored datetimes
+    (an end before the start runs past midnight). When classes overlap, the one
+    loaded first wins, like the first match of the old cursor scan.
+    """
+
+    def __init__(self):
+        self._starts: Dict[str, List[float]] = {}
+        self._entries: Dict[str, List[Tuple[float, float, int, Dict[str, Any]]]] = {}
+        self.built_at: Optional[datetime.datetime] = None
+        self.size = 0
+        self.version: Optional[int] = None
+        self.kept_on_empty = 0
+
+    def build(self, schedules: Iterable[Dict[str, Any]]) -> int:
+        entries: Dict[str, List[Tuple[float, float, int, Dict[str, Any]]]] = {}
+        count = 0
+        for ordinal, doc in enumerate(schedules):
+            start_time, end_time = doc.get("start_time"), doc.get("end_time")
+            if not isinstance(start_time, datetime.datetime) or not isinstance(end_time, datetime.datetime):
+                continue
+            if doc.get("day") not in DAYS:
+                continue
+            day_base = DAYS.index(doc["day"]) * DAY_SECONDS
+            start = day_base + _seconds_of_day(start_time.time())
+            end = day_base + _seconds_of_day(end_time.time())
+            if end < start:
+                end += DAY_SECONDS
+            entries.setdefault(doc.get("section"), []).append((start, end, ordinal, doc))
+            count += 1
+
+        for section_entries in entries.values():
+            section_entries.sort(key=lambda e: (e[0], e[2]))
+        # swap in whole dicts so concurrent lookups never see a half-built index
+        self._entries = entries
+        self._starts = {section: [e[0] for e in section_entries] for section, section_entries in entries.items()}
+        self.built_at = datetime.datetime.now(datetime.timezone.utc)
+        self.size = count
+        return count
+
+    async def load(self, db, allow_empty: bool = True) -> int:
+        # read the signal first: a change finishing during the load is picked up by the next poll
+        signal = await db[SCHEDULE_VERSION_COL].find_one({"_id": SCHEDULE_VERSION_ID})
+        # same order the (section, day, start_time) index fed the old per-tap scan
+        schedules = await db["class_schedules"].find({}).sort([("section", 1), ("day", 1), ("start_time", 1)]).to_list(None)
+        if not schedules and self.size and not allow_empty:
+            # most likely caught between the delete and the insert of a rewrite
+            self.kept_on_empty += 1
+            logger.warning("class_schedules is empty; keeping the %s compiled classes", self.size)
+            return self.size
+        self.version = signal.get("version") if signal else None
+        return self.build(schedules)
+
+    async def refresh(self, db) -> bool:
+        """
+        One poll of the change signal. Reloads when its version moved and no change is in
+        progress, and every SCHEDULE_INDEX_REFRESH_SECONDS for edits made without the signal;
+        those reloads never swap a compiled timetable for an empty one.
+        """
+        signal = await db[SCHEDULE_VERSION_COL].find_one({"_id": SCHEDULE_VERSION_ID}) or {}
+        now = datetime.datetime.now(datetime.timezone.utc)
+        if signal.get("changing"):
+            changed_at = signal.get("changed_at")
+            if changed_at and now - changed_at.replace(tzinfo=datetime.timezone.utc) < datetime.timedelta(seconds=SCHEDULE_CHANGE_TIMEOUT_SECONDS):
+                return False
+            # the writer died mid-change; rebuild from what is there, but not from nothing
+            await self.load(db, allow_empty=False)
+            return True
+        if signal.get("version") != self.version:
+            await self.load(db)
+            return True
+        if self.built_at is None or (now - self.built_at).total_seconds() >= SCHEDULE_INDEX_REFRESH_SECONDS:
+            await self.load(db, allow_empty=False)
+            return True
+        return False
+
+    def lookup(self, section: str, at: datetime.datetime) -> Optional[ActiveClass]:
+        starts = self._starts.get(section)
+        if not starts:
+            return None
+        at = at.astimezone(datetime.timezone.utc) if at.tzinfo else at.replace(tzinfo=datetime.timezone.utc)
+        day_base = at.weekday() * DAY_SECONDS
+        t = day_base + _seconds_of_day(at.time())
+
+        entries = self._entries[section]
+        best = None
+        # only classes of today that already started can match; walk back over overlaps
+        i = bisect.bisect_right(starts, t) - 1
+        while i >= 0 and entries[i][0] >= day_base:
+            if t < entries[i][1] and (best is None or entries[i][2] < best[2]):
+                best = entries[i]
+            i -= 1
+        if best is None:
+            return None
+
+        midnight = datetime.datetime.combine(at.date(), datetime.time(), tzinfo=datetime.timezone.utc)
+        return ActiveClass(
+            schedule=best[3],
+            start=midnight + datetime.timedelta(seconds=best[0] - day_base),
+            end=midnight + datetime.timedelta(seconds=best[1] - day_base),
+        )
+
+    def ended_between(self, since: datetime.datetime, until: datetime.datetime) -> List[Tuple[str, ActiveClass]]:
+        """Class occurrences of every section whose end falls in (since, until], oldest end first."""
+        since = since.astimezone(datetime.timezone.utc)
+        until = until.astimezone(datetime.timezone.utc)
+        ended = []
+        # a class ending after `since` started at most one day earlier (overnight classes)
+        day = since.date() - datetime.timedelta(days=1)
+        while day <= until.date():
+            midnight = datetime.datetime.combine(day, datetime.time(), tzinfo=datetime.timezone.utc)
+            day_base = day.weekday() * DAY_SECONDS
+            for section, entries in self._entries.items():
+                for start, end, _, doc in entries:
+                    if not day_base <= start < day_base + DAY_SECONDS:
+                        continue
+                    occurrence = ActiveClass(
+                        schedule=doc,
+                        start=midnight + datetime.timedelta(seconds=start - day_base),
+                        end=midnight + datetime.timedelta(seconds=end - day_base),
+                    )
+                    if since < occurrence.end <= until:
+                        ended.append((section, occurrence))
+            day += datetime.timedelta(days=1)
+        ended.sort(key=lambda item: item[1].end)
+        return ended
+
+    async def run_refresher(self, db, poll_seconds: float = SCHEDULE_INDEX_POLL_SECONDS) -> None:
+        # picks up out-of-process changes such as a repopulate.py run
+        while True:
+            await asyncio.sleep(poll_seconds)
+            try:
+                await self.refresh(db)
+            except Exception:
+                logger.exception("Failed to refresh the schedule index; keeping the previous one")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "classes": self.size,
+            "sections": len(self._entries),
+            "version": self.version,
+            "built_at": self.built_at.isoformat() if self.built_at else None,
+            "kept_on_empty": self.kept_on_empty,
+        }
+
+
+schedule_index = ScheduleIndex()
@@ -1,14 +1,26 @@
 from datetime import datetime, timedelta
+from concurrent.futures import ProcessPoolExecutor
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 from decouple import config
-from typing import Any, Dict
+from typing import Any, Dict, Optional, Tuple
+import asyncio
+import multiprocessing
 
 SECRET_KEY = config("SECRET_KEY", default="supersecretkey")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24  
+BCRYPT_ROUNDS = config("BCRYPT_ROUNDS", default=12, cast=int)
+PASSWORD_HASH_WORKERS = config("PASSWORD_HASH_WORKERS", default=2, cast=int)
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# min/max pinned to the configured cost so hashes made with any other cost need an update
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__rounds=BCRYPT_ROUNDS,
+    bcrypt__min_rounds=BCRYPT_ROUNDS,
+    bcrypt__max_rounds=BCRYPT_ROUNDS,
+)
 
 def hash_password(password: str) -> str:
     return pwd_context.hash(password)
@@ -16,6 +28,34 @@ def hash_password(password: str) -> str:
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     return pwd_context.verify(plain_password, hashed_password)
 
+def verify_and_update_password(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    # (valid, new hash when the stored one uses an outdated scheme or cost)
+    return pwd_context.verify_and_update(plain_password, hashed_password)
+
+# bcrypt is deliberately slow CPU work; run it in worker processes so it neither blocks
+# the event loop nor competes with it for the GIL
+_hash_pool: Optional[ProcessPoolExecutor] = None
+
+def start_password_pool() -> None:
+    global _hash_pool
+    if _hash_pool is None:
+        # spawn, not fork: the parent runs threads (Motor) that must not be copied mid-flight
+        _hash_pool = ProcessPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+
+def shutdown_password_pool() -> None:
+    global _hash_pool
+    if _hash_pool is not None:
+        _hash_pool.shutdown(wait=True, cancel_futures=True)
+        _hash_pool = None
+
+async def hash_password_async(password: str) -> str:
+    start_password_pool()
+    return await asyncio.get_running_loop().run_in_executor(_hash_pool, hash_password, password)
+
+async def verify_and_update_password_async(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    start_password_pool()
+    return await asyncio.get_running_loop().run_in_executor(_hash_pool, verify_and_update_password, plain_password, hashed_password)
+
 def create_access_token(data: dict, expires_delta: timedelta | None = None):
     to_encode = data.copy()
     expire = datetime.utcnow() + (expires_delta or timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
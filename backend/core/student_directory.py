@@ -0,0 +1,138 @@
+import asyncio
+import datetime
+import logging
+from typing import Any, Dict, Iterable, Optional
+from decouple import config
+
+from core.cache import TTLCache
+
+logger = logging.getLogger("student_directory")
+
+STUDENT_CACHE_MAX_SIZE = config("STUDENT_CACHE_MAX_SIZE", default=5000, cast=int)
+# backstop for edits made without the change signal (e.g. directly in the database)
+STUDENT_CACHE_TTL_SECONDS = config("STUDENT_CACHE_TTL_SECONDS", default=60, cast=int)
+STUDENT_DIRECTORY_POLL_SECONDS = config("STUDENT_DIRECTORY_POLL_SECONDS", default=2, cast=float)
+
+# one document whose version every student write bumps, so all workers drop their copies
+STUDENT_VERSION_COL = "student_versions"
+STUDENT_VERSION_ID = "students"
+
+
+async def signal_students_changed(db) -> None:
+    """Call after writing students; every worker clears its directory within STUDENT_DIRECTORY_POLL_SECONDS."""
+    await db[STUDENT_VERSION_COL].update_one(
+        {"_id": STUDENT_VERSION_ID},
+        {"$inc": {"version": 1}, "$set": {"changed_at": datetime.datetime.now(datetime.timezone.utc)}},
+        upsert=True,
+    )
+
+
+class StudentDirectory:
+    """
+    In-process directory of raw `students` documents keyed by rfid_uid and student_id_no.
+    Loaded at startup and invalidated by the student write routes in their own process; they
+    also bump the student_versions signal, on which every other worker clears its copy
+    (run_refresher). The TTL covers edits made without the signal.
+    Unknown cards are not cached, so a newly enrolled card works on its first tap.
+    """
+
+    def __init__(self, max_size: int = STUDENT_CACHE_MAX_SIZE, ttl_seconds: float = STUDENT_CACHE_TTL_SECONDS):
+        self._by_rfid = TTLCache(max_size, ttl_seconds)
+        self._by_id_no = TTLCache(max_size, ttl_seconds)
+        self.version: Optional[int] = None
+        self.signal_clears = 0
+
+    def _put(self, student: Dict[str, Any]) -> None:
+        if student.get("rfid_uid"):
+            self._by_rfid.set(student["rfid_uid"], student)
+        if student.get("student_id_no"):
+            self._by_id_no.set(student["student_id_no"], student)
+
+    async def _signal_version(self, db) -> Optional[int]:
+        signal = await db[STUDENT_VERSION_COL].find_one({"_id": STUDENT_VERSION_ID})
+        return signal.get("version") if signal else None
+
+    async def load(self, db) -> int:
+        # the version first: a change landing during the load clears it again on the next poll
+        self.version = await self._signal_version(db)
+        self._by_rfid.clear()
+        self._by_id_no.clear()
+        count = 0
+        async for student in db["students"].find({}).limit(self._by_rfid.max_size):
+            self._put(student)
+            count += 1
+        return count
+
+    async def get_by_rfid(self, db, rfid_uid: str) -> Optional[Dict[str, Any]]:
+        student = self._by_rfid.get(rfid_uid)
+        if student is None:
+            student = await db["students"].find_one({"rfid_uid": rfid_uid})
+            if student:
+                self._put(student)
+        return student
+
+    async def get_many_by_rfid(self, db, rfid_uids: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+        # one query for all cache misses
+        found: Dict[str, Dict[str, Any]] = {}
+        missing = []
+        for rfid_uid in set(rfid_uids):
+            student = self._by_rfid.get(rfid_uid)
+            if student is None:
+                missing.append(rfid_uid)
+            else:
+                found[rfid_uid] = student
+        if missing:
+            async for student in db["students"].find({"rfid_uid": {"$in": missing}}):
+                self._put(student)
+                found[student["rfid_uid"]] = student
+        return found
+
+    async def get_by_student_id_no(self, db, student_id_no: str) -> Optional[Dict[str, Any]]:
+        student = self._by_id_no.get(student_id_no)
+        if student is None:
+            student = await db["students"].find_one({"student_id_no": student_id_no})
+            if student:
+                self._put(student)
+        return student
+
+    def invalidate(self, rfid_uid: Optional[str] = None, student_id_no: Optional[str] = None) -> None:
+        # drop both keys of every cached student matching either identifier
+        for student in (self._by_rfid.pop(rfid_uid), self._by_id_no.pop(student_id_no)):
+            if student:
+                self._by_rfid.pop(student.get("rfid_uid"))
+                self._by_id_no.pop(student.get("student_id_no"))
+
+    def clear(self) -> None:
+        self._by_rfid.clear()
+        self._by_id_no.clear()
+
+    async def refresh(self, db) -> bool:
+        """One poll of the change signal; clears the directory when another write happened."""
+        version = await self._signal_version(db)
+        if version == self.version:
+            return False
+        self.clear()
+        self.version = version
+        self.signal_clears += 1
+        return True
+
+    async def run_refresher(self, db, poll_seconds: float = STUDENT_DIRECTORY_POLL_SECONDS) -> None:
+        while True:
+            await asyncio.sleep(poll_seconds)
+            try:
+                await self.refresh(db)
+            except Exception:
+                # can't see other workers' edits: drop everything rather than serve it stale
+                self.clear()
+                logger.exception("Failed to poll the student change signal; cleared the directory")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "by_rfid": self._by_rfid.stats(),
+            "by_student_id_no": self._by_id_no.stats(),
+            "version": self.version,
+            "signal_clears": self.signal_clears,
+        }
+
+
+student_directory = StudentDirectory()
@@ -0,0 +1,63 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable
+from decouple import config
+
+from core.cache import TTLCache
+
+# readers report one card 2-3 times within a second; 0 disables the debounce
+RFID_DEBOUNCE_SECONDS = config("RFID_DEBOUNCE_SECONDS", default=2.0, cast=float)
+RFID_DEBOUNCE_MAX_SIZE = config("RFID_DEBOUNCE_MAX_SIZE", default=10000, cast=int)
+
+
+class TapDebouncer:
+    """
+    Collapses repeated reads of the same card. The first read of a key runs the tap; any read
+    of that key within `window_seconds` of it gets the same result (awaiting it while it is
+    still in flight) and is counted in `suppressed`. A tap that raises is forgotten at once,
+    so the next read retries. Windows are per process.
+    """
+
+    def __init__(self, window_seconds: float = RFID_DEBOUNCE_SECONDS, max_size: int = RFID_DEBOUNCE_MAX_SIZE):
+        self.window_seconds = window_seconds
+        self._recent = TTLCache(max_size, window_seconds)
+        self.suppressed = 0
+        self.passed = 0
+
+    async def run(self, key: Hashable, tap: Callable[[], Awaitable[Any]]) -> Any:
+        """Returns (result, duplicate)."""
+        if self.window_seconds <= 0:
+            self.passed += 1
+            return await tap(), False
+        pending = self._recent.get(key)
+        if pending is not None:
+            self.suppressed += 1
+            return await asyncio.shield(pending), True
+
+        future = asyncio.get_running_loop().create_future()
+        self._recent.set(key, future)
+        self.passed += 1
+        try:
+            result = await tap()
+        except asyncio.CancelledError:
+            self._recent.pop(key)
+            future.cancel()
+            raise
+        except Exception as e:
+            self._recent.pop(key)
+            future.set_exception(e)
+            # only callers sharing the future should see it; don't warn when nobody did
+            future.exception()
+            raise
+        future.set_result(result)
+        return result, False
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "window_seconds": self.window_seconds,
+            "tracked": len(self._recent),
+            "passed": self.passed,
+            "suppressed": self.suppressed,
+        }
+
+
+tap_debouncer = TapDebouncer()
@@ -0,0 +1,96 @@
+import asyncio
+import json
+from collections import deque
+from typing import Any, Deque, Dict, Optional, Set
+from decouple import config
+
+TAP_STREAM_QUEUE_SIZE = config("TAP_STREAM_QUEUE_SIZE", default=100, cast=int)
+TAP_STREAM_MAX_SUBSCRIBERS = config("TAP_STREAM_MAX_SUBSCRIBERS", default=200, cast=int)
+
+
+class Subscription:
+    """
+    One listener's view of the stream: a bounded queue of encoded events for a section
+    (and optionally one subject). A slow client never blocks publishers; once its queue is
+    full the oldest event is dropped, so it always catches up to the latest taps.
+    """
+
+    def __init__(self, section: str, subject: Optional[str], queue_size: int):
+        self.section = section
+        self.subject = subject
+        self.dropped = 0
+        self._queue: Deque[str] = deque(maxlen=queue_size)
+        self._ready = asyncio.Event()
+
+    def matches(self, section: Optional[str], subject: Optional[str]) -> bool:
+        return section == self.section and (self.subject is None or subject == self.subject)
+
+    def put(self, message: str) -> None:
+        if len(self._queue) == self._queue.maxlen:
+            self.dropped += 1
+        self._queue.append(message)
+        self._ready.set()
+
+    async def get(self, timeout: float) -> Optional[str]:
+        """Next event, or None when nothing arrived within timeout."""
+        if not self._queue:
+            self._ready.clear()
+            try:
+                await asyncio.wait_for(self._ready.wait(), timeout)
+            except asyncio.TimeoutError:
+                return None
+        return self._queue.popleft()
+
+
+class TapBroadcaster:
+    """
+    In-process fan-out of tap results to live roster streams. Each event is JSON-encoded once
+    and handed to every matching subscription. Only taps handled by this process are seen;
+    with several workers each serves the streams of its own clients.
+    """
+
+    def __init__(self, queue_size: int = TAP_STREAM_QUEUE_SIZE, max_subscribers: int = TAP_STREAM_MAX_SUBSCRIBERS):
+        self.queue_size = queue_size
+        self.max_subscribers = max_subscribers
+        self._subscribers: Set[Subscription] = set()
+        self.published = 0
+        self.delivered = 0
+        self.dropped = 0
+
+    def subscribe(self, section: str, subject: Optional[str] = None) -> Optional[Subscription]:
+        """Returns None when max_subscribers streams are already open."""
+        if len(self._subscribers) >= self.max_subscribers:
+            return None
+        subscription = Subscription(section, subject, self.queue_size)
+        self._subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        self._subscribers.discard(subscription)
+        self.dropped += subscription.dropped
+
+    def publish(self, event: Dict[str, Any]) -> int:
+        """Queues an already JSON-safe event for every matching subscriber; returns how many got it."""
+        self.published += 1
+        section, subject = event.get("section"), event.get("subject")
+        targets = [s for s in self._subscribers if s.matches(section, subject)]
+        if not targets:
+            return 0
+        message = f"id: {self.published}\nevent: tap\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+        for subscription in targets:
+            subscription.put(message)
+        self.delivered += len(targets)
+        return len(targets)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "subscribers": len(self._subscribers),
+            "max_subscribers": self.max_subscribers,
+            "queue_size": self.queue_size,
+            "published": self.published,
+            "delivered": self.delivered,
+            "dropped": self.dropped + sum(s.dropped for s in self._subscribers),
+        }
+
+
+tap_broadcaster = TapBroadcaster()
@@ -1,12 +1,118 @@
 from motor.motor_asyncio import AsyncIOMotorClient
 from beanie import init_beanie
 from decouple import config
+from pymongo import monitoring
+from typing import Any, Dict, Optional
 import asyncio
+import time
+from core.metrics import command_metrics
 
 MONGO_URI = config("MONGO_URI")
+MONGO_DB_NAME = config("MONGO_DB_NAME", default="attendance_system")
+MONGO_MAX_POOL_SIZE = config("MONGO_MAX_POOL_SIZE", default=50, cast=int)
+MONGO_MIN_POOL_SIZE = config("MONGO_MIN_POOL_SIZE", default=0, cast=int)
+MONGO_SERVER_SELECTION_TIMEOUT_MS = config("MONGO_SERVER_SELECTION_TIMEOUT_MS", default=5000, cast=int)
+MONGO_CONNECT_TIMEOUT_MS = config("MONGO_CONNECT_TIMEOUT_MS", default=5000, cast=int)
+MONGO_SOCKET_TIMEOUT_MS = config("MONGO_SOCKET_TIMEOUT_MS", default=30000, cast=int)
+MONGO_WAIT_QUEUE_TIMEOUT_MS = config("MONGO_WAIT_QUEUE_TIMEOUT_MS", default=5000, cast=int)
+# e.g. "majority" or "1"; empty keeps the server default
+MONGO_WRITE_CONCERN = config("MONGO_WRITE_CONCERN", default="")
+MONGO_HEALTH_CHECK_SECONDS = config("MONGO_HEALTH_CHECK_SECONDS", default=10, cast=float)
 
-client = AsyncIOMotorClient(MONGO_URI)
-db = client.attendance_system
+
+class PoolStats(monitoring.ConnectionPoolListener):
+    """Connection pool counters collected through pymongo's pool monitoring."""
+
+    def __init__(self):
+        self.pools = 0
+        self.created = 0
+        self.closed = 0
+        self.checked_out = 0
+        self.checkouts = 0
+        self.checkout_failures = 0
+        self.pool_clears = 0
+
+    def pool_created(self, event): self.pools += 1
+    def pool_ready(self, event): pass
+    def pool_cleared(self, event): self.pool_clears += 1
+    def pool_closed(self, event): self.pools -= 1
+    def connection_created(self, event): self.created += 1
+    def connection_ready(self, event): pass
+    def connection_closed(self, event): self.closed += 1
+    def connection_check_out_started(self, event): pass
+    def connection_check_out_failed(self, event): self.checkout_failures += 1
+
+    def connection_checked_out(self, event):
+        self.checked_out += 1
+        self.checkouts += 1
+
+    def connection_checked_in(self, event):
+        self.checked_out -= 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "max_pool_size": MONGO_MAX_POOL_SIZE,
+            "min_pool_size": MONGO_MIN_POOL_SIZE,
+            "pools": self.pools,
+            "open_connections": self.created - self.closed,
+            "in_use": self.checked_out,
+            "connections_created": self.created,
+            "checkouts": self.checkouts,
+            "checkout_failures": self.checkout_failures,
+            "pool_clears": self.pool_clears,
+        }
+
+
+def _client_options() -> Dict[str, Any]:
+    options: Dict[str, Any] = {
+        "maxPoolSize": MONGO_MAX_POOL_SIZE,
+        "minPoolSize": MONGO_MIN_POOL_SIZE,
+        "serverSelectionTimeoutMS": MONGO_SERVER_SELECTION_TIMEOUT_MS,
+        "connectTimeoutMS": MONGO_CONNECT_TIMEOUT_MS,
+        "socketTimeoutMS": MONGO_SOCKET_TIMEOUT_MS,
+        "waitQueueTimeoutMS": MONGO_WAIT_QUEUE_TIMEOUT_MS,
+        "event_listeners": [pool_stats, command_metrics],
+    }
+    if MONGO_WRITE_CONCERN:
+        options["w"] = int(MONGO_WRITE_CONCERN) if MONGO_WRITE_CONCERN.isdigit() else MONGO_WRITE_CONCERN
+    return options
+
+
+class HealthProbe:
+    """
+    Cached MongoDB reachability check. At most one ping runs per MONGO_HEALTH_CHECK_SECONDS,
+    no matter how many requests ask; concurrent callers share the in-flight ping.
+    """
+
+    def __init__(self, interval_seconds: float = MONGO_HEALTH_CHECK_SECONDS):
+        self.interval_seconds = interval_seconds
+        self.available = True
+        self.last_error: Optional[str] = None
+        self.checked_at = 0.0
+        self._lock = asyncio.Lock()
+
+    async def is_available(self) -> bool:
+        if time.monotonic() - self.checked_at < self.interval_seconds:
+            return self.available
+        async with self._lock:
+            if time.monotonic() - self.checked_at >= self.interval_seconds:
+                try:
+                    await client.admin.command("ping")
+                    self.available, self.last_error = True, None
+                except Exception as e:
+                    self.available, self.last_error = False, str(e)
+                self.checked_at = time.monotonic()
+        return self.available
+
+    def stats(self) -> Dict[str, Any]:
+        return {"available": self.available, "last_error": self.last_error}
+
+
+# The one client of the process: Beanie models, raw collection access and scripts all share its pool.
+pool_stats = PoolStats()
+client = AsyncIOMotorClient(MONGO_URI, **_client_options())
+db = client[MONGO_DB_NAME]
+health_probe = HealthProbe()
 
 def get_db():
     return db
@@ -16,9 +122,10 @@ async def init_db():
     from models.attendance import Attendance
     from models.class_schedule import Schedule
     from models.subject_attendance import SubjectAttendance
+    from models.tap_event import TapEvent
 
 
     await init_beanie(
         database=db,
-        document_models=[Teacher, Student, Attendance, Schedule, SubjectAttendance]
+        document_models=[Teacher, Student, Attendance, Schedule, SubjectAttendance, TapEvent]
     )
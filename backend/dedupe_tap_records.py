@@ -0,0 +1,51 @@
+import asyncio
+from pymongo import ASCENDING, IndexModel
+from db.connection import get_db
+from api.attendance_utils import COL_NAME, record_keep_order, sync_rollups
+from backfill_late_counters import backfill_late_counters
+
+TAP_INDEX_KEYS = [("student_id", ASCENDING), ("lesson_date", ASCENDING), ("subject", ASCENDING)]
+TAP_INDEX_NAME = "student_id_1_lesson_date_1_subject_1"
+
+# Makes the tap index of subject_attendance unique. Run once before starting a version whose
+# SubjectAttendance declares it unique; until then the app refuses to start on the old index.
+# Races between concurrent first taps could leave several records for one student+subject+day.
+# Per group the record to keep is, in order: one already converted to an absence, one with a
+# tap, the earliest tap, the oldest _id (record_keep_order). The others are deleted, the kept
+# records' rollups rewritten and the late counters recounted. Safe to re-run.
+
+
+async def dedupe_tap_records():
+    print("--- Starting Tap Record Dedupe ---")
+    db = get_db()
+    col = db[COL_NAME]
+    groups = await col.aggregate([
+        {"$group": {
+            "_id": {"student_id": "$student_id", "lesson_date": "$lesson_date", "subject": "$subject"},
+            "ids": {"$push": "$_id"},
+            "count": {"$sum": 1},
+        }},
+        {"$match": {"count": {"$gt": 1}}},
+    ], allowDiskUse=True).to_list(None)
+    print(f"Found {len(groups)} student+subject+day keys with more than one record.")
+
+    removed, kept = 0, []
+    for group in groups:
+        docs = sorted(await col.find({"_id": {"$in": group["ids"]}}).to_list(None), key=record_keep_order)
+        removed += (await col.delete_many({"_id": {"$in": [doc["_id"] for doc in docs[1:]]}})).deleted_count
+        kept.append(docs[0])
+    if kept:
+        await sync_rollups(db, kept)
+        await backfill_late_counters()
+    print(f"Removed {removed} duplicate records.")
+
+    existing = (await col.index_information()).get(TAP_INDEX_NAME)
+    if existing and not existing.get("unique"):
+        await col.drop_index(TAP_INDEX_NAME)
+        print(f"Dropped the non-unique {TAP_INDEX_NAME}.")
+    await col.create_indexes([IndexModel(TAP_INDEX_KEYS, name=TAP_INDEX_NAME, unique=True)])
+    print(f"{TAP_INDEX_NAME} is unique.")
+    print("--- Dedupe Complete! ---")
+
+if __name__ == "__main__":
+    asyncio.run(dedupe_tap_records())
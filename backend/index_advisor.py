@@ -0,0 +1,364 @@
+"""
+Index advisor: explains the query shapes the routes issue against seeded data.
+
+Seeds students and schedules (as loadtest.py does) plus a few weeks of attendance history into
+a dedicated database, then runs explain(executionStats) for every query shape listed in
+QUERY_SHAPES with realistic values. A hot-path shape fails when its winning plan has a COLLSCAN
+or when it examines more than --max-ratio keys/documents per document it returns; for every
+failing shape the index that would serve it (equality, sort, range fields) is printed.
+
+    MONGO_URI=mongodb://localhost:27017 python index_advisor.py --sections 5 --students 30 --days 28
+
+Exits with status 1 when a hot-path shape fails, so it can run as a check before deploying.
+Time-series collections (tap_events) are explained over their buckets: "returned" counts buckets.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# must happen before db.connection creates the client
+os.environ.setdefault("MONGO_DB_NAME", "attendance_index_advisor")
+
+from db.connection import get_db, MONGO_DB_NAME
+from loadtest import seed
+from repopulate import correct_schedules_data
+from api.attendance_utils import (
+    COL_NAME,
+    ROLLUPS_COL,
+    LATE_COUNTERS_COL,
+    TAP_EVENTS_COL,
+    archived_months_stage,
+    build_attendance_filter,
+    ensure_indexes,
+    late_counter_id,
+    late_records_filter,
+    log_event,
+    records_query,
+    report_match,
+    subject_code_of,
+    subject_key_of,
+    tap_event_ops,
+    to_iso_z,
+)
+from api.attendance_route import RECORDS_PAGE_SIZE
+from backfill_late_counters import backfill_late_counters
+from rebuild_rollups import rebuild_rollups
+
+RANGE_OPERATORS = {"$gt", "$gte", "$lt", "$lte", "$ne", "$nin", "$regex", "$exists"}
+
+
+@dataclass
+class QueryShape:
+    """One query a route issues; `filter`/`pipeline` are built from a sample of the seeded data."""
+    route: str
+    collection: str
+    build: Callable[[Dict[str, Any]], Dict[str, Any]]
+    hot: bool = True
+
+
+@dataclass
+class Verdict:
+    shape: QueryShape
+    command: Dict[str, Any]
+    stages: List[str] = field(default_factory=list)
+    indexes: List[str] = field(default_factory=list)
+    keys_examined: int = 0
+    docs_examined: int = 0
+    returned: int = 0
+    problems: List[str] = field(default_factory=list)
+
+
+def find(collection: str, filter: Dict[str, Any], sort: Optional[List[Tuple[str, int]]] = None, limit: int = 0) -> Dict[str, Any]:
+    command: Dict[str, Any] = {"find": collection, "filter": filter}
+    if sort:
+        command["sort"] = dict(sort)
+    if limit:
+        command["limit"] = limit
+    return command
+
+
+def aggregate(collection: str, pipeline: List[Dict[str, Any]]) -> Dict[str, Any]:
+    return {"aggregate": collection, "pipeline": pipeline, "cursor": {}}
+
+
+def distinct(collection: str, key: str, query: Dict[str, Any]) -> Dict[str, Any]:
+    return {"distinct": collection, "key": key, "query": query}
+
+
+def records_page(query: Dict[str, Any]) -> Dict[str, Any]:
+    # one json page of GET /attendance/records, plus the record that tells whether there is a next one
+    return find(COL_NAME, query, [("_id", 1)], RECORDS_PAGE_SIZE + 1)
+
+
+# Filters come from the helpers the routes use; sorts and pipeline heads mirror the routes,
+# keep those in sync when a route's query changes.
+QUERY_SHAPES: List[QueryShape] = [
+    QueryShape("POST /attendance/rfid (student lookup)", "students",
+               lambda s: find("students", {"rfid_uid": s["rfid_uid"]}, limit=1)),
+    QueryShape("POST /attendance/rfid (tap upsert)", COL_NAME,
+               lambda s: find(COL_NAME, build_attendance_filter(s["student"], s["lesson_date"], s["subject"]), limit=1)),
+    QueryShape("POST /attendance/rfid (late counter)", LATE_COUNTERS_COL,
+               lambda s: find(LATE_COUNTERS_COL, {"_id": late_counter_id(s["student_id"], s["subject"])}, limit=1)),
+    QueryShape("POST /attendance/rfid (late conversion)", COL_NAME,
+               lambda s: find(COL_NAME, late_records_filter(s["student_id"], s["subject"]), [("lesson_date", 1)], 3)),
+    QueryShape("POST /attendance/rfid/batch (current records)", COL_NAME,
+               lambda s: find(COL_NAME, {"$or": [
+                   build_attendance_filter(student, s["lesson_date"], s["subject"]) for student in s["section_students"][:20]
+               ]})),
+    QueryShape("class closer (roster)", "students",
+               lambda s: find("students", {"section": s["section"], "is_active": {"$ne": False}, "student_id_no": {"$nin": [None, ""]}})),
+    QueryShape("class closer (tappers)", COL_NAME,
+               lambda s: distinct(COL_NAME, "student_id", {
+                   "student_id": {"$in": [st["student_id_no"] for st in s["section_students"]]},
+                   "lesson_date": s["lesson_date"],
+                   "subject": s["subject"],
+               })),
+    QueryShape("GET /attendance/records?student_id", COL_NAME,
+               lambda s: records_page(records_query(student_id=s["student_id"]))),
+    QueryShape("GET /attendance/records?date", COL_NAME,
+               lambda s: records_page(records_query(lesson_date=s["lesson_date"]))),
+    QueryShape("GET /attendance/records?subject&subject_match=exact", COL_NAME,
+               lambda s: records_page(records_query(subject=s["subject"], subject_match="exact"))),
+    QueryShape("GET /attendance/events?student_id&start&end", TAP_EVENTS_COL,
+               lambda s: find(TAP_EVENTS_COL, {"meta.student_id": s["student_id"], "at": {"$gte": s["since"]}}, [("at", 1)], 1000)),
+    QueryShape("GET /attendance/events?device&start&end", TAP_EVENTS_COL,
+               lambda s: find(TAP_EVENTS_COL, {"meta.device": s["device"], "at": {"$gte": s["since"]}}, [("at", 1)], 1000)),
+    QueryShape("GET /reports/attendance-summary?section&date_from&date_to", ROLLUPS_COL,
+               lambda s: aggregate(ROLLUPS_COL, [
+                   {"$match": report_match(s["section"], date_from=s["date_from"], date_to=s["date_to"])},
+                   archived_months_stage(s["section"], None, "contains", s["date_from"], s["date_to"]),
+               ])),
+    QueryShape("GET /reports/attendance-summary?subject&subject_match=prefix", ROLLUPS_COL,
+               lambda s: aggregate(ROLLUPS_COL, [
+                   {"$match": report_match(subject=s["subject_code"], subject_match="prefix")},
+                   archived_months_stage(None, s["subject_code"], "prefix"),
+               ])),
+    QueryShape("POST /reports/attendance/section-totals", ROLLUPS_COL,
+               lambda s: aggregate(ROLLUPS_COL, [{"$match": {"section": s["section"]}}])),
+    QueryShape("GET /reports/export?kind=records&section&date_from&date_to", COL_NAME,
+               lambda s: find(COL_NAME, report_match(s["section"], date_from=s["date_from"], date_to=s["date_to"]), [("_id", 1)]),
+               hot=False),
+    QueryShape("GET /schedule/class-schedules?section", "class_schedules",
+               lambda s: find("class_schedules", {"section": s["section"]}), hot=False),
+    QueryShape("GET /students?section&sort_by=last_name", "students",
+               lambda s: find("students", {"section": s["section"]}, [("last_name", 1)], 50), hot=False),
+    QueryShape("student edit job (history batch)", COL_NAME,
+               lambda s: find(COL_NAME, {"student_id": s["student_id"]}, [("_id", 1)], 500), hot=False),
+]
+
+
+def collect(node: Any, key: str, found: List[Any]) -> List[Any]:
+    """Every value stored under `key` anywhere in an explain document."""
+    if isinstance(node, dict):
+        for k, v in node.items():
+            if k == key:
+                found.append(v)
+            collect(v, key, found)
+    elif isinstance(node, list):
+        for v in node:
+            collect(v, key, found)
+    return found
+
+
+def judge(shape: QueryShape, command: Dict[str, Any], explain: Dict[str, Any], max_ratio: float) -> Verdict:
+    verdict = Verdict(shape, command)
+    for plan in collect(explain, "winningPlan", []):
+        verdict.stages.extend(stage for stage in collect(plan, "stage", []) if isinstance(stage, str))
+        verdict.indexes.extend(name for name in collect(plan, "indexName", []) if name not in verdict.indexes)
+    # the first executionStats is the one of the queried collection ($unionWith plans come later)
+    stats = next((s for s in collect(explain, "executionStats", []) if "totalKeysExamined" in s), {})
+    verdict.keys_examined = stats.get("totalKeysExamined", 0)
+    verdict.docs_examined = stats.get("totalDocsExamined", 0)
+    verdict.returned = stats.get("nReturned", 0)
+
+    if "COLLSCAN" in verdict.stages:
+        verdict.problems.append("COLLSCAN")
+    examined = max(verdict.keys_examined, verdict.docs_examined)
+    if examined > max_ratio * max(verdict.returned, 1):
+        verdict.problems.append(f"examined {examined} for {verdict.returned} returned")
+    return verdict
+
+
+def query_and_sort(command: Dict[str, Any]) -> Tuple[Dict[str, Any], Dict[str, int]]:
+    if "find" in command:
+        return command["filter"], command.get("sort", {})
+    if "distinct" in command:
+        return command["query"], {}
+    head = command["pipeline"][0] if command["pipeline"] else {}
+    return head.get("$match", {}), {}
+
+
+def suggest_index(command: Dict[str, Any]) -> Optional[List[Tuple[str, int]]]:
+    """Equality fields, then the sort, then range fields; None when no index can help."""
+    query, sort = query_and_sort(command)
+    if "$or" in query:
+        # every branch has the same shape in these routes
+        query = {**{k: v for k, v in query.items() if k != "$or"}, **query["$or"][0]}
+    equality, ranges = [], []
+    for name, value in query.items():
+        if name.startswith("$"):
+            continue
+        if isinstance(value, dict) and any(op in RANGE_OPERATORS for op in value):
+            if "$regex" in value and (value.get("$options") or not str(value["$regex"]).startswith("^")):
+                continue  # unanchored or case-insensitive regexes cannot use index bounds
+            ranges.append((name, 1))
+        else:
+            equality.append((name, 1))
+    keys = equality + [(name, direction) for name, direction in sort.items() if name not in dict(equality)]
+    keys += [key for key in ranges if key[0] not in dict(keys)]
+    if not keys or keys == [("_id", 1)]:
+        return None
+    return keys
+
+
+async def seed_history(db, days: int, now: datetime, rng: random.Random) -> None:
+    """`days` of past classes for every seeded student: records, tap events, rollups, late counters."""
+    students = await db["students"].find({}).to_list(None)
+    by_section: Dict[str, List[Dict[str, Any]]] = {}
+    for student in students:
+        by_section.setdefault(student["section"], []).append(student)
+
+    records, events = [], []
+    for back in range(1, days + 1):
+        day = (now - timedelta(days=back)).date()
+        weekday = day.strftime("%a")
+        for sched in (s for s in correct_schedules_data if s["day"] == weekday):
+            start = datetime.combine(day, sched["start_time"], tzinfo=timezone.utc)
+            for section, members in by_section.items():
+                device = f"reader-{section}"
+                for student in members:
+                    roll = rng.random()
+                    status = "Absent" if roll < 0.05 else "Late" if roll < 0.2 else "Present"
+                    time_in = None if status == "Absent" else start + timedelta(minutes=rng.randint(-10, 25 if status == "Late" else 9))
+                    records.append({
+                        "student_id": student["student_id_no"],
+                        "student_name": f"{student['first_name']} {student['last_name']}",
+                        "section": section,
+                        "subject": sched["subject"],
+                        "subject_code": subject_code_of(sched["subject"]),
+                        "subject_key": subject_key_of(sched["subject"]),
+                        "lesson_date": day.isoformat(),
+                        "time_in": to_iso_z(time_in) if time_in else None,
+                        "time_out": None,
+                        "status": status,
+                        "late": status == "Late",
+                        "converted_to_absence": False,
+                        "from_device": device,
+                    })
+                    if time_in:
+                        events.append(log_event(student["student_id_no"], student, section, day.isoformat(),
+                                                to_iso_z(time_in), "tap_in", device, sched["subject"]))
+    for chunk in range(0, len(records), 5000):
+        await db[COL_NAME].insert_many(records[chunk:chunk + 5000], ordered=False)
+    for chunk in range(0, len(events), 5000):
+        await db[TAP_EVENTS_COL].bulk_write(tap_event_ops(events[chunk:chunk + 5000]), ordered=False)
+    print(f"Seeded {len(records)} attendance records and {len(events)} tap events over {days} days.")
+    await rebuild_rollups()
+    await backfill_late_counters()
+
+
+async def pick_sample(db, days: int, now: datetime) -> Dict[str, Any]:
+    # a late student, so the conversion query has something to find
+    record = await db[COL_NAME].find_one({"late": True}, sort=[("lesson_date", -1)])
+    if record is None:
+        sys.exit("No seeded attendance history; use --days >= 7.")
+    student = await db["students"].find_one({"student_id_no": record["student_id"]})
+    section_students = await db["students"].find({"section": record["section"]}).to_list(None)
+    return {
+        "student": student,
+        "student_id": record["student_id"],
+        "rfid_uid": student["rfid_uid"],
+        "section": record["section"],
+        "section_students": section_students,
+        "subject": record["subject"],
+        "subject_code": record["subject_code"],
+        "lesson_date": record["lesson_date"],
+        "date_from": (now - timedelta(days=min(days, 7))).date().isoformat(),
+        "date_to": now.date().isoformat(),
+        "device": record["from_device"],
+        "since": now - timedelta(days=min(days, 7)),
+    }
+
+
+def format_keys(keys: List[Tuple[str, int]]) -> str:
+    return "IndexModel([" + ", ".join(f'("{name}", {"ASCENDING" if d == 1 else "DESCENDING"})' for name, d in keys) + "])"
+
+
+async def advise(args) -> int:
+    if MONGO_DB_NAME == "attendance_system" and not args.allow_main_db:
+        sys.exit("Refusing to seed the production database; set MONGO_DB_NAME or pass --allow-main-db.")
+    print("--- Starting Index Advisor ---")
+    now = datetime.now(timezone.utc)
+    rng = random.Random(args.seed)
+    await seed(args.sections, args.students, now)
+    db = get_db()
+    await ensure_indexes(db)
+    await seed_history(db, args.days, now, rng)
+    sample = await pick_sample(db, args.days, now)
+
+    verdicts: List[Verdict] = []
+    for shape in QUERY_SHAPES:
+        command = shape.build(sample)
+        explain = await db.command("explain", command, verbosity="executionStats")
+        verdicts.append(judge(shape, command, explain, args.max_ratio))
+
+    needed: Dict[str, List[List[Tuple[str, int]]]] = {}
+    failures = 0
+    for v in verdicts:
+        failed = bool(v.problems) and v.shape.hot
+        failures += failed
+        mark = "FAIL" if failed else ("warn" if v.problems else "ok")
+        plan = ", ".join(v.indexes) or " > ".join(dict.fromkeys(v.stages))
+        print(f"[{mark:4}] {v.shape.route}")
+        print(f"       {v.shape.collection}: {plan} | keys {v.keys_examined}, docs {v.docs_examined}, returned {v.returned}"
+              + (f" | {'; '.join(v.problems)}" if v.problems else ""))
+        if v.problems:
+            keys = suggest_index(v.command)
+            if keys and keys not in needed.setdefault(v.shape.collection, []):
+                needed[v.shape.collection].append(keys)
+
+    if needed:
+        print("\nIndexes that would serve the flagged shapes:")
+        for collection, index_list in needed.items():
+            print(f"  {collection}:")
+            for keys in index_list:
+                print(f"    {format_keys(keys)},")
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump([{
+                "route": v.shape.route,
+                "collection": v.shape.collection,
+                "hot": v.shape.hot,
+                "indexes": v.indexes,
+                "stages": v.stages,
+                "keys_examined": v.keys_examined,
+                "docs_examined": v.docs_examined,
+                "returned": v.returned,
+                "problems": v.problems,
+            } for v in verdicts], f, indent=2)
+    print(f"{len(verdicts)} query shapes explained, {failures} hot-path failure(s).")
+    print("--- Index Advisor Complete! ---")
+    return 1 if failures else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Explain every route's query shapes against seeded data and suggest indexes")
+    parser.add_argument("--sections", type=int, default=5)
+    parser.add_argument("--students", type=int, default=30, help="students per section")
+    parser.add_argument("--days", type=int, default=28, help="days of attendance history to seed")
+    parser.add_argument("--max-ratio", type=float, default=10, help="max keys/docs examined per returned document")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--out", help="also write the verdicts as JSON")
+    parser.add_argument("--allow-main-db", action="store_true")
+    args = parser.parse_args()
+    sys.exit(asyncio.run(advise(args)))
+
+
+if __name__ == "__main__":
+    main()
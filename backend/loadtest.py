@@ -0,0 +1,301 @@
+"""
+Morning-rush load test for POST /attendance/rfid.
+
+Seeds sections, students and schedules into a dedicated database (never the real one unless
+--allow-main-db is given), then replays a synthetic arrival burst: most students tap in around
+the start of class, some readers report the same card twice within a second, and some students
+leave for a break and come back. Latency percentiles, throughput and MongoDB commands per tap
+are written as JSON so runs can be compared.
+
+    MONGO_URI=mongodb://localhost:27017 python loadtest.py --sections 20 --students 40 --out run.json
+
+With --logins N, N teacher logins (POST /teacher/login, bcrypt-verified) are spread over the same
+burst; their throughput and latency are reported apart from the taps, so the effect of password
+hashing on tap latency shows up as the difference to a run without logins.
+
+By default the FastAPI app runs in-process (httpx ASGITransport) against the local mongod from
+MONGO_URI; with --url the taps go to an already running server instead (Mongo ops are then not measured).
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+from collections import Counter
+from datetime import date, datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+# must happen before db.connection creates the client
+os.environ.setdefault("MONGO_DB_NAME", "attendance_loadtest")
+
+from pymongo import monitoring
+
+
+class CommandCounter(monitoring.CommandListener):
+    def __init__(self):
+        self.enabled = False
+        self.commands: Counter = Counter()
+
+    def started(self, event):
+        if self.enabled:
+            self.commands[event.command_name] += 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+command_counter = CommandCounter()
+monitoring.register(command_counter)
+
+import httpx
+from db.connection import init_db, get_db, MONGO_DB_NAME
+from models.class_schedule import Schedule
+from models.user import Student, Teacher
+from core.security import hash_password
+from repopulate import correct_schedules_data
+
+LOGIN_PASSWORD = "loadtest-password"
+
+
+def percentile(sorted_values: List[float], pct: float) -> Optional[float]:
+    # nearest-rank percentile
+    if not sorted_values:
+        return None
+    rank = max(1, int(round(pct / 100 * len(sorted_values) + 0.5)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+async def seed(sections: int, students_per_section: int, now: datetime) -> Tuple[List[str], List[str]]:
+    """
+    Weekly timetable from repopulate.py for every section, plus a class in session right now,
+    and one teacher per section. Returns the RFID UIDs and the teacher emails.
+    """
+    await init_db()
+    db = get_db()
+    for name in ("students", "teachers", "class_schedules", "subject_attendance", "attendance_logs", "tap_events", "attendance_rollups", "late_counters"):
+        await db[name].drop()
+    await init_db()  # recreate the Beanie indexes on the dropped collections
+
+    local_tz = timezone(timedelta(hours=8))
+    placeholder_date = date(1970, 1, 1)
+    in_session_start = (now - timedelta(minutes=5)).replace(second=0, microsecond=0)
+    schedules, students, rfids, teachers = [], [], [], []
+    # hashed once: every teacher gets the same password, at the configured BCRYPT_ROUNDS
+    password_hash = hash_password(LOGIN_PASSWORD)
+    for s in range(sections):
+        section = f"LT{s:03d}"
+        for sched_data in correct_schedules_data:
+            schedules.append(Schedule(
+                section=section, teacher_name="TBA", room="211",
+                day=sched_data["day"], subject=sched_data["subject"],
+                start_time=datetime.combine(placeholder_date, sched_data["start_time"]).replace(tzinfo=local_tz),
+                end_time=datetime.combine(placeholder_date, sched_data["end_time"]).replace(tzinfo=local_tz),
+            ))
+        schedules.append(Schedule(
+            section=section, teacher_name="TBA", room="LOAD",
+            day=now.strftime("%a"), subject="LOAD-TEST (Rush)",
+            start_time=datetime.combine(placeholder_date, in_session_start.time()).replace(tzinfo=timezone.utc),
+            end_time=datetime.combine(placeholder_date, (in_session_start + timedelta(hours=1)).time()).replace(tzinfo=timezone.utc),
+        ))
+        teachers.append(Teacher(
+            first_name="Load", last_name=f"Teacher{s:03d}", email=f"teacher{s:03d}@loadtest.example.com",
+            password=password_hash, section=section,
+        ))
+        for i in range(students_per_section):
+            rfid = f"LT-{section}-{i:04d}"
+            rfids.append(rfid)
+            students.append(Student(
+                first_name=f"Student{i:04d}", last_name=f"Section{s:03d}", section=section,
+                rfid_uid=rfid, student_id_no=f"LT{s:03d}{i:05d}",
+                seat_row=i // 10 + 1, seat_col=i % 10 + 1,
+            ))
+    await Schedule.insert_many(schedules)
+    await Student.insert_many(students)
+    await Teacher.insert_many(teachers)
+    return rfids, [t.email for t in teachers]
+
+
+def plan_taps(rfids: List[str], burst_seconds: float, double_tap_rate: float, break_rate: float, rng: random.Random) -> List[Tuple[float, str, str]]:
+    """(offset seconds, rfid_uid, kind) sorted by offset."""
+    taps = []
+    for rfid in rfids:
+        # arrivals peak around the bell: triangular distribution over the burst window
+        arrival = rng.triangular(0, burst_seconds, burst_seconds * 0.3)
+        taps.append((arrival, rfid, "arrival"))
+        if rng.random() < double_tap_rate:
+            taps.append((arrival + rng.uniform(0.05, 0.8), rfid, "double_read"))
+        if rng.random() < break_rate:
+            leave = arrival + rng.uniform(burst_seconds * 0.2, burst_seconds * 0.6) + 1.5
+            taps.append((leave, rfid, "break_out"))
+            taps.append((leave + rng.uniform(1.5, burst_seconds * 0.3 + 2), rfid, "break_in"))
+    taps.sort(key=lambda t: t[0])
+    return taps
+
+
+def plan_logins(emails: List[str], logins: int, burst_seconds: float, rng: random.Random) -> List[Tuple[float, str, str]]:
+    """(offset seconds, email, "login"), spread evenly over the burst."""
+    return [(rng.uniform(0, burst_seconds), rng.choice(emails), "login") for _ in range(logins)] if emails else []
+
+
+async def fire(client: httpx.AsyncClient, taps: List[Tuple[float, str, str]], concurrency: int) -> List[Dict[str, Any]]:
+    semaphore = asyncio.Semaphore(concurrency)
+    samples: List[Dict[str, Any]] = []
+    started = time.perf_counter()
+
+    async def one(offset: float, target: str, kind: str):
+        delay = offset - (time.perf_counter() - started)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        async with semaphore:
+            t0 = time.perf_counter()
+            try:
+                if kind == "login":
+                    response = await client.post("/teacher/login", json={"email": target, "password": LOGIN_PASSWORD})
+                else:
+                    response = await client.post("/attendance/rfid", params={"rfid_uid": target})
+                status = response.status_code
+            except httpx.HTTPError as e:
+                status = f"error:{type(e).__name__}"
+            samples.append({"kind": kind, "status": status, "latency_ms": (time.perf_counter() - t0) * 1000})
+
+    await asyncio.gather(*(one(*tap) for tap in taps))
+    return samples
+
+
+def summarize(all_samples: List[Dict[str, Any]], wall_seconds: float) -> Dict[str, Any]:
+    # logins are reported on their own; every other figure is about taps only
+    samples = [s for s in all_samples if s["kind"] != "login"]
+    logins = sorted(s["latency_ms"] for s in all_samples if s["kind"] == "login")
+    latencies = sorted(s["latency_ms"] for s in samples)
+    by_kind = {}
+    for kind in sorted({s["kind"] for s in samples}):
+        kind_latencies = sorted(s["latency_ms"] for s in samples if s["kind"] == kind)
+        by_kind[kind] = {
+            "taps": len(kind_latencies),
+            "p50_ms": percentile(kind_latencies, 50),
+            "p95_ms": percentile(kind_latencies, 95),
+            "p99_ms": percentile(kind_latencies, 99),
+        }
+    return {
+        "taps": len(samples),
+        "wall_seconds": wall_seconds,
+        "throughput_taps_per_second": len(samples) / wall_seconds if wall_seconds else None,
+        "latency_ms": {
+            "p50": percentile(latencies, 50),
+            "p95": percentile(latencies, 95),
+            "p99": percentile(latencies, 99),
+            "max": latencies[-1] if latencies else None,
+            "mean": sum(latencies) / len(latencies) if latencies else None,
+        },
+        "status_codes": dict(Counter(str(s["status"]) for s in samples)),
+        "by_kind": by_kind,
+        "logins": {
+            "logins": len(logins),
+            "throughput_logins_per_second": len(logins) / wall_seconds if wall_seconds else None,
+            "status_codes": dict(Counter(str(s["status"]) for s in all_samples if s["kind"] == "login")),
+            "latency_ms": {
+                "p50": percentile(logins, 50),
+                "p95": percentile(logins, 95),
+                "p99": percentile(logins, 99),
+                "max": logins[-1] if logins else None,
+            },
+        } if logins else None,
+    }
+
+
+async def run(args) -> Dict[str, Any]:
+    if MONGO_DB_NAME == "attendance_system" and not args.allow_main_db:
+        sys.exit("Refusing to seed the production database; set MONGO_DB_NAME or pass --allow-main-db.")
+
+    rng = random.Random(args.seed)
+    now = datetime.now(timezone.utc)
+    rfids, emails = await seed(args.sections, args.students, now)
+    taps = plan_taps(rfids, args.burst_seconds, args.double_tap_rate, args.break_rate, rng)
+    logins = plan_logins(emails, args.logins, args.burst_seconds, rng)
+    print(f"Seeded {args.sections} sections x {args.students} students into '{MONGO_DB_NAME}'; firing {len(taps)} taps and {len(logins)} logins...")
+    taps = sorted(taps + logins, key=lambda t: t[0])
+
+    if args.url:
+        async with httpx.AsyncClient(base_url=args.url, timeout=30) as client:
+            t0 = time.perf_counter()
+            samples = await fire(client, taps, args.concurrency)
+            wall = time.perf_counter() - t0
+        commands = None
+    else:
+        from main import app, lifespan
+        async with lifespan(app):
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://loadtest", timeout=30) as client:
+                command_counter.enabled = True
+                t0 = time.perf_counter()
+                samples = await fire(client, taps, args.concurrency)
+                wall = time.perf_counter() - t0
+        # leaving the lifespan drains the write-behind queues, so their writes are counted too
+        command_counter.enabled = False
+        commands = dict(command_counter.commands)
+
+    result = {
+        "started_at": now.isoformat(),
+        "config": {
+            "sections": args.sections,
+            "students_per_section": args.students,
+            "burst_seconds": args.burst_seconds,
+            "double_tap_rate": args.double_tap_rate,
+            "break_rate": args.break_rate,
+            "concurrency": args.concurrency,
+            "logins": args.logins,
+            "seed": args.seed,
+            "target": args.url or "in-process",
+            "database": MONGO_DB_NAME,
+        },
+        **summarize(samples, wall),
+    }
+    if commands is not None:
+        total = sum(commands.values())
+        result["mongo"] = {
+            "commands": total,
+            # includes the queries of any logins in the run
+            "commands_per_tap": total / result["taps"] if result["taps"] else None,
+            "by_command": commands,
+        }
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate a morning rush against POST /attendance/rfid")
+    parser.add_argument("--sections", type=int, default=10)
+    parser.add_argument("--students", type=int, default=40, help="students per section")
+    parser.add_argument("--burst-seconds", type=float, default=60, help="length of the arrival burst")
+    parser.add_argument("--double-tap-rate", type=float, default=0.2, help="share of arrivals the reader reports twice")
+    parser.add_argument("--break-rate", type=float, default=0.1, help="share of students who leave and come back")
+    parser.add_argument("--concurrency", type=int, default=64, help="max in-flight requests")
+    parser.add_argument("--logins", type=int, default=0, help="teacher logins mixed into the burst")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--url", help="hit a running server instead of the in-process app")
+    parser.add_argument("--out", default="loadtest-results.json")
+    parser.add_argument("--allow-main-db", action="store_true")
+    args = parser.parse_args()
+
+    result = asyncio.run(run(args))
+    with open(args.out, "w") as f:
+        json.dump(result, f, indent=2)
+    latency = result["latency_ms"]
+    print(f"{result['taps']} taps in {result['wall_seconds']:.1f}s "
+          f"({result['throughput_taps_per_second']:.1f}/s) p50={latency['p50']:.1f}ms "
+          f"p95={latency['p95']:.1f}ms p99={latency['p99']:.1f}ms")
+    if result["logins"]:
+        logins = result["logins"]
+        print(f"{logins['logins']} logins ({logins['throughput_logins_per_second']:.1f}/s) "
+              f"p50={logins['latency_ms']['p50']:.1f}ms p95={logins['latency_ms']['p95']:.1f}ms")
+    if "mongo" in result:
+        print(f"MongoDB commands per tap: {result['mongo']['commands_per_tap']:.2f}")
+    print(f"Results written to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,9 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
 from contextlib import asynccontextmanager
 import uvicorn
-import os
-from pymongo import MongoClient
+import asyncio
 from dotenv import load_dotenv
 
 from api.auth_route import router as auth_route
@@ -14,18 +14,42 @@ from api.edit_details_route import router as edit_details_route
 from api.schedule_route import router as schedule_route
 load_dotenv()
 
-from db.connection import init_db
-
-MONGODB_URI = os.getenv(
-    "MONGODB_URI"
-)
+from db.connection import init_db, get_db, client as mongo_client, health_probe, pool_stats
+from core.student_directory import student_directory
+from core.schedule_index import schedule_index
+from api.attendance_utils import tap_journal, ensure_indexes, class_closer, student_edit_jobs, rollup_sync
+from core.security import start_password_pool, shutdown_password_pool
+from core.dependencies import principal_cache
+from core.tap_stream import tap_broadcaster
+from core.tap_debounce import tap_debouncer
+from core.report_cache import report_cache
+from core import metrics
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     print("Starting up and connecting to the database...")
     await init_db()
+    await ensure_indexes(get_db())
+    loaded = await student_directory.load(get_db())
+    print(f"Loaded {loaded} students into the RFID directory.")
+    compiled = await schedule_index.load(get_db())
+    print(f"Compiled {compiled} class schedules into the schedule index.")
+    schedule_refresher = asyncio.create_task(schedule_index.run_refresher(get_db()))
+    directory_refresher = asyncio.create_task(student_directory.run_refresher(get_db()))
+    absence_job = asyncio.create_task(class_closer.run(get_db()))
+    edit_jobs = asyncio.create_task(student_edit_jobs.run(get_db()))
+    tap_journal.start(get_db())
+    start_password_pool()
     yield
     print("Shutting down...")
+    schedule_refresher.cancel()
+    directory_refresher.cancel()
+    absence_job.cancel()
+    edit_jobs.cancel()
+    await tap_journal.stop()
+    shutdown_password_pool()
+    print(f"Tap journal drained: {tap_journal.stats()}")
+    mongo_client.close()
 
 app = FastAPI(
     title="Attendance Monitoring System",
@@ -41,6 +65,7 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(metrics.MetricsMiddleware)
 
 app.include_router(auth_route, prefix="/teacher", tags=["Teacher"])
 app.include_router(students_route, prefix="/students", tags=["Students"])
@@ -48,17 +73,30 @@ app.include_router(attendance_route, prefix="/attendance", tags=["Attendance"])
 app.include_router(class_report_route, prefix="/reports", tags=["Reports"])
 app.include_router(edit_details_route, prefix="/edit", tags=["Edit Details"])
 app.include_router(schedule_route, prefix="/schedule", tags=["Class Schedule"])
-@app.on_event("startup")
-def startup_event():
-    client = MongoClient(MONGODB_URI)
-    app.state.mongo_client = client
-
-@app.on_event("shutdown")
-def shutdown_event():
-    client = getattr(app.state, "mongo_client", None)
-    if client:
-        client.close()
 
 @app.get("/")
 async def root():
-    return {"message": "Server is running"}
\ No newline at end of file
+    return {"message": "Server is running"}
+
+@app.get("/health")
+async def health():
+    await health_probe.is_available()
+    return {"mongo": health_probe.stats(), "pool": pool_stats.stats()}
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    gauges = (
+        metrics.render_gauges("attendance_student_directory", student_directory.stats())
+        + metrics.render_gauges("attendance_principal_cache", principal_cache.stats())
+        + metrics.render_gauges("attendance_tap_journal", tap_journal.stats())
+        + metrics.render_gauges("attendance_tap_stream", tap_broadcaster.stats())
+        + metrics.render_gauges("attendance_tap_debounce", tap_debouncer.stats())
+        + metrics.render_gauges("attendance_report_cache", report_cache.stats())
+        + metrics.render_gauges("attendance_student_edit_jobs", student_edit_jobs.stats())
+        + metrics.render_gauges("attendance_class_closer", class_closer.stats())
+        + metrics.render_gauges("attendance_rollup_sync", rollup_sync.stats())
+        + metrics.render_gauges("attendance_schedule_index", schedule_index.stats())
+        + metrics.render_gauges("mongodb_pool", pool_stats.stats())
+        + metrics.render_gauges("mongodb_health", health_probe.stats())
+    )
+    return PlainTextResponse(metrics.render(gauges), media_type="text/plain; version=0.0.4")
@@ -0,0 +1,22 @@
+import asyncio
+from db.connection import get_db
+from api.attendance_utils import ROLLUPS_COL, subject_code_of, subject_key_of
+
+# Backfills subject_code / subject_key on records (and rollups) written before they existed.
+# Subjects are few, so this is one update_many per distinct subject; safe to re-run.
+async def migrate_subject_keys():
+    print("--- Starting Subject Key Migration ---")
+    db = get_db()
+    subjects = await db["subject_attendance"].distinct("subject")
+    print(f"Found {len(subjects)} distinct subjects.")
+    for subject in subjects:
+        if not isinstance(subject, str):
+            continue
+        normalized = {"subject_code": subject_code_of(subject), "subject_key": subject_key_of(subject)}
+        result = await db["subject_attendance"].update_many({"subject": subject, "subject_key": {"$ne": normalized["subject_key"]}}, {"$set": normalized})
+        await db[ROLLUPS_COL].update_many({"subject": subject}, {"$set": normalized})
+        print(f"  {subject!r}: {result.modified_count} records updated")
+    print("--- Migration Complete! ---")
+
+if __name__ == "__main__":
+    asyncio.run(migrate_subject_keys())
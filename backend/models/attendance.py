@@ -20,7 +20,8 @@ class Attendance(Document):
     class Settings:
         name = "attendance_logs"
         indexes = [
-            IndexModel([("student_id", ASCENDING), ("lesson_date", ASCENDING)], unique=True),
+            # several logs per student and day (breaks); the unique index this replaces is dropped by ensure_indexes
+            IndexModel([("student_id", ASCENDING), ("lesson_date", ASCENDING), ("time_in", ASCENDING)]),
             IndexModel([("section", ASCENDING), ("lesson_date", ASCENDING)]),
             IndexModel([("lesson_date", DESCENDING), ("time_in", DESCENDING)]),
         ]
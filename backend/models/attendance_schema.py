@@ -71,4 +71,27 @@ class StudentSummarySchema(BaseModel):
 
 class AttendanceRecordsResponse(BaseModel):
     """Response schema for the GET /records endpoint."""
-    records: List[AttendanceResponse]
\ No newline at end of file
+    records: List[AttendanceResponse]
+    next_after: Optional[str] = None
+
+class TapEventIn(BaseModel):
+    """A buffered tap replayed by a reader device."""
+    rfid_uid: str
+    tapped_at: datetime.datetime
+    device_id: Optional[str] = None
+
+class TapEventResult(BaseModel):
+    """Outcome of a single event of a batch, in request order."""
+    index: int
+    rfid_uid: str
+    tapped_at: datetime.datetime
+    status: str  # applied | stale | duplicate | rejected | failed
+    action: Optional[str] = None
+    subject: Optional[str] = None
+    lesson_date: Optional[str] = None
+    detail: Optional[str] = None
+
+class TapBatchResponse(BaseModel):
+    """Response schema for the POST /rfid/batch endpoint."""
+    applied: int
+    results: List[TapEventResult]
@@ -1,4 +1,4 @@
-from beanie import Document, PydanticObjectId
+from beanie import Document
 from pydantic import Field
 from typing import Literal, Optional
 from datetime import date, datetime
@@ -10,11 +10,14 @@ class SubjectAttendance(Document):
     """
     Represents a single attendance record for a student in a specific subject on a given day.
     """
-    # Using PydanticObjectId is the standard way to reference other documents.
-    student_id: PydanticObjectId = Field(index=True)
+    # The student's student_id_no, as written by the tap path and queried by every route.
+    student_id: str = Field(index=True)
     
     section: str = Field(index=True)
     subject: str
+    # normalized copies of `subject` written with every tap, see api.attendance_utils
+    subject_code: Optional[str] = None
+    subject_key: Optional[str] = None
     
     lesson_date: date
     
@@ -49,14 +52,46 @@ class SubjectAttendance(Document):
                     ("lesson_date", DESCENDING), # Usually you want the most recent dates first
                 ]
             ),
-            # Compound index for another common query:
-            # "Find all attendance for a specific student"
+            # Compound index for the tap path:
+            # "Find the record of a student for a subject on a given day"
+            # Unique so concurrent first taps (and the class closer) upsert one record, not two.
+            # Databases created before it was unique need dedupe_tap_records.py first.
             IndexModel(
                 [
                     ("student_id", ASCENDING),
+                    ("lesson_date", ASCENDING),
                     ("subject", ASCENDING),
-                    ("late", DESCENDING),
-                    ("converted_to_absence", ASCENDING),
+                ],
+                unique=True,
+            ),
+            # Index-backed exact / prefix subject filters
+            IndexModel(
+                [
+                    ("subject_key", ASCENDING),
+                    ("lesson_date", ASCENDING),
+                ]
+            ),
+            IndexModel(
+                [
+                    ("student_id", ASCENDING),
+                    ("subject_key", ASCENDING),
+                ]
+            ),
+            # Compound index for the late-to-absence conversion:
+            # "Find the oldest lates of a student in a subject"
+            # (converted lates have late=False, so equality on late already excludes them)
+            IndexModel(
+                [
+                    ("student_id", ASCENDING),
+                    ("subject", ASCENDING),
+                    ("late", ASCENDING),
+                    ("lesson_date", ASCENDING),
+                ]
+            ),
+            # Date-only filters: /attendance/records?date=, date-range exports, archive_terms.py
+            IndexModel(
+                [
+                    ("lesson_date", ASCENDING),
                 ]
             ),
         ]
\ No newline at end of file
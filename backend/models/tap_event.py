@@ -0,0 +1,46 @@
+from beanie import Document, TimeSeriesConfig, Granularity
+from pydantic import BaseModel
+from typing import Literal, Optional
+from datetime import datetime
+from decouple import config
+from pymongo import IndexModel, ASCENDING, DESCENDING
+
+# 0 keeps raw taps forever
+TAP_EVENTS_EXPIRE_AFTER_SECONDS = config("TAP_EVENTS_EXPIRE_AFTER_SECONDS", default=0, cast=int)
+
+TapAction = Literal["tap_in", "tap_out"]
+
+class TapEventMeta(BaseModel):
+    """Series key of a tap: MongoDB buckets events sharing the same meta together."""
+    student_id: str
+    section: str
+    device: str
+
+class TapEvent(Document):
+    """
+    One raw RFID tap, never updated after it is written.
+    Stored in a time-series collection (MongoDB 5.0+), which compresses the buckets
+    and keeps time-range scans per student or device cheap.
+    """
+    at: datetime
+    meta: TapEventMeta
+    action: TapAction
+    lesson_date: str
+    subject: Optional[str] = None
+    queued_at: Optional[datetime] = None
+
+    class Settings:
+        name = "tap_events"
+        timeseries = TimeSeriesConfig(
+            time_field="at",
+            meta_field="meta",
+            granularity=Granularity.seconds,
+            expire_after_seconds=TAP_EVENTS_EXPIRE_AFTER_SECONDS or None,
+        )
+        indexes = [
+            # per-student timelines
+            IndexModel([("meta.student_id", ASCENDING), ("at", DESCENDING)]),
+            # device audits
+            IndexModel([("meta.device", ASCENDING), ("at", DESCENDING)]),
+            IndexModel([("meta.section", ASCENDING), ("at", DESCENDING)]),
+        ]
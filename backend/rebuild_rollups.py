@@ -0,0 +1,18 @@
+import asyncio
+from db.connection import get_db
+from api.attendance_utils import ROLLUPS_COL, ROLLUP_FROM_RECORDS_STAGES
+
+# Rebuilds attendance_rollups from the full subject_attendance history.
+# $out swaps the collection in atomically; taps recorded while it runs may be lost
+# from the rollups, so run it outside class hours.
+async def rebuild_rollups():
+    print("--- Starting Attendance Rollup Rebuild ---")
+    db = get_db()
+    pipeline = ROLLUP_FROM_RECORDS_STAGES + [{"$out": ROLLUPS_COL}]
+    await db["subject_attendance"].aggregate(pipeline, allowDiskUse=True).to_list(None)
+    count = await db[ROLLUPS_COL].count_documents({})
+    print(f"Rebuilt {count} rollup documents.")
+    print("--- Rebuild Complete! ---")
+
+if __name__ == "__main__":
+    asyncio.run(rebuild_rollups())
@@ -1,7 +1,8 @@
 import asyncio
 from datetime import time, date, datetime, timezone, timedelta
 from models.class_schedule import Schedule
-from db.connection import init_db
+from db.connection import init_db, get_db
+from core.schedule_index import mark_schedules_changing, mark_schedules_changed
 
 # THIS DATA IS NOW VERIFIED 100% AGAINST THE IMAGE
 correct_schedules_data = [
@@ -40,6 +41,8 @@ correct_schedules_data = [
 async def repopulate_data():
     print("--- Starting Schedule Repopulation Script ---")
     await init_db()
+    # running servers keep their timetable until the new one is complete
+    await mark_schedules_changing(get_db())
     print("Deleting all existing schedules...")
     await Schedule.delete_all()
     print("Preparing new schedule objects...")
@@ -61,7 +64,9 @@ async def repopulate_data():
     
     print("Inserting new documents...")
     await Schedule.insert_many(schedule_objects_to_insert)
+    await mark_schedules_changed(get_db())
     print("--- Repopulation Complete! ---")
+    print("Running servers reload the timetable within a few seconds.")
 
 if __name__ == "__main__":
     asyncio.run(repopulate_data())
\ No newline at end of file
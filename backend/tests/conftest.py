@@ -0,0 +1,29 @@
+import os
+import sys
+
+import pytest
+
+# db.connection creates its client at import; nothing connects unless TEST_MONGO_URI names a
+# test mongod, which only the tests that need a real server use (they are skipped otherwise)
+TEST_MONGO_URI = os.environ.get("TEST_MONGO_URI")
+if TEST_MONGO_URI:
+    os.environ["MONGO_URI"] = TEST_MONGO_URI
+os.environ.setdefault("MONGO_URI", "mongodb://localhost:1")
+os.environ.setdefault("MONGO_DB_NAME", "attendance_test")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def app_state():
+    """Fresh schedule index, student directory, tap debouncer and report cache for one test; the app's are restored after."""
+    from core.report_cache import report_cache
+    from core.schedule_index import schedule_index
+    from core.student_directory import student_directory
+    from core.tap_debounce import tap_debouncer
+
+    saved = [(obj, obj.__dict__) for obj in (schedule_index, student_directory, tap_debouncer, report_cache)]
+    for obj, _ in saved:
+        obj.__dict__ = type(obj)().__dict__
+    yield
+    for obj, state in saved:
+        obj.__dict__ = state
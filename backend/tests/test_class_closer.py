@@ -0,0 +1,57 @@
+import asyncio
+import datetime
+
+from mongomock_motor import AsyncMongoMockClient
+
+from core.class_closer import CLOSURES_COL, WATERMARK_ID, ClassCloser
+from core.schedule_index import ScheduleIndex
+
+
+def index_with_class_that_ended(minutes_ago):
+    end = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None, microsecond=0) - datetime.timedelta(minutes=minutes_ago)
+    start = end - datetime.timedelta(hours=1)
+    index = ScheduleIndex()
+    index.build([{"section": "CC", "day": start.strftime("%a"), "subject": "CC 101", "start_time": start, "end_time": end}])
+    return index
+
+
+async def worker_dies_mid_close():
+    db = AsyncMongoMockClient()["closer"]
+    index = index_with_class_that_ended(minutes_ago=30)
+    await db[CLOSURES_COL].insert_one({"_id": WATERMARK_ID, "until": datetime.datetime.utcnow() - datetime.timedelta(hours=3)})
+    closing = asyncio.Event()
+
+    async def hang(db, section, occurrence):
+        closing.set()
+        await asyncio.Event().wait()
+
+    closed = []
+
+    async def record(db, section, occurrence):
+        closed.append((section, occurrence.schedule.get("subject"), occurrence.start))
+        return 1
+
+    # worker A claims the occurrence and is killed before it finishes
+    a = ClassCloser(hang, index=index, delay_seconds=0, claim_seconds=0.2)
+    task = asyncio.create_task(a.run_once(db))
+    await closing.wait()
+    task.cancel()
+
+    # worker B finds it claimed, skips it and moves the shared watermark past it
+    b = ClassCloser(record, index=index, delay_seconds=0, claim_seconds=0.2)
+    assert await b.run_once(db) == 0
+    assert b.skipped == 1
+
+    # once the claim is older than claim_seconds, B's next round retries it
+    await asyncio.sleep(0.3)
+    assert await b.run_once(db) == 1
+    claim = await db[CLOSURES_COL].find_one({"status": {"$exists": True}})
+    return closed, b, claim
+
+
+def test_an_abandoned_claim_is_retried_after_the_watermark_moved_on():
+    closed, b, claim = asyncio.run(worker_dies_mid_close())
+    assert [(section, subject) for section, subject, _ in closed] == [("CC", "CC 101")]
+    assert closed[0][2].tzinfo is not None
+    assert b.retried == 1
+    assert claim["status"] == "closed" and claim["records_created"] == 1
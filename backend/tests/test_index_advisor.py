@@ -0,0 +1,43 @@
+import argparse
+import asyncio
+import datetime
+import json
+import os
+
+import pytest
+
+import index_advisor
+
+
+def sample():
+    students = [{"student_id_no": f"IA{i:05d}", "rfid_uid": f"IA-{i:04d}", "section": "IA"} for i in range(3)]
+    now = datetime.datetime(2026, 10, 16, tzinfo=datetime.timezone.utc)
+    return {
+        "student": students[0],
+        "student_id": "IA00000",
+        "rfid_uid": "IA-0000",
+        "section": "IA",
+        "section_students": students,
+        "subject": "MATH 101",
+        "subject_code": "MATH 101",
+        "lesson_date": "2026-10-15",
+        "date_from": "2026-10-09",
+        "date_to": "2026-10-16",
+        "device": "reader-IA",
+        "since": now - datetime.timedelta(days=7),
+    }
+
+
+def test_every_query_shape_builds():
+    for shape in index_advisor.QUERY_SHAPES:
+        command = shape.build(sample())
+        assert command.get("find", command.get("aggregate", command.get("distinct"))) == shape.collection, shape.route
+
+
+@pytest.mark.skipif(not os.environ.get("TEST_MONGO_URI"), reason="set TEST_MONGO_URI to a test mongod to explain the query shapes")
+def test_hot_query_shapes_are_served_by_indexes(tmp_path):
+    out = tmp_path / "verdicts.json"
+    args = argparse.Namespace(sections=3, students=20, days=14, max_ratio=10, seed=7, out=str(out), allow_main_db=False)
+    status = asyncio.run(index_advisor.advise(args))
+    failures = [v for v in json.loads(out.read_text()) if v["hot"] and v["problems"]]
+    assert status == 0, failures
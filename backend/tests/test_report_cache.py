@@ -0,0 +1,33 @@
+import asyncio
+
+import httpx
+
+from main import app
+from api.attendance_utils import get_mongo_db
+from test_tap_concurrency import FakeCollection, FakeCursor, FakeDb
+
+
+class Rollups(FakeCollection):
+    def aggregate(self, pipeline, **kwargs):
+        return FakeCursor(lambda: self._call(0, []))
+
+
+class RollupsDb(FakeDb):
+    def __getitem__(self, name):
+        return Rollups(self, name)
+
+
+async def summaries(*subjects):
+    app.dependency_overrides[get_mongo_db] = lambda: RollupsDb()
+    try:
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+            return [await client.get("/reports/attendance-summary", params={"subject": subject}) for subject in subjects]
+    finally:
+        app.dependency_overrides.pop(get_mongo_db, None)
+
+
+def test_a_cached_summary_echoes_the_subject_as_requested(app_state):
+    first, second = asyncio.run(summaries("Math", "MATH"))
+    assert first.json()["report_details"].endswith("Math")
+    assert second.json()["report_details"].endswith("MATH")
+    assert first.headers["etag"] != second.headers["etag"]
@@ -0,0 +1,36 @@
+import asyncio
+
+import httpx
+
+from main import app
+from api.attendance_utils import get_mongo_db, rollup_sync
+from core.schedule_index import schedule_index
+from test_tap_concurrency import FakeCollection, FakeDb, class_in_session_now
+
+
+class RollupsDown(FakeCollection):
+    async def bulk_write(self, ops, **kwargs):
+        raise RuntimeError("rollups unavailable")
+
+
+class RollupsDownDb(FakeDb):
+    def __getitem__(self, name):
+        return (RollupsDown if name == "attendance_rollups" else FakeCollection)(self, name)
+
+
+async def tap(db, card):
+    app.dependency_overrides[get_mongo_db] = lambda: db
+    schedule_index.build([class_in_session_now()])
+    try:
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+            return await client.post("/attendance/rfid", params={"rfid_uid": card})
+    finally:
+        app.dependency_overrides.pop(get_mongo_db, None)
+
+
+def test_a_failed_rollup_write_does_not_fail_a_committed_tap(app_state):
+    failures = rollup_sync.failures
+    response = asyncio.run(tap(RollupsDownDb(), "CARD0039"))
+    assert response.status_code == 200, response.text
+    assert response.json()["doc"]["student_id"] == "CONC00039"
+    assert rollup_sync.failures == failures + 1
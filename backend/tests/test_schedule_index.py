@@ -0,0 +1,55 @@
+import asyncio
+import datetime
+
+from mongomock_motor import AsyncMongoMockClient
+
+from bench_schedule_index import compare
+from core.schedule_index import ScheduleIndex, mark_schedules_changed, mark_schedules_changing
+
+
+def schedule(section, subject, hour):
+    start = datetime.datetime(1970, 1, 1, hour)
+    return {"section": section, "day": "Mon", "subject": subject, "start_time": start, "end_time": start + datetime.timedelta(hours=1)}
+
+
+def test_index_matches_the_old_scan():
+    result = compare(schedules=300, sections=10, instants=5000, seed=11)
+    assert result["active"] > 0
+    assert result["mismatches"] == []
+
+
+def test_refresh_waits_for_a_rewrite_to_finish():
+    async def scenario():
+        db = AsyncMongoMockClient()["schedule_index_test"]
+        await db["class_schedules"].insert_one(schedule("A", "OLD", 8))
+        index = ScheduleIndex()
+        await index.load(db)
+
+        # repopulate.py between its delete and its insert
+        await mark_schedules_changing(db)
+        await db["class_schedules"].delete_many({})
+        assert await index.refresh(db) is False
+        assert index.size == 1
+
+        await db["class_schedules"].insert_one(schedule("A", "NEW", 9))
+        await mark_schedules_changed(db)
+        assert await index.refresh(db) is True
+        monday_nine = datetime.datetime(2026, 10, 12, 9, 30, tzinfo=datetime.timezone.utc)
+        assert index.lookup("A", monday_nine).schedule["subject"] == "NEW"
+        assert await index.refresh(db) is False
+
+    asyncio.run(scenario())
+
+
+def test_unsignalled_reload_keeps_the_index_when_the_collection_is_empty():
+    async def scenario():
+        db = AsyncMongoMockClient()["schedule_index_test"]
+        await db["class_schedules"].insert_one(schedule("A", "OLD", 8))
+        index = ScheduleIndex()
+        await index.load(db)
+        await db["class_schedules"].delete_many({})
+        assert await index.load(db, allow_empty=False) == 1
+        assert index.kept_on_empty == 1
+        assert index.lookup("A", datetime.datetime(2026, 10, 12, 8, 30, tzinfo=datetime.timezone.utc)) is not None
+
+    asyncio.run(scenario())
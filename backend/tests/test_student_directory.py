@@ -0,0 +1,30 @@
+import asyncio
+
+from mongomock_motor import AsyncMongoMockClient
+
+from core.student_directory import StudentDirectory, signal_students_changed
+
+
+async def card_reassigned_by_another_worker():
+    db = AsyncMongoMockClient()["directory"]
+    await db["students"].insert_one({"rfid_uid": "CARD1", "student_id_no": "S001", "section": "A"})
+    writer, other = StudentDirectory(), StudentDirectory()
+    await writer.load(db)
+    await other.load(db)
+    assert (await other.get_by_rfid(db, "CARD1"))["student_id_no"] == "S001"
+
+    # the writer's process moves the card to another student
+    await db["students"].update_one({"student_id_no": "S001"}, {"$set": {"rfid_uid": "CARD9"}})
+    await db["students"].insert_one({"rfid_uid": "CARD1", "student_id_no": "S002", "section": "A"})
+    writer.invalidate(rfid_uid="CARD1", student_id_no="S001")
+    await signal_students_changed(db)
+
+    cleared = await other.refresh(db)
+    return cleared, await other.get_by_rfid(db, "CARD1"), await other.refresh(db)
+
+
+def test_other_workers_drop_their_directory_on_the_change_signal():
+    cleared, student, cleared_again = asyncio.run(card_reassigned_by_another_worker())
+    assert cleared
+    assert student["student_id_no"] == "S002"
+    assert not cleared_again
@@ -0,0 +1,45 @@
+import asyncio
+
+from mongomock_motor import AsyncMongoMockClient
+from pymongo import ASCENDING, IndexModel
+
+from api.attendance_utils import COL_NAME, TAP_EVENTS_COL, propagate_student_edit
+
+
+def record(student_id, lesson_date, subject, time_in, **extra):
+    return {"student_id": student_id, "lesson_date": lesson_date, "subject": subject, "time_in": time_in, "time_out": None, **extra}
+
+
+async def edit_after_same_day_tap():
+    db = AsyncMongoMockClient()["edit"]
+    await db[COL_NAME].create_indexes([
+        IndexModel([("student_id", ASCENDING), ("lesson_date", ASCENDING), ("subject", ASCENDING)], unique=True),
+    ])
+    await db[COL_NAME].insert_many([
+        record("OLD001", "2026-10-14", "MATH 101", "2026-10-14T00:05:00Z"),
+        record("OLD001", "2026-10-15", "MATH 101", "2026-10-15T00:02:00Z"),
+        record("OLD001", "2026-10-15", "SCI 102", "2026-10-15T01:01:00Z"),
+    ])
+    # the ID was corrected mid-class: the next tap and the class closer wrote under the new ID
+    await db[COL_NAME].insert_many([
+        record("NEW001", "2026-10-15", "MATH 101", "2026-10-15T00:40:00Z"),
+        record("NEW001", "2026-10-15", "SCI 102", None, status="Absent"),
+    ])
+    job = {"params": {"old_student_id_no": "OLD001", "student_id_no": "NEW001", "student_name": "New Name", "section": "A"}}
+    while job.get("phase") != TAP_EVENTS_COL:
+        progress = await propagate_student_edit(db, job, batch_size=2)
+        job.update(phase=progress["phase"], last_id=progress["last_id"])
+    return await db[COL_NAME].find({}, {"_id": 0}).sort([("lesson_date", 1), ("subject", 1)]).to_list(None)
+
+
+def test_an_id_change_after_a_same_day_tap_keeps_one_record_per_lesson():
+    records = asyncio.run(edit_after_same_day_tap())
+    assert [(r["student_id"], r["lesson_date"], r["subject"]) for r in records] == [
+        ("NEW001", "2026-10-14", "MATH 101"),
+        ("NEW001", "2026-10-15", "MATH 101"),
+        ("NEW001", "2026-10-15", "SCI 102"),
+    ]
+    # the earliest tap of the lesson wins over a later one, a tap over a closer absence
+    assert records[1]["time_in"] == "2026-10-15T00:02:00Z"
+    assert records[2]["time_in"] == "2026-10-15T01:01:00Z"
+    assert all(r["student_name"] == "New Name" for r in records)
@@ -0,0 +1,97 @@
+import asyncio
+import datetime
+import time
+
+import httpx
+
+from main import app
+from api.attendance_utils import get_mongo_db
+from core.schedule_index import schedule_index
+from core.tap_debounce import tap_debouncer
+
+REPORT_SECONDS = 1.5
+QUERY_SECONDS = 0.005
+
+
+class FakeCursor:
+    def __init__(self, run):
+        self._run = run
+
+    async def to_list(self, length=None):
+        return await self._run()
+
+
+class FakeCollection:
+    """Collection whose calls take a fixed server time, off the event loop like Motor's."""
+
+    def __init__(self, db, name):
+        self.db = db
+        self.name = name
+
+    async def _call(self, seconds, result):
+        await asyncio.get_running_loop().run_in_executor(None, time.sleep, seconds)
+        return result
+
+    async def find_one(self, filt, *args, **kwargs):
+        return await self._call(QUERY_SECONDS, self.db.students.get(filt.get("rfid_uid")))
+
+    async def find_one_and_update(self, filt, update, **kwargs):
+        now = datetime.datetime.now(datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+        doc = {**filt, "section": "CONC", "time_in": now, "time_out": None, "late": False, "status": "Present", "breaks": []}
+        return await self._call(QUERY_SECONDS, doc)
+
+    async def bulk_write(self, ops, **kwargs):
+        return await self._call(QUERY_SECONDS, None)
+
+    def aggregate(self, pipeline, **kwargs):
+        # the whole-school summary: seconds of server time
+        return FakeCursor(lambda: self._call(REPORT_SECONDS, []))
+
+
+class FakeDb:
+    def __init__(self):
+        self.students = {
+            f"CARD{i:04d}": {"_id": i, "rfid_uid": f"CARD{i:04d}", "student_id_no": f"CONC{i:05d}", "section": "CONC", "first_name": "Con", "last_name": f"Current{i}"}
+            for i in range(40)
+        }
+
+    def __getitem__(self, name):
+        return FakeCollection(self, name)
+
+
+def class_in_session_now():
+    now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+    start = now - datetime.timedelta(minutes=5)
+    return {"section": "CONC", "day": now.strftime("%a"), "subject": "CONC 101", "start_time": start, "end_time": start + datetime.timedelta(hours=1)}
+
+
+async def taps_during_report(db):
+    """Per-tap latencies, and seconds from starting the report until the last tap answered."""
+    app.dependency_overrides[get_mongo_db] = lambda: db
+    schedule_index.build([class_in_session_now()])
+    transport = httpx.ASGITransport(app=app)
+    try:
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            started = time.perf_counter()
+            report = asyncio.create_task(client.get("/reports/attendance-summary", params={"section": "CONC"}))
+            await asyncio.sleep(0.1)  # the report is now waiting on MongoDB
+            latencies = []
+            for card in list(db.students)[:20]:
+                t0 = time.perf_counter()
+                response = await client.post("/attendance/rfid", params={"rfid_uid": card})
+                latencies.append(time.perf_counter() - t0)
+                assert response.status_code == 200, response.text
+            taps_done = time.perf_counter() - started
+            report_response = await report
+    finally:
+        app.dependency_overrides.pop(get_mongo_db, None)
+    assert report_response.status_code == 200
+    return latencies, taps_done
+
+
+def test_taps_stay_fast_while_a_heavy_report_runs(app_state):
+    latencies, taps_done = asyncio.run(taps_during_report(FakeDb()))
+    # all 20 taps answered while the 1.5 s report was still running, each within a few query times
+    assert taps_done < REPORT_SECONDS
+    assert max(latencies) < 0.25
+    assert tap_debouncer.suppressed == 0